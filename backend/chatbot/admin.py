@@ -9,10 +9,18 @@ from . import models
 class ConversationAdmin(BaseAdmin):
     """Conversation inf admin UI built from django."""
 
-    list_display = ["id", "name", "record_file_s3_key"]
+    list_display = ["id", "name", "record_file_s3_key", "message_count", "last_message_at"]
     search_fields = ["name", "record_file_s3_key"]
 
 
+@admin.register(models.Assistant)
+class AssistantAdmin(BaseAdmin):
+    """Assistant inf admin UI built from django."""
+
+    list_display = ["id", "assistant_id", "model", "content_hash"]
+    search_fields = ["assistant_id", "content_hash"]
+
+
 @admin.register(models.Message)
 class MessageAdmin(BaseAdmin):
     """Message inf admin UI built from django."""
@@ -1,21 +1,29 @@
 from typing import Any
 from uuid import UUID
 
+from django.conf import settings
 from django.core.handlers.wsgi import WSGIRequest
+from django.http import HttpRequest
+from django.http import StreamingHttpResponse
 from ninja import Form
+from ninja import Query
 from ninja.files import UploadedFile
 from ninja_extra import api_controller
 from ninja_extra import route
 from ninja_extra.permissions import IsAuthenticated
-from ninja_jwt.authentication import JWTAuth
 
 from core import exceptions as core_exceptions
 from core import schemas as core_schemas
 from core import utils as core_utils
+from core.authentication import CustomAsyncJWTAuth
+from core.authentication import CustomAsyncJWTTokenUserAuth
+from core.authentication import CustomJWTAuth
+from core.authentication import CustomJWTTokenUserAuth
 from core.models import BaseModel
 
 from . import models
 from . import schemas
+from . import utils
 
 
 conversation_crud_controller = core_utils.generate_crud_controller(
@@ -30,12 +38,13 @@ message_crud_controller = core_utils.generate_crud_controller(
     model_name="Message",
     controller_prefix="message",
     application_schemas=schemas,
+    owned_relations=("conversation",),
 )
 
 
 @api_controller(
     prefix_or_class="chatbot",
-    auth=JWTAuth(),
+    auth=CustomJWTAuth(),
     tags=["chatbot"],
     permissions=[IsAuthenticated],
 )
@@ -45,7 +54,7 @@ class ChatbotApiController:
     @route.post(
         "",
         response={
-            200: schemas.CreateConversationSchema,
+            200: schemas.GetConversationResponseSchema,
             401: core_schemas.Http401UnauthorizedSchema,
             404: core_schemas.Http404NotFoundSchema,
         },
@@ -58,29 +67,7 @@ class ChatbotApiController:
         target: Form[str],
     ) -> Any:
         """Create a new chatbot conversation."""
-        with file.open() as f:
-            record = f.file.read().decode("utf-8")
-
-        if record == "":
-            assistant = core_utils.OPENAI_CLIENT.beta.assistants.create(
-                name=name,
-                instructions="",
-                model="gpt-4o-2024-11-20",
-            )
-        else:
-            assistant = core_utils.OPENAI_CLIENT.beta.assistants.create(
-                name=name,
-                instructions=f"Your conversation with the chatbot. you need to reply message like style of following record content {target}'s role\n\n {record}",
-                model="gpt-4o-2024-11-20",
-            )
-
-        conversation = models.Conversation(
-            name=name,
-            record_file_s3_key=file.name,
-            assistant_id=assistant.id,
-        )
-        conversation.create(request.user)  # type: ignore
-        return conversation
+        return utils.create_conversation(request.user, name, file, target)  # type: ignore
 
     @route.delete(
         "/{conversation_id}",
@@ -96,25 +83,47 @@ class ChatbotApiController:
         conversation_id: UUID,
     ) -> Any:
         """Delete a chatbot conversation."""
-        try:
-            conversation = models.Conversation.objects.get(id=conversation_id)
-        except models.Conversation.DoesNotExist as err:
-            raise core_exceptions.Http404NotFoundException from err
-
-        conversation.delete(request.user)  # type: ignore
-        return conversation
+        return utils.delete_conversation(request.user, conversation_id)  # type: ignore
 
     @route.get(
         "",
+        auth=CustomJWTTokenUserAuth(),
+        response={
+            200: schemas.ConversationPageResponseSchema,
+            401: core_schemas.Http401UnauthorizedSchema,
+            404: core_schemas.Http404NotFoundSchema,
+        },
+    )
+    def list_chatbot(
+        self,
+        request: WSGIRequest,
+        name: Query[str | None] = None,
+        order: Query[schemas.ConversationOrdering] = "recent",
+        after: Query[str | None] = None,
+        limit: Query[int] = 20,
+    ):
+        """List a page of chatbot conversations with their last message preview and unread count.
+
+        Pass the returned `after` cursor to get the next page.
+        """
+        return utils.list_conversations(request.user.id, name=name, order=order, after=after, limit=limit)  # type: ignore
+
+    @route.put(
+        "/{conversation_id}/read",
+        auth=CustomJWTTokenUserAuth(),
         response={
-            200: list[schemas.GetConversationResponseSchema],
+            200: schemas.ConversationReadResponseSchema,
             401: core_schemas.Http401UnauthorizedSchema,
             404: core_schemas.Http404NotFoundSchema,
         },
     )
-    def list_chatbot(self, request: WSGIRequest):
-        """List chatbot conversations."""
-        return models.Conversation.objects.filter(created_by_user=request.user).order_by("name").values()
+    def read_chatbot(
+        self,
+        request: WSGIRequest,
+        conversation_id: UUID,
+    ) -> dict:
+        """Mark a chatbot conversation as read, resetting its unread count."""
+        return utils.mark_conversation_read(request.user.id, conversation_id)  # type: ignore
 
     @route.put(
         "/{conversation_id}",
@@ -131,20 +140,14 @@ class ChatbotApiController:
         body: schemas.PutConversationNameRequestSchema,
     ):
         """Update the name of a chatbot conversation."""
-        try:
-            conversation = models.Conversation.objects.get(id=conversation_id)
-        except models.Conversation.DoesNotExist as err:
-            raise core_exceptions.Http404NotFoundException from err
-
-        conversation.name = body.name  # type: ignore
-        conversation.save(request.user)  # type: ignore
-
-        return conversation
+        return utils.rename_conversation(request.user, conversation_id, body.name)  # type: ignore
 
     @route.get(
         "/{conversation_id}",
+        auth=CustomJWTTokenUserAuth(),
         response={
-            200: list[schemas.MessageResponseSchema],
+            200: schemas.MessagePageResponseSchema,
+            400: core_schemas.Http400BadRequestSchema,
             401: core_schemas.Http401UnauthorizedSchema,
             404: core_schemas.Http404NotFoundSchema,
         },
@@ -153,19 +156,45 @@ class ChatbotApiController:
         self,
         request: WSGIRequest,  # noqa: ARG002
         conversation_id: UUID,
+        before: Query[str | None] = None,
+        after: Query[str | None] = None,
+        limit: Query[int] = 50,
     ):
-        """List messages in a chatbot conversation."""
-        try:
-            conversation = models.Conversation.objects.get(id=conversation_id)
-        except models.Conversation.DoesNotExist as err:
-            raise core_exceptions.Http404NotFoundException from err
+        """List a page of messages in a chatbot conversation.
 
-        return models.Message.objects.filter(conversation=conversation).order_by("created_at").values()
+        Without cursors the page holds the latest messages, `before`/`after` page to older/newer messages.
+        """
+        return utils.list_messages(conversation_id, before=before, after=after, limit=limit)
+
+    @route.get(
+        "/{conversation_id}/sync",
+        auth=CustomJWTTokenUserAuth(),
+        response={
+            200: schemas.MessageSyncResponseSchema,
+            400: core_schemas.Http400BadRequestSchema,
+            401: core_schemas.Http401UnauthorizedSchema,
+            404: core_schemas.Http404NotFoundSchema,
+        },
+    )
+    def sync_messages(
+        self,
+        request: WSGIRequest,  # noqa: ARG002
+        conversation_id: UUID,
+        watermark: Query[str | None] = None,
+        limit: Query[int] = 100,
+    ):
+        """Sync the messages created, edited or deleted since a watermark, with the conversation state.
+
+        Pass the returned `watermark` to the next call, keep calling while `has_more` is true. Recently
+        changed messages are returned again by the next sync, upsert them by id.
+        """
+        return utils.sync_messages(conversation_id, watermark=watermark, limit=limit)
 
     @route.post(
         "/{conversation_id}",
         response={
             200: schemas.MessageResponseSchema,
+            400: core_schemas.Http400BadRequestSchema,
             401: core_schemas.Http401UnauthorizedSchema,
             404: core_schemas.Http404NotFoundSchema,
         },
@@ -177,21 +206,11 @@ class ChatbotApiController:
         body: schemas.PutMessageSchema,
     ) -> BaseModel:
         """Post a message to a chatbot conversation."""
-        try:
-            conversation = models.Conversation.objects.get(id=conversation_id)
-        except models.Conversation.DoesNotExist as err:
-            raise core_exceptions.Http404NotFoundException from err
-
-        message = models.Message(
-            conversation=conversation,
-            text=body.text,  # type: ignore
-        )
-        message.save(request.user)  # type: ignore
-
-        return message
+        return utils.post_message(request.user, conversation_id, body.text)  # type: ignore
 
     @route.get(
         "/{conversation_id}/state",
+        auth=CustomJWTTokenUserAuth(),
         response={
             200: schemas.ChatbotStateResponseSchema,
             401: core_schemas.Http401UnauthorizedSchema,
@@ -204,9 +223,308 @@ class ChatbotApiController:
         conversation_id: UUID,
     ) -> dict:
         """Get the state of the chatbot conversation."""
-        try:
-            conversation = models.Conversation.objects.get(id=conversation_id)
-        except models.Conversation.DoesNotExist as err:
-            raise core_exceptions.Http404NotFoundException from err
+        return utils.get_conversation_state(conversation_id)
+
+    @route.get(
+        "/{conversation_id}/state/wait",
+        auth=CustomAsyncJWTTokenUserAuth(),
+        response={
+            200: schemas.ChatbotStateResponseSchema,
+            401: core_schemas.Http401UnauthorizedSchema,
+            404: core_schemas.Http404NotFoundSchema,
+        },
+    )
+    async def wait_chatbot_state(
+        self,
+        request: HttpRequest,  # noqa: ARG002
+        conversation_id: UUID,
+        state: Query[models.Conversation.State | None] = None,
+        max_wait: float = Query(25, alias="timeout"),
+    ) -> dict:
+        """Long-poll the state of the chatbot conversation.
+
+        Responds as soon as the state differs from `state`, or with the current state after `timeout` seconds.
+        """
+        current_state = await utils.wait_for_state_change(
+            conversation_id,
+            state,
+            min(max(max_wait, 0), settings.CHATBOT_STATE_WAIT_MAX_SECONDS),
+        )
+        if current_state is None:
+            raise core_exceptions.Http404NotFoundException
+
+        return {"state": current_state}
+
+    @route.get(
+        "/{conversation_id}/stream",
+        auth=CustomAsyncJWTTokenUserAuth(),
+        response={
+            401: core_schemas.Http401UnauthorizedSchema,
+            404: core_schemas.Http404NotFoundSchema,
+        },
+    )
+    async def stream_chatbot_reply(
+        self,
+        request: HttpRequest,  # noqa: ARG002
+        conversation_id: UUID,
+    ) -> StreamingHttpResponse:
+        """Stream the pending chatbot reply of a conversation as Server-Sent-Events."""
+        if not await models.Conversation.objects.filter(id=conversation_id).aexists():
+            raise core_exceptions.Http404NotFoundException
+
+        response = StreamingHttpResponse(
+            utils.reply_event_stream(conversation_id),
+            content_type="text/event-stream",
+        )
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+
+@api_controller(
+    prefix_or_class="async/chatbot",
+    auth=CustomAsyncJWTAuth(),
+    tags=["chatbot (async)"],
+    permissions=[IsAuthenticated],
+)
+class AsyncChatbotApiController:
+    """Chatbot API controller for ASGI deployments.
+
+    Routes use the async ORM and the asynchronous LLM provider, a worker can wait on many slow OpenAI calls
+    without holding a thread for each of them.
+    """
+
+    @route.post(
+        "",
+        response={
+            200: schemas.GetConversationResponseSchema,
+            401: core_schemas.Http401UnauthorizedSchema,
+            404: core_schemas.Http404NotFoundSchema,
+        },
+    )
+    async def new_chatbot(
+        self,
+        request: HttpRequest,
+        name: Form[str],
+        file: UploadedFile,
+        target: Form[str],
+    ) -> Any:
+        """Create a new chatbot conversation."""
+        return await utils.acreate_conversation(request.user, name, file, target)  # type: ignore
+
+    @route.delete(
+        "/{conversation_id}",
+        response={
+            200: schemas.DeleteConversationSchema,
+            401: core_schemas.Http401UnauthorizedSchema,
+            404: core_schemas.Http404NotFoundSchema,
+        },
+    )
+    async def delete_chatbot(
+        self,
+        request: HttpRequest,
+        conversation_id: UUID,
+    ) -> Any:
+        """Delete a chatbot conversation."""
+        return await utils.adelete_conversation(request.user, conversation_id)  # type: ignore
+
+    @route.get(
+        "",
+        auth=CustomAsyncJWTTokenUserAuth(),
+        response={
+            200: schemas.ConversationPageResponseSchema,
+            401: core_schemas.Http401UnauthorizedSchema,
+            404: core_schemas.Http404NotFoundSchema,
+        },
+    )
+    async def list_chatbot(
+        self,
+        request: HttpRequest,
+        name: Query[str | None] = None,
+        order: Query[schemas.ConversationOrdering] = "recent",
+        after: Query[str | None] = None,
+        limit: Query[int] = 20,
+    ):
+        """List a page of chatbot conversations with their last message preview and unread count.
 
-        return {"state": conversation.state}
+        Pass the returned `after` cursor to get the next page.
+        """
+        return await utils.alist_conversations(
+            request.user.id,  # type: ignore
+            name=name,
+            order=order,
+            after=after,
+            limit=limit,
+        )
+
+    @route.put(
+        "/{conversation_id}/read",
+        auth=CustomAsyncJWTTokenUserAuth(),
+        response={
+            200: schemas.ConversationReadResponseSchema,
+            401: core_schemas.Http401UnauthorizedSchema,
+            404: core_schemas.Http404NotFoundSchema,
+        },
+    )
+    async def read_chatbot(
+        self,
+        request: HttpRequest,
+        conversation_id: UUID,
+    ) -> dict:
+        """Mark a chatbot conversation as read, resetting its unread count."""
+        return await utils.amark_conversation_read(request.user.id, conversation_id)  # type: ignore
+
+    @route.put(
+        "/{conversation_id}",
+        response={
+            200: schemas.PutConversationNameResponseSchema,
+            401: core_schemas.Http401UnauthorizedSchema,
+            404: core_schemas.Http404NotFoundSchema,
+        },
+    )
+    async def update_chatbot(
+        self,
+        request: HttpRequest,
+        conversation_id: UUID,
+        body: schemas.PutConversationNameRequestSchema,
+    ):
+        """Update the name of a chatbot conversation."""
+        return await utils.arename_conversation(request.user, conversation_id, body.name)  # type: ignore
+
+    @route.get(
+        "/{conversation_id}",
+        auth=CustomAsyncJWTTokenUserAuth(),
+        response={
+            200: schemas.MessagePageResponseSchema,
+            400: core_schemas.Http400BadRequestSchema,
+            401: core_schemas.Http401UnauthorizedSchema,
+            404: core_schemas.Http404NotFoundSchema,
+        },
+    )
+    async def list_messages(
+        self,
+        request: HttpRequest,  # noqa: ARG002
+        conversation_id: UUID,
+        before: Query[str | None] = None,
+        after: Query[str | None] = None,
+        limit: Query[int] = 50,
+    ):
+        """List a page of messages in a chatbot conversation.
+
+        Without cursors the page holds the latest messages, `before`/`after` page to older/newer messages.
+        """
+        return await utils.alist_messages(conversation_id, before=before, after=after, limit=limit)
+
+    @route.get(
+        "/{conversation_id}/sync",
+        auth=CustomAsyncJWTTokenUserAuth(),
+        response={
+            200: schemas.MessageSyncResponseSchema,
+            400: core_schemas.Http400BadRequestSchema,
+            401: core_schemas.Http401UnauthorizedSchema,
+            404: core_schemas.Http404NotFoundSchema,
+        },
+    )
+    async def sync_messages(
+        self,
+        request: HttpRequest,  # noqa: ARG002
+        conversation_id: UUID,
+        watermark: Query[str | None] = None,
+        limit: Query[int] = 100,
+    ):
+        """Sync the messages created, edited or deleted since a watermark, with the conversation state.
+
+        Pass the returned `watermark` to the next call, keep calling while `has_more` is true. Recently
+        changed messages are returned again by the next sync, upsert them by id.
+        """
+        return await utils.async_messages(conversation_id, watermark=watermark, limit=limit)
+
+    @route.post(
+        "/{conversation_id}",
+        response={
+            200: schemas.MessageResponseSchema,
+            400: core_schemas.Http400BadRequestSchema,
+            401: core_schemas.Http401UnauthorizedSchema,
+            404: core_schemas.Http404NotFoundSchema,
+        },
+    )
+    async def post_message(
+        self,
+        request: HttpRequest,
+        conversation_id: UUID,
+        body: schemas.PutMessageSchema,
+    ) -> BaseModel:
+        """Post a message to a chatbot conversation."""
+        return await utils.apost_message(request.user, conversation_id, body.text)  # type: ignore
+
+    @route.get(
+        "/{conversation_id}/state",
+        auth=CustomAsyncJWTTokenUserAuth(),
+        response={
+            200: schemas.ChatbotStateResponseSchema,
+            401: core_schemas.Http401UnauthorizedSchema,
+            404: core_schemas.Http404NotFoundSchema,
+        },
+    )
+    async def get_chatbot_state(
+        self,
+        request: HttpRequest,  # noqa: ARG002
+        conversation_id: UUID,
+    ) -> dict:
+        """Get the state of the chatbot conversation."""
+        return await utils.aget_conversation_state(conversation_id)
+
+    @route.get(
+        "/{conversation_id}/state/wait",
+        auth=CustomAsyncJWTTokenUserAuth(),
+        response={
+            200: schemas.ChatbotStateResponseSchema,
+            401: core_schemas.Http401UnauthorizedSchema,
+            404: core_schemas.Http404NotFoundSchema,
+        },
+    )
+    async def wait_chatbot_state(
+        self,
+        request: HttpRequest,  # noqa: ARG002
+        conversation_id: UUID,
+        state: Query[models.Conversation.State | None] = None,
+        max_wait: float = Query(25, alias="timeout"),
+    ) -> dict:
+        """Long-poll the state of the chatbot conversation.
+
+        Responds as soon as the state differs from `state`, or with the current state after `timeout` seconds.
+        """
+        current_state = await utils.wait_for_state_change(
+            conversation_id,
+            state,
+            min(max(max_wait, 0), settings.CHATBOT_STATE_WAIT_MAX_SECONDS),
+        )
+        if current_state is None:
+            raise core_exceptions.Http404NotFoundException
+
+        return {"state": current_state}
+
+    @route.get(
+        "/{conversation_id}/stream",
+        auth=CustomAsyncJWTTokenUserAuth(),
+        response={
+            401: core_schemas.Http401UnauthorizedSchema,
+            404: core_schemas.Http404NotFoundSchema,
+        },
+    )
+    async def stream_chatbot_reply(
+        self,
+        request: HttpRequest,  # noqa: ARG002
+        conversation_id: UUID,
+    ) -> StreamingHttpResponse:
+        """Stream the pending chatbot reply of a conversation as Server-Sent-Events."""
+        if not await models.Conversation.objects.filter(id=conversation_id).aexists():
+            raise core_exceptions.Http404NotFoundException
+
+        response = StreamingHttpResponse(
+            utils.reply_event_stream(conversation_id),
+            content_type="text/event-stream",
+        )
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"
+        return response
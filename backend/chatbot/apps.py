@@ -8,4 +8,5 @@ class ChatbotConfig(AppConfig):
     name = "chatbot"
 
     def ready(self):  # noqa: D102
+        from . import checks  # noqa: F401
         from . import signals  # noqa: F401
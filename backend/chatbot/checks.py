@@ -0,0 +1,30 @@
+from typing import Any
+
+from django.conf import settings
+from django.core.checks import Error
+from django.core.checks import register
+from django.utils.module_loading import import_string
+
+from core.providers import FakeLLMProvider
+
+
+@register()
+def check_run_poller_provider(app_configs: Any, **kwargs: Any) -> list[Error]:  # noqa: ARG001
+    """Reject the run poller with the fake provider.
+
+    The runs of the fake provider only live in the memory of the celery worker that started them, the
+    `run_reply_poller` process would never find them.
+
+    Returns:
+        list[Error]: the configuration error, if any.
+    """
+    if not settings.CHATBOT_RUN_POLLER or not issubclass(import_string(settings.LLM_PROVIDER_BACKEND), FakeLLMProvider):
+        return []
+    return [
+        Error(
+            "CHATBOT_RUN_POLLER cannot be used with the fake LLM provider.",
+            hint="Unset CHATBOT_RUN_POLLER, the fake provider keeps its threads and runs in process memory.",
+            obj="settings.CHATBOT_RUN_POLLER",
+            id="chatbot.E001",
+        ),
+    ]
@@ -0,0 +1,215 @@
+import codecs
+import hashlib
+import heapq
+import re
+from collections.abc import Iterable
+from collections.abc import Iterator
+from dataclasses import dataclass
+
+from django.conf import settings
+
+
+# `SPEAKER<colon>text` with an ascii or fullwidth colon as in record.txt, optionally behind a WhatsApp style
+# "12/01/2024, 10:00 - " timestamp.
+COLON_TURN_PATTERN = re.compile(
+    r"^(?P<timestamp>\[?[\d/.\-]+,?\s+\d{1,2}:\d{2}(?::\d{2})?(?:\s?[APap][Mm])?\]?\s*-?\s*)?"
+    r"(?P<speaker>[^:：\t]{1,64}?)\s*[:：]\s*(?P<text>.*)$",
+)
+# LINE exports: "10:00\tSPEAKER\ttext".
+TAB_TURN_PATTERN = re.compile(r"^\d{1,2}:\d{2}\t(?P<speaker>[^\t]{1,64})\t(?P<text>.*)$")
+
+MAX_LINE_CHARS = 4096
+MAX_TURN_CHARS = 2048
+IDEAL_TURN_CHARS = 40
+# a chat has at least two speakers, past them untimestamped `xx: yy` lines of unknown speakers are message text
+MIN_SPEAKERS = 2
+
+
+@dataclass
+class RecordDigest:
+    """Result of ingesting a chat record.
+
+    Attributes:
+        sha256 (str): hex sha256 of the raw record bytes.
+        excerpt (str): the selected turns of the target speaker in record order, or the head of the record
+            when none could be selected.
+    """
+
+    sha256: str
+    excerpt: str
+
+
+def iter_lines(chunks: Iterable[bytes]) -> Iterator[str]:
+    """Decode utf-8 chunks incrementally and split them into lines.
+
+    Lines longer than MAX_LINE_CHARS are truncated, so memory use does not depend on the input.
+
+    Args:
+        chunks (Iterable[bytes]): raw record chunks.
+
+    Yields:
+        str: lines without their line break.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    buffer = ""
+
+    for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        yield from (line.rstrip("\r")[:MAX_LINE_CHARS] for line in lines)
+        buffer = buffer[:MAX_LINE_CHARS]
+
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer.rstrip("\r")[:MAX_LINE_CHARS]
+
+
+def starts_turn(match: re.Match | None, speakers: set[str]) -> bool:
+    """Tell whether a matched record line starts a new turn rather than continuing a multi-line message.
+
+    Export formats with timestamps are unambiguous. Without one, a `xx: yy` line only starts a turn for a
+    speaker already seen, or while fewer than MIN_SPEAKERS speakers are known.
+
+    Args:
+        match (re.Match | None): match of the line against the turn patterns.
+        speakers (set[str]): speakers seen so far.
+
+    Returns:
+        bool: whether the line starts a turn.
+    """
+    if match is None:
+        return False
+    if match.re is TAB_TURN_PATTERN or match["timestamp"]:
+        return True
+    return match["speaker"].strip() in speakers or len(speakers) < MIN_SPEAKERS
+
+
+def iter_turns(lines: Iterable[str], speakers: Iterable[str] = ()) -> Iterator[tuple[str, str]]:
+    """Group record lines into speaker turns.
+
+    Lines that do not start a turn, see `starts_turn`, continue the previous turn.
+
+    Args:
+        lines (Iterable[str]): record lines.
+        speakers (Iterable[str], optional): speakers known to take part, e.g. the target. Defaults to none.
+
+    Yields:
+        tuple[str, str]: speaker and text of each turn.
+    """
+    speakers = set(speakers)
+    speaker, text = None, ""
+
+    for line in lines:
+        match = TAB_TURN_PATTERN.match(line) or COLON_TURN_PATTERN.match(line)
+        if not starts_turn(match, speakers):
+            if speaker is not None and line.strip():
+                text = f"{text}\n{line}"[:MAX_TURN_CHARS]
+            continue
+
+        if speaker is not None:
+            yield speaker, text
+        speaker, text = match["speaker"].strip(), match["text"][:MAX_TURN_CHARS]  # type: ignore
+        speakers.add(speaker)
+
+    if speaker is not None:
+        yield speaker, text
+
+
+def estimate_tokens(text: str) -> int:
+    """Roughly estimate the number of tokens of a text.
+
+    CJK characters are about one token each, other text about four characters per token.
+
+    Args:
+        text (str): text to estimate.
+
+    Returns:
+        int: estimated number of tokens.
+    """
+    wide = sum(1 for char in text if ord(char) > 0x7F)  # noqa: PLR2004
+    return wide + (len(text) - wide) // 4 + 1
+
+
+def score_turn(text: str, *, has_prompt: bool) -> float:
+    """Score how representative a turn is of its speaker's style.
+
+    Short acknowledgements and long pastes say little about how the speaker writes, turns answering
+    another speaker are preferred because they keep the context of the reply.
+
+    Args:
+        text (str): text of the turn.
+        has_prompt (bool): whether the turn answers a line of another speaker.
+
+    Returns:
+        float: score, higher is more representative.
+    """
+    length = len(text.strip())
+    score = min(length, IDEAL_TURN_CHARS) - max(0, length - IDEAL_TURN_CHARS) / 2
+    return score + (IDEAL_TURN_CHARS / 4 if has_prompt else 0)
+
+
+def ingest_record(chunks: Iterable[bytes], target: str, token_budget: int | None = None) -> RecordDigest:
+    """Hash a chat record and select the most representative turns of the target speaker in one pass.
+
+    Only the selected turns are kept in memory, bounded by `token_budget`, so peak memory is flat no
+    matter how large the record is. When no turn of the target can be selected, e.g. the record uses an
+    unknown format or the target never speaks, the excerpt falls back to the head of the record.
+
+    Args:
+        chunks (Iterable[bytes]): raw record chunks, e.g. `UploadedFile.chunks()`.
+        target (str): the speaker whose turns are selected.
+        token_budget (int | None, optional): estimated token budget of the excerpt.
+            Defaults to `settings.CHATBOT_RECORD_TOKEN_BUDGET`.
+
+    Returns:
+        RecordDigest: hash of the record and the excerpt.
+    """
+    if token_budget is None:
+        token_budget = settings.CHATBOT_RECORD_TOKEN_BUDGET
+
+    digest = hashlib.sha256()
+
+    def hashed(chunks: Iterable[bytes]) -> Iterator[bytes]:
+        for chunk in chunks:
+            digest.update(chunk)
+            yield chunk
+
+    head: list[str] = []
+    head_tokens = 0
+
+    def headed(lines: Iterable[str]) -> Iterator[str]:
+        nonlocal head_tokens
+        for line in lines:
+            if head_tokens <= token_budget:
+                head_tokens += estimate_tokens(line)
+                if head_tokens <= token_budget:
+                    head.append(line)
+            yield line
+
+    selected: list[tuple[float, int, int, str]] = []
+    used_tokens = 0
+    prompt = None
+
+    for seq, (speaker, text) in enumerate(iter_turns(headed(iter_lines(hashed(chunks))), [target])):
+        if speaker != target:
+            prompt = f"{speaker}：{text}"
+            continue
+
+        exchange = f"{prompt}\n{target}：{text}" if prompt else f"{target}：{text}"
+        tokens = estimate_tokens(exchange)
+        score = score_turn(text, has_prompt=prompt is not None)
+        prompt = None
+
+        if tokens > token_budget:
+            continue
+
+        heapq.heappush(selected, (score, seq, tokens, exchange))
+        used_tokens += tokens
+        while used_tokens > token_budget:
+            used_tokens -= heapq.heappop(selected)[2]
+
+    if not selected:
+        return RecordDigest(sha256=digest.hexdigest(), excerpt="\n".join(head))
+
+    excerpt = "\n".join(exchange for _, _, _, exchange in sorted(selected, key=lambda item: item[1]))
+    return RecordDigest(sha256=digest.hexdigest(), excerpt=excerpt)
@@ -0,0 +1,78 @@
+import statistics
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from typing import Any
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db import transaction
+
+from chatbot import models
+from chatbot import utils
+from config import celery_app
+from core.providers import FakeLLMProvider
+from core.providers import get_llm_provider
+from core.utils import get_system_user
+
+
+class Command(BaseCommand):
+    """Benchmark the post message -> reply_message -> state pipeline offline."""
+
+    help = (
+        "Post messages to throwaway conversations and measure the time until each is replied to. "
+        "Requires LLM_PROVIDER_BACKEND=core.providers.FakeLLMProvider, celery tasks run eagerly in this process, "
+        "set MESSAGE_BROKER_BACKEND=core.broker.InProcessBroker to run without redis."
+    )
+
+    def add_arguments(self, parser: ArgumentParser):  # noqa: D102
+        parser.add_argument("--conversations", type=int, default=4, help="conversations replied to concurrently")
+        parser.add_argument("--messages", type=int, default=20, help="messages posted per conversation")
+
+    def handle(self, *args: Any, **options: Any):  # noqa: ARG002, D102
+        provider = get_llm_provider()
+        if not isinstance(provider, FakeLLMProvider):
+            raise CommandError("LLM_PROVIDER_BACKEND is not the fake provider, the benchmark would spend real tokens")
+
+        celery_app.conf.task_always_eager = True
+        user = get_system_user()
+
+        conversations = []
+        for i in range(options["conversations"]):
+            conversation = models.Conversation(
+                name=f"benchmark {i}",
+                assistant_id=provider.create_assistant(f"benchmark {i}", "", utils.ASSISTANT_MODEL),
+            )
+            conversation.create(user)
+            conversations.append(conversation)
+
+        def converse(conversation: models.Conversation) -> list[float]:
+            latencies = []
+            try:
+                for i in range(options["messages"]):
+                    start = perf_counter()
+                    # the reply runs eagerly once the message is committed
+                    with transaction.atomic():
+                        models.Message(conversation=conversation, text=f"benchmark message {i}").create(user)
+                    latencies.append(perf_counter() - start)
+
+                    conversation.refresh_from_db(fields=["state"])
+                    if conversation.state != models.Conversation.State.COMPLETE:
+                        raise CommandError(f"{conversation} was not replied to")
+            finally:
+                connection.close()
+            return latencies
+
+        start = perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=len(conversations)) as executor:
+                latencies = [latency for result in executor.map(converse, conversations) for latency in result]
+        finally:
+            elapsed = perf_counter() - start
+            models.Message.all_objects.filter(conversation__in=conversations).delete()
+            models.Conversation.all_objects.filter(id__in=[c.id for c in conversations]).delete()
+
+        self.stdout.write(f"{len(latencies)} replies in {elapsed:.2f} s, {len(latencies) / elapsed:.1f} replies/s")
+        p95 = statistics.quantiles(latencies, n=20)[-1] if len(latencies) > 1 else latencies[0]
+        self.stdout.write(f"latency p50 {statistics.median(latencies) * 1000:.1f} ms, p95 {p95 * 1000:.1f} ms")
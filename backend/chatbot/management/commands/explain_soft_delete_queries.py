@@ -0,0 +1,42 @@
+from argparse import ArgumentParser
+from timeit import timeit
+from typing import Any
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from chatbot import models
+from chatbot import utils
+from core.models import User
+
+
+class Command(BaseCommand):
+    """Benchmark the hot queries filtered on `is_delete = false`."""
+
+    help = (
+        "Print the query plan and mean latency of the soft delete filtered hot queries. "
+        "Run it before and after `migrate chatbot 0013` to compare the full and the partial indexes."
+    )
+
+    def add_arguments(self, parser: ArgumentParser):  # noqa: D102
+        parser.add_argument("--repeat", type=int, default=50, help="executions per query for the mean latency")
+        parser.add_argument("--analyze", action="store_true", help="EXPLAIN ANALYZE instead of EXPLAIN")
+
+    def handle(self, *args: Any, **options: Any):  # noqa: ARG002, D102
+        conversation = models.Conversation.objects.order_by("-message_count").first()
+        if conversation is None:
+            raise CommandError("There is no conversation to benchmark")
+        user_id = conversation.created_by_user_id  # type: ignore
+        email = User.objects.filter(pk=user_id).values_list("email", flat=True).first()
+
+        queries = {
+            "list_messages": utils.message_page_queryset(conversation, before=None, after=None, limit=50),
+            "list_chatbot": utils.conversation_list_queryset(user_id, name=None, order="recent", after=None, limit=20),
+            "user_by_email": User.objects.filter(email=email),
+        }
+
+        for name, queryset in queries.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write(queryset.explain(analyze=options["analyze"]))
+            elapsed = timeit(lambda queryset=queryset: list(queryset.all()), number=options["repeat"])
+            self.stdout.write(f"{elapsed / options['repeat'] * 1000:.3f} ms per query\n")
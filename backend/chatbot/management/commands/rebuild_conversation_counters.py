@@ -0,0 +1,36 @@
+from argparse import ArgumentParser
+from typing import Any
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from chatbot import models
+
+
+class Command(BaseCommand):
+    """Rebuild the denormalized message counters of the conversations."""
+
+    help = "Recompute message_count and last_message_at of every conversation from its messages, in batches."
+
+    def add_arguments(self, parser: ArgumentParser):  # noqa: D102
+        parser.add_argument("--batch-size", type=int, default=500, help="conversations rebuilt per transaction")
+
+    def handle(self, *args: Any, **options: Any):  # noqa: ARG002, D102
+        batch_size = options["batch_size"]
+        conversations = models.Conversation.all_objects.order_by("id")
+        rebuilt, last_id = 0, None
+
+        while True:
+            batch = conversations if last_id is None else conversations.filter(id__gt=last_id)
+            ids = list(batch.values_list("id", flat=True)[:batch_size])
+            if not ids:
+                break
+
+            with transaction.atomic():
+                rebuilt += models.Conversation.rebuild_message_counters(
+                    models.Conversation.all_objects.filter(id__in=ids),
+                )
+            last_id = ids[-1]
+            self.stdout.write(f"rebuilt {rebuilt} conversations")
+
+        self.stdout.write(self.style.SUCCESS(f"done, rebuilt {rebuilt} conversations"))
@@ -0,0 +1,38 @@
+import asyncio
+from argparse import ArgumentParser
+from typing import Any
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chatbot import poller
+
+
+class Command(BaseCommand):
+    """Follow the assistant runs handed over by reply_message in a single event loop."""
+
+    help = (
+        "Poll (CHATBOT_REPLY_MODE=blocking) or stream (CHATBOT_REPLY_MODE=stream) the assistant runs handed over "
+        "when CHATBOT_RUN_POLLER is enabled, and store their replies. Runs until interrupted."
+    )
+
+    def add_arguments(self, parser: ArgumentParser):  # noqa: D102
+        parser.add_argument(
+            "--max-runs",
+            type=int,
+            default=settings.CHATBOT_RUN_POLLER_MAX_RUNS,
+            help="runs followed at once",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=settings.CHATBOT_RUN_POLL_INTERVAL_SECONDS,
+            help="seconds between two checks of a run",
+        )
+
+    def handle(self, *args: Any, **options: Any):  # noqa: ARG002, D102
+        self.stdout.write(f"following up to {options['max_runs']} runs")
+        try:
+            asyncio.run(poller.serve(options["max_runs"], options["poll_interval"]))
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.SUCCESS("stopped, unfinished runs are requeued once the heartbeat expires"))
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.16 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("chatbot", "0005_conversation_assistant_id"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="conversation",
+            name="thread_id",
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.16 on 2026-10-18 10:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("chatbot", "0006_conversation_thread_id"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="conversation",
+            name="state",
+            field=models.CharField(
+                choices=[("PROVISIONING", "Provisioning"), ("PENDING", "Pending"), ("COMPLETE", "Complete")],
+                default="COMPLETE",
+                max_length=20,
+            ),
+        ),
+    ]
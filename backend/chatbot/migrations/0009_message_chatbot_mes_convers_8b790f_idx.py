@@ -0,0 +1,16 @@
+# Generated by Django 4.2.16 on 2026-10-18 12:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("chatbot", "0008_assistant"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(fields=["conversation", "updated_at"], name="chatbot_mes_convers_8b790f_idx"),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.16 on 2026-10-18 13:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("chatbot", "0009_message_chatbot_mes_convers_8b790f_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="conversation",
+            name="last_read_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
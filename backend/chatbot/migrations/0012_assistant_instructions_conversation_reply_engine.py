@@ -0,0 +1,27 @@
+# Generated by Django 4.2.16 on 2026-10-18 16:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("chatbot", "0011_conversation_last_message_at_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="assistant",
+            name="instructions",
+            field=models.TextField(blank=True, default=""),
+        ),
+        migrations.AddField(
+            model_name="conversation",
+            name="reply_engine",
+            field=models.CharField(
+                blank=True,
+                choices=[("ASSISTANTS", "Assistants thread and run"), ("CHAT", "Chat completion")],
+                max_length=20,
+                null=True,
+            ),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 4.2.16 on 2026-10-18 18:40
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.contrib.postgres.operations import RemoveIndexConcurrently
+from django.db import migrations, models
+import django.db.models.functions.comparison
+
+
+class Migration(migrations.Migration):
+    # the indexes are built and dropped without locking the tables against writes, which cannot run in a transaction
+    atomic = False
+
+    dependencies = [
+        ("chatbot", "0012_assistant_instructions_conversation_reply_engine"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="conversation",
+            index=models.Index(
+                models.F("created_by_user"),
+                models.OrderBy(
+                    django.db.models.functions.comparison.Coalesce("last_message_at", "created_at"), descending=True
+                ),
+                models.OrderBy(models.F("id"), descending=True),
+                condition=models.Q(("is_delete", False)),
+                name="chatbot_con_owner_recent_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="message",
+            index=models.Index(
+                condition=models.Q(("is_delete", False)),
+                fields=["conversation", "created_at"],
+                name="chatbot_mes_conv_live_idx",
+            ),
+        ),
+        # replaced by chatbot_mes_conv_live_idx, dropped once it is built
+        RemoveIndexConcurrently(
+            model_name="message",
+            name="chatbot_mes_convers_a0cf0e_idx",
+        ),
+        RemoveIndexConcurrently(
+            model_name="message",
+            name="chatbot_mes_created_2fef1d_idx",
+        ),
+    ]
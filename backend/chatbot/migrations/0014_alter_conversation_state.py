@@ -0,0 +1,26 @@
+# Generated by Django 4.2.16 on 2026-10-18 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("chatbot", "0013_concurrent_list_indexes"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="conversation",
+            name="state",
+            field=models.CharField(
+                choices=[
+                    ("PROVISIONING", "Provisioning"),
+                    ("PENDING", "Pending"),
+                    ("COMPLETE", "Complete"),
+                    ("FAILED", "Failed"),
+                ],
+                default="COMPLETE",
+                max_length=20,
+            ),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.16 on 2026-10-18 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("chatbot", "0014_alter_conversation_state"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="assistant",
+            name="assistant_id",
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+    ]
@@ -1,4 +1,17 @@
+from datetime import datetime
+from uuid import UUID
+
+from django.contrib.auth.models import AbstractBaseUser
 from django.db import models
+from django.db import transaction
+from django.db.models import Count
+from django.db.models import F
+from django.db.models import OuterRef
+from django.db.models import QuerySet
+from django.db.models import Subquery
+from django.db.models import Value
+from django.db.models.functions import Coalesce
+from django.db.models.functions import Greatest
 
 from core.models import BaseModel
 
@@ -11,22 +24,130 @@ class Conversation(BaseModel):
     Attributes:
         name (CharField): The name of the conversation.
         record_file_s3_key (CharField): The S3 key of the conversation record file.
-        state (CharField): The state of the conversation (PENDING or COMPLETE).
+        state (CharField): The state of the conversation (PROVISIONING, PENDING, COMPLETE or FAILED).
+        assistant_id (CharField): The id of the OpenAI assistant replying in the conversation.
+        thread_id (CharField): The id of the OpenAI thread holding the conversation history.
+        last_read_at (DateTimeField): When the owner last read the conversation, for the unread count.
+        message_count (PositiveIntegerField): The number of messages in the conversation.
+        last_message_at (DateTimeField): When the latest message of the conversation was created.
+        reply_engine (CharField): How the chatbot replies (ASSISTANTS or CHAT), `settings.CHATBOT_REPLY_ENGINE` when
+            not set.
 
     """
 
     class State(models.TextChoices):
+        PROVISIONING = "PROVISIONING", "Provisioning"
         PENDING = "PENDING", "Pending"
         COMPLETE = "COMPLETE", "Complete"
+        FAILED = "FAILED", "Failed"
+
+    class ReplyEngine(models.TextChoices):
+        ASSISTANTS = "ASSISTANTS", "Assistants thread and run"
+        CHAT = "CHAT", "Chat completion"
 
     name = models.CharField(max_length=255, null=True, blank=True)
     record_file_s3_key = models.CharField(max_length=255, null=True, blank=True)
-    state = models.CharField(max_length=10, choices=State.choices, default=State.COMPLETE)
+    state = models.CharField(max_length=20, choices=State.choices, default=State.COMPLETE)
     assistant_id = models.CharField(max_length=255, null=True, blank=True)
+    thread_id = models.CharField(max_length=255, null=True, blank=True)
+    last_read_at = models.DateTimeField(null=True, blank=True)
+    message_count = models.PositiveIntegerField(default=0)
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    reply_engine = models.CharField(max_length=20, choices=ReplyEngine.choices, null=True, blank=True)
+
+    COUNTER_FIELDS = ("message_count", "last_message_at")
+
+    class Meta:
+        indexes = [
+            models.Index(
+                F("created_by_user"),
+                Coalesce("last_message_at", "created_at").desc(),
+                F("id").desc(),
+                name="chatbot_con_owner_recent_idx",
+                condition=models.Q(is_delete=False),
+            ),
+        ]
 
     def __str__(self) -> str:
         return f"Conversation {self.id}"
 
+    @classmethod
+    def record_messages_added(cls, conversation_id: UUID, count: int, last_created_at: datetime) -> None:
+        """Count new messages of a conversation.
+
+        Args:
+            conversation_id (UUID): id of the conversation.
+            count (int): number of new messages.
+            last_created_at (datetime): creation time of the latest new message.
+        """
+        cls.all_objects.filter(pk=conversation_id).update(
+            message_count=F("message_count") + count,
+            last_message_at=Greatest(Coalesce(F("last_message_at"), Value(last_created_at)), Value(last_created_at)),
+        )
+
+    @classmethod
+    def record_messages_removed(cls, conversation_ids: list[UUID], count: int = 1) -> None:
+        """Uncount soft deleted messages of conversations.
+
+        `last_message_at` is looked up again as the latest message may be among the deleted ones.
+
+        Args:
+            conversation_ids (list[UUID]): ids of the conversations.
+            count (int, optional): number of deleted messages per conversation. Defaults to 1.
+        """
+        cls.all_objects.filter(pk__in=conversation_ids).update(
+            message_count=Greatest(F("message_count") - count, Value(0)),
+            last_message_at=cls._last_message_at(),
+        )
+
+    @classmethod
+    def rebuild_message_counters(cls, queryset: QuerySet) -> int:
+        """Recompute the message counters of conversations from their messages.
+
+        Args:
+            queryset (QuerySet): conversations to rebuild.
+
+        Returns:
+            int: number of rebuilt conversations.
+        """
+        message_count = (
+            Message.objects.filter(conversation=OuterRef("pk"))
+            .order_by()
+            .values("conversation")
+            .annotate(count=Count("id"))
+            .values("count")
+        )
+        return queryset.update(
+            message_count=Coalesce(Subquery(message_count), Value(0)),
+            last_message_at=cls._last_message_at(),
+        )
+
+    @staticmethod
+    def _last_message_at() -> Subquery:
+        latest_messages = Message.objects.filter(conversation=OuterRef("pk")).order_by("-created_at")
+        return Subquery(latest_messages.values("created_at")[:1])
+
+
+class Assistant(BaseModel):
+    """Model representing an OpenAI assistant shared by conversations built from identical content.
+
+    Attributes:
+        content_hash (CharField): The sha256 of the record, target and model the assistant was built from.
+        assistant_id (CharField): The id of the OpenAI assistant.
+        model (CharField): The OpenAI model of the assistant.
+        instructions (TextField): The instructions of the assistant, the persona of chat completion replies.
+
+    """
+
+    content_hash = models.CharField(max_length=64, unique=True)
+    # chat completion replies look up the persona of a conversation by its assistant id
+    assistant_id = models.CharField(max_length=255, db_index=True)
+    model = models.CharField(max_length=255)
+    instructions = models.TextField(blank=True, default="")
+
+    def __str__(self) -> str:
+        return f"Assistant {self.assistant_id}"
+
 
 class Message(BaseModel):
     """Model representing a message in a conversation.
@@ -50,9 +171,26 @@ class Message(BaseModel):
 
     class Meta:
         indexes = [
-            models.Index(fields=["conversation"]),
-            models.Index(fields=["created_at"]),
+            models.Index(
+                fields=["conversation", "created_at"],
+                name="chatbot_mes_conv_live_idx",
+                condition=models.Q(is_delete=False),
+            ),
+            # delta sync reads soft deleted messages too
+            models.Index(fields=["conversation", "updated_at"]),
         ]
 
     def __str__(self) -> str:
         return f"Message {self.id}"
+
+    def delete(self, user: AbstractBaseUser) -> None:
+        """Soft delete the message and uncount it from its conversation.
+
+        Args:
+            user (AbstractBaseUser): The user who is initiating the deletion.
+        """
+        was_deleted = self.is_delete
+        with transaction.atomic():
+            super().delete(user)
+            if not was_deleted:
+                Conversation.record_messages_removed([self.conversation_id])  # type: ignore
@@ -0,0 +1,164 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+from uuid import UUID
+from uuid import uuid4
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+
+from core.broker import get_async_redis_client
+from core.broker import get_redis_client
+from core.providers import get_llm_provider
+
+from . import models
+from . import utils
+
+
+logger = logging.getLogger(__name__)
+
+# runs handed over by reply_message. Each poller moves the runs it works on to its own processing list
+# and keeps its heartbeat key alive, the processing lists of pollers whose heartbeat expired are requeued.
+RUN_QUEUE_KEY = "chatbot:runs"
+RUN_PROCESSING_KEY = "chatbot:runs:processing:{worker_id}"
+RUN_HEARTBEAT_KEY = "chatbot:runs:heartbeat:{worker_id}"
+HEARTBEAT_SECONDS = 10
+HEARTBEAT_TTL_SECONDS = 3 * HEARTBEAT_SECONDS
+
+
+def hand_off_run(conversation_id: UUID, thread_id: str, run_id: str | None = None) -> None:
+    """Hand an assistant run over to the run poller, which stores its reply once it completes.
+
+    Args:
+        conversation_id (UUID): id of the conversation being replied to.
+        thread_id (str): id of the thread holding the user message.
+        run_id (str | None, optional): id of a run started with `start_run` to wait for. Defaults to None, the
+            poller then streams a new run of the conversation's assistant.
+    """
+    entry = {"conversation_id": str(conversation_id), "thread_id": thread_id, "run_id": run_id}
+    get_redis_client().rpush(RUN_QUEUE_KEY, json.dumps(entry))
+
+
+async def follow_run(entry: dict[str, str | None], poll_interval: float) -> None:
+    """Wait for a handed over run and store its reply, or fail the reply if the run did not complete.
+
+    Args:
+        entry (dict[str, str | None]): the handed over run, see `hand_off_run`.
+        poll_interval (float): seconds between two checks of a polled run.
+    """
+    provider = get_llm_provider()
+    conversation = await models.Conversation.objects.aget(id=entry["conversation_id"])
+    thread_id: str = entry["thread_id"]  # type: ignore
+
+    if entry["run_id"] is None:
+        # deltas are published in order by one task, the provider hands them over without waiting
+        deltas: asyncio.Queue[str | None] = asyncio.Queue()
+
+        async def publish_deltas() -> None:
+            while (delta := await deltas.get()) is not None:
+                await utils.apublish_reply_event(conversation.id, "delta", text=delta)
+
+        publishing = asyncio.create_task(publish_deltas())
+        try:
+            result = await provider.astream(conversation.assistant_id, thread_id, deltas.put_nowait)  # type: ignore
+        finally:
+            deltas.put_nowait(None)
+            await publishing
+    else:
+        result = await provider.await_run(thread_id, entry["run_id"], poll_interval)
+
+    if result.text is None:
+        await sync_to_async(utils.fail_reply)(conversation.id, result.status)
+        return
+
+    from .tasks import save_reply
+
+    await sync_to_async(save_reply)(conversation, result.text)
+
+
+async def follow_queued_run(raw: bytes, poll_interval: float) -> None:
+    """Follow a run read from the run queue, failing its reply if following it raises.
+
+    Args:
+        raw (bytes): the queued entry, see `hand_off_run`.
+        poll_interval (float): seconds between two checks of a polled run.
+    """
+    try:
+        await follow_run(json.loads(raw), poll_interval)
+    except Exception:
+        logger.exception("following run %s failed", raw)
+        await sync_to_async(utils.fail_reply)(json.loads(raw)["conversation_id"], "failed")
+
+
+async def requeue_abandoned_runs() -> int:
+    """Requeue the runs of the pollers whose heartbeat expired, they stopped without finishing them.
+
+    Returns:
+        int: number of requeued runs.
+    """
+    client = get_async_redis_client()
+    requeued = 0
+    async for key in client.scan_iter(match=RUN_PROCESSING_KEY.format(worker_id="*")):
+        worker_id = key.decode().rsplit(":", 1)[-1]
+        if await client.exists(RUN_HEARTBEAT_KEY.format(worker_id=worker_id)):
+            continue
+        # LMOVE is atomic, pollers requeueing the same list at once never requeue a run twice
+        while await client.lmove(key, RUN_QUEUE_KEY, "RIGHT", "LEFT"):
+            requeued += 1
+    return requeued
+
+
+async def keep_alive(worker_id: str) -> None:
+    """Refresh the heartbeat of a poller and requeue the runs of stopped pollers until cancelled.
+
+    Args:
+        worker_id (str): id of the poller.
+    """
+    client = get_async_redis_client()
+    heartbeat_key = RUN_HEARTBEAT_KEY.format(worker_id=worker_id)
+    while True:
+        await client.set(heartbeat_key, 1, ex=HEARTBEAT_TTL_SECONDS)
+        if requeued := await requeue_abandoned_runs():
+            logger.warning("requeued %s runs of stopped pollers", requeued)
+        await asyncio.sleep(HEARTBEAT_SECONDS)
+
+
+async def serve(max_runs: int, poll_interval: float) -> None:
+    """Follow the handed over runs until cancelled, up to `max_runs` at once.
+
+    Runs left over by stopped pollers are taken back, those of running pollers are left to them.
+
+    Args:
+        max_runs (int): most runs followed at once.
+        poll_interval (float): seconds between two checks of a polled run.
+    """
+    client = get_async_redis_client()
+    worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid4().hex[:8]}"
+    processing_key = RUN_PROCESSING_KEY.format(worker_id=worker_id)
+
+    await client.set(RUN_HEARTBEAT_KEY.format(worker_id=worker_id), 1, ex=HEARTBEAT_TTL_SECONDS)
+    heartbeat = asyncio.create_task(keep_alive(worker_id))
+
+    slots = asyncio.Semaphore(max_runs)
+    following: set[asyncio.Task] = set()
+
+    async def follow(raw: bytes) -> None:
+        try:
+            await follow_queued_run(raw, poll_interval)
+        finally:
+            await client.lrem(processing_key, 1, raw)
+            slots.release()
+
+    try:
+        while True:
+            await slots.acquire()
+            raw = await client.blmove(RUN_QUEUE_KEY, processing_key, 0, "LEFT", "RIGHT")
+            # like at the end of a request, drop the connection used by the ORM calls if it broke or is too old
+            await sync_to_async(close_old_connections)()
+            task = asyncio.create_task(follow(raw))
+            following.add(task)
+            task.add_done_callback(following.discard)
+    finally:
+        heartbeat.cancel()
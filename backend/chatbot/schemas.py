@@ -1,3 +1,5 @@
+from datetime import datetime
+from typing import Literal
 from uuid import UUID
 
 from ninja import ModelSchema
@@ -19,12 +21,42 @@ class GetConversationResponseSchema(ModelSchema):
         model_exclude = BASE_GET_EXCLUDE_FIELD
 
 
+class ConversationListItemSchema(GetConversationResponseSchema):
+    """Conversation response schema of the conversation list, with the last message preview."""
+
+    last_message: str | None
+    unread_count: int
+
+
+class ConversationPageResponseSchema(Schema):
+    """Page of conversations response schema."""
+
+    items: list[ConversationListItemSchema]
+    after: str | None
+    has_more: bool
+
+
+ConversationOrdering = Literal["recent", "name"]
+
+
+# written by the backend only: the LLM resources, the state machine, the uploaded record and the counters
+CONVERSATION_SERVER_FIELDS = [
+    "assistant_id",
+    "thread_id",
+    "state",
+    "reply_engine",
+    "record_file_s3_key",
+    "last_read_at",
+    *models.Conversation.COUNTER_FIELDS,
+]
+
+
 class CreateConversationSchema(ModelSchema):
     """Conversation schema for POST method."""
 
     class Config:
         model = models.Conversation
-        model_exclude = BASE_CREATE_EXCLUDE_FIELD
+        model_exclude = [*CONVERSATION_SERVER_FIELDS, *BASE_CREATE_EXCLUDE_FIELD]
 
 
 class PutConversationSchema(ModelSchema):
@@ -32,7 +64,7 @@ class PutConversationSchema(ModelSchema):
 
     class Config:
         model = models.Conversation
-        model_exclude = BASE_UPDATE_EXCLUDE_FIELD
+        model_exclude = [*CONVERSATION_SERVER_FIELDS, *BASE_UPDATE_EXCLUDE_FIELD]
 
 
 class GetMessageResponseSchema(ModelSchema):
@@ -48,7 +80,8 @@ class CreateMessageSchema(ModelSchema):
 
     class Config:
         model = models.Message
-        model_exclude = BASE_CREATE_EXCLUDE_FIELD
+        # chatbot replies are only written by the backend
+        model_exclude = ["type", *BASE_CREATE_EXCLUDE_FIELD]
 
 
 class PutMessageSchema(ModelSchema):
@@ -56,7 +89,7 @@ class PutMessageSchema(ModelSchema):
 
     class Config:
         model = models.Message
-        model_exclude = ["conversation", *BASE_UPDATE_EXCLUDE_FIELD]
+        model_exclude = ["conversation", "type", *BASE_UPDATE_EXCLUDE_FIELD]
 
 
 class MessageResponseSchema(ModelSchema):
@@ -67,6 +100,32 @@ class MessageResponseSchema(ModelSchema):
         model_exclude = BASE_EXCLUDE_FIELD
 
 
+class MessagePageResponseSchema(Schema):
+    """Page of messages response schema."""
+
+    items: list[MessageResponseSchema]
+    before: str | None
+    after: str | None
+    has_more: bool
+
+
+class MessageSyncSchema(ModelSchema):
+    """Message schema for the delta sync, soft deleted messages are included."""
+
+    class Config:
+        model = models.Message
+        model_fields = ["id", "conversation", "type", "text", "created_at", "updated_at", "is_delete"]
+
+
+class MessageSyncResponseSchema(Schema):
+    """Delta sync response schema."""
+
+    items: list[MessageSyncSchema]
+    watermark: str | None
+    has_more: bool
+    state: models.Conversation.State
+
+
 class ChatbotStateResponseSchema(Schema):
     """Chatbot state response schema."""
 
@@ -87,6 +146,13 @@ class PutConversationNameResponseSchema(Schema):
     state: models.Conversation.State
 
 
+class ConversationReadResponseSchema(Schema):
+    """Conversation read schema for PUT method."""
+
+    id: UUID
+    last_read_at: datetime
+
+
 class DeleteConversationSchema(Schema):
     """Conversation schema for DELETE method."""
 
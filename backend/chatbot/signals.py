@@ -1,3 +1,5 @@
+from collections import Counter
+from collections import defaultdict
 from functools import partial
 
 from django.db import transaction
@@ -5,10 +7,40 @@ from django.db.models import signals
 from django.db.models.base import ModelBase
 from django.dispatch import receiver
 
-from core.models import User
+from core.models import post_bulk_create
+from core.models import post_bulk_delete
+from core.utils import get_system_user
 
 from . import models
 from . import tasks
+from . import utils
+
+
+def _follow_latest_message(conversation: models.Conversation, message: models.Message) -> None:
+    """Flip the conversation state after its latest message and reply to it if it is from the user.
+
+    The new state is published to the state channel of the conversation once the transaction commits.
+
+    Args:
+        conversation (models.Conversation): The conversation of the message.
+        message (models.Message): The latest message of the conversation.
+    """
+    if message.type == models.Message.Type.USER:
+        conversation.state = models.Conversation.State.PENDING
+        conversation.save(get_system_user())
+        transaction.on_commit(partial(utils.publish_state, conversation.id, conversation.state))
+
+        transaction.on_commit(
+            partial(
+                tasks.reply_message.delay,
+                conversation_id=conversation.id,
+                message_id=message.id,
+            ),
+        )
+    else:
+        conversation.state = models.Conversation.State.COMPLETE
+        conversation.save(get_system_user())
+        transaction.on_commit(partial(utils.publish_state, conversation.id, conversation.state))
 
 
 @receiver(signals.post_save, sender=models.Message)
@@ -20,6 +52,9 @@ def message_post_save_signal(
 ):
     """Reply to a message in a conversation.
 
+    Counts the message in its conversation, flips the conversation state between PENDING and COMPLETE
+    and publishes the new state to the state channel of the conversation once the transaction commits.
+
     Args:
         sender (ModelBase): The model class of the sender.
         instance (models.Message): The instance of the message.
@@ -27,18 +62,58 @@ def message_post_save_signal(
         **kwargs: Additional keyword arguments.
     """
     if created:
-        conversation = instance.conversation
-        if instance.type == models.Message.Type.USER:
-            conversation.state = models.Conversation.State.PENDING
-            conversation.save(User.objects.get(email="admin@email.com"))
-
-            transaction.on_commit(
-                partial(
-                    tasks.reply_message.delay,
-                    conversation_id=conversation.id,
-                    message_id=instance.id,
-                ),
-            )
-        else:
-            conversation.state = models.Conversation.State.COMPLETE
-            conversation.save(User.objects.get(email="admin@email.com"))
+        models.Conversation.record_messages_added(instance.conversation_id, 1, instance.created_at)  # type: ignore
+        _follow_latest_message(instance.conversation, instance)
+
+
+@receiver(post_bulk_create, sender=models.Message)
+def message_post_bulk_create_signal(
+    sender: ModelBase,  # noqa: ARG001
+    objs: list[models.Message],
+    **kwargs,  # noqa: ARG001, ANN003
+):
+    """Count bulk created messages and follow the latest one, once per conversation.
+
+    Only the latest message of each conversation decides its state and gets a reply, so importing a chat
+    history does not enqueue a reply for every imported user message.
+
+    Args:
+        sender (ModelBase): The model class of the sender.
+        objs (list[models.Message]): The created messages.
+        **kwargs: Additional keyword arguments.
+    """
+    counts = Counter(message.conversation_id for message in objs)  # type: ignore
+    latest_messages: dict = {}
+    for message in objs:
+        latest = latest_messages.get(message.conversation_id)  # type: ignore
+        if latest is None or message.created_at >= latest.created_at:
+            latest_messages[message.conversation_id] = message  # type: ignore
+
+    conversations = models.Conversation.objects.in_bulk(list(latest_messages))
+    for conversation_id, message in latest_messages.items():
+        models.Conversation.record_messages_added(conversation_id, counts[conversation_id], message.created_at)
+        if conversation_id in conversations:
+            _follow_latest_message(conversations[conversation_id], message)
+
+
+@receiver(post_bulk_delete, sender=models.Message)
+def message_post_bulk_delete_signal(
+    sender: ModelBase,  # noqa: ARG001
+    pks: list,
+    **kwargs,  # noqa: ARG001, ANN003
+):
+    """Uncount bulk soft deleted messages from their conversations.
+
+    Args:
+        sender (ModelBase): The model class of the sender.
+        pks (list): The primary keys of the deleted messages.
+        **kwargs: Additional keyword arguments.
+    """
+    counts = Counter(models.Message.all_objects.filter(pk__in=pks).values_list("conversation_id", flat=True))
+
+    conversations_by_count = defaultdict(list)
+    for conversation_id, count in counts.items():
+        conversations_by_count[count].append(conversation_id)
+
+    for count, conversation_ids in conversations_by_count.items():
+        models.Conversation.record_messages_removed(conversation_ids, count)
@@ -1,48 +1,220 @@
 from uuid import UUID
 
+from django.conf import settings
+
 from config import celery_app
 
-from core.models import User
-from core.utils import OPENAI_CLIENT
+from core.providers import ThreadNotFoundError
+from core.providers import get_llm_provider
+from core.utils import get_system_user
 
 from . import models
+from . import poller
+from . import utils
+
+
+THREAD_MESSAGE_ROLES = {
+    models.Message.Type.USER: "user",
+    models.Message.Type.CHATBOT: "assistant",
+}
+
+
+def rebuild_thread(conversation: models.Conversation) -> str:
+    """Create a new thread seeded with the stored messages of a conversation.
+
+    Only the latest `settings.CHATBOT_THREAD_REBUILD_MESSAGES` messages are sent, the new thread id is
+    saved on the conversation.
+
+    Args:
+        conversation (models.Conversation): conversation to rebuild the thread of.
+
+    Returns:
+        str: id of the new thread.
+    """
+    history = reversed(
+        models.Message.objects.filter(conversation=conversation)
+        .order_by("-created_at")
+        .values("type", "text")[: settings.CHATBOT_THREAD_REBUILD_MESSAGES],
+    )
+    messages = [{"role": THREAD_MESSAGE_ROLES[row["type"]], "content": row["text"]} for row in history]
+    thread_id = get_llm_provider().create_thread(messages)
+
+    conversation.thread_id = thread_id
+    conversation.save(get_system_user())
+    return thread_id
+
+
+def add_message_to_thread(conversation: models.Conversation, message: models.Message) -> str:
+    """Add a user message to the thread of a conversation.
+
+    The thread is created lazily on the first message and reused afterwards. When the stored thread
+    no longer exists on the LLM provider it is rebuilt from the stored messages, which already include `message`.
+
+    Args:
+        conversation (models.Conversation): conversation the message belongs to.
+        message (models.Message): the user message.
+
+    Returns:
+        str: id of the thread holding the message.
+    """
+    if conversation.thread_id is None:
+        return rebuild_thread(conversation)
+
+    try:
+        get_llm_provider().add_message(conversation.thread_id, message.text)
+    except ThreadNotFoundError:
+        return rebuild_thread(conversation)
+
+    return conversation.thread_id
+
+
+def stream_reply(conversation: models.Conversation, thread_id: str) -> str | None:
+    """Run the assistant on a thread and push the reply tokens to the reply stream channel.
+
+    A run that does not complete fails the reply, see `utils.fail_reply`.
+
+    Args:
+        conversation (models.Conversation): conversation being replied to.
+        thread_id (str): id of the thread holding the user message.
+
+    Returns:
+        str | None: the full reply text, or None if the run did not complete.
+    """
+    result = get_llm_provider().stream(
+        conversation.assistant_id,  # type: ignore
+        thread_id,
+        lambda delta: utils.publish_reply_event(conversation.id, "delta", text=delta),
+    )
+    if result.text is None:
+        utils.fail_reply(conversation.id, result.status)
+
+    return result.text
+
+
+def chat_reply(conversation: models.Conversation) -> str:
+    """Reply with a single streamed chat completion, pushing the reply tokens to the reply stream channel.
+
+    The prompt is built locally from the persona instructions registered for the conversation's assistant
+    and its latest `settings.CHATBOT_CHAT_HISTORY_MESSAGES` messages, no thread or run is involved.
+
+    Args:
+        conversation (models.Conversation): conversation being replied to, its latest message is the user message.
+
+    Returns:
+        str: the full reply text.
+    """
+    assistants = models.Assistant.objects.filter(assistant_id=conversation.assistant_id)
+    persona = assistants.values("instructions", "model").first()
+    history = reversed(
+        models.Message.objects.filter(conversation=conversation)
+        .order_by("-created_at")
+        .values("type", "text")[: settings.CHATBOT_CHAT_HISTORY_MESSAGES],
+    )
+    messages = [
+        {"role": "system", "content": persona["instructions"] if persona else ""},
+        *({"role": THREAD_MESSAGE_ROLES[row["type"]], "content": row["text"]} for row in history),
+    ]
+
+    return get_llm_provider().stream_chat(
+        persona["model"] if persona else utils.ASSISTANT_MODEL,
+        messages,
+        lambda delta: utils.publish_reply_event(conversation.id, "delta", text=delta),
+    )
+
+
+def save_reply(conversation: models.Conversation, text: str) -> models.Message:
+    """Store the chatbot reply of a conversation and publish it as the end of the reply stream.
+
+    Args:
+        conversation (models.Conversation): conversation being replied to.
+        text (str): the reply text.
+
+    Returns:
+        models.Message: the stored reply.
+    """
+    message_reply = models.Message(
+        conversation=conversation,
+        type=models.Message.Type.CHATBOT,
+        text=text,
+    )
+    message_reply.save(get_system_user())
+    utils.publish_reply_event(conversation.id, "done", message_id=message_reply.id, text=message_reply.text)
+    return message_reply
+
+
+@celery_app.task
+def create_assistant(conversation_id: UUID, instructions: str, content_hash: str):
+    """Create the assistant of a conversation created in deferred mode.
+
+    Fills in `assistant_id` and moves the conversation out of the PROVISIONING state. An assistant already
+    registered for `content_hash` is reused.
+    """
+    conversation = models.Conversation.objects.get(id=conversation_id)
+    system_user = get_system_user()
+
+    conversation.assistant_id = utils.get_or_create_assistant(
+        system_user,
+        conversation.name,  # type: ignore
+        instructions,
+        content_hash,
+    )
+    conversation.state = models.Conversation.State.COMPLETE
+    conversation.save(system_user)
+    utils.publish_state(conversation.id, conversation.state)
+
+    return conversation.assistant_id
 
 
 @celery_app.task
 def reply_message(conversation_id: UUID, message_id: UUID):
-    """Reply to a message in a conversation."""
+    """Reply to a message in a conversation.
+
+    A reply that fails, whether its run does not complete or an error is raised, leaves the conversation
+    in the FAILED state, see `utils.fail_reply`.
+    """
+    try:
+        return _reply_message(conversation_id, message_id)
+    except Exception:
+        utils.fail_reply(conversation_id, "failed")
+        raise
+
+
+def _reply_message(conversation_id: UUID, message_id: UUID) -> str | None:
     conversation = models.Conversation.objects.get(id=conversation_id)
     message = models.Message.objects.get(id=message_id)
 
+    if (conversation.reply_engine or settings.CHATBOT_REPLY_ENGINE) == models.Conversation.ReplyEngine.CHAT:
+        return save_reply(conversation, chat_reply(conversation)).text
+
     if conversation.assistant_id is None:
-        assistant = OPENAI_CLIENT.beta.assistants.create(
-            name=conversation.name,
-            instructions="",
-            model="gpt-4o-2024-11-20",
+        conversation.assistant_id = get_llm_provider().create_assistant(
+            conversation.name,  # type: ignore
+            "",
+            utils.ASSISTANT_MODEL,
         )
-        conversation.assistant_id = assistant.id
-        conversation.save(User.objects.get(email="admin@email.com"))
-
-    thread = OPENAI_CLIENT.beta.threads.create()
-    message_from_user = OPENAI_CLIENT.beta.threads.messages.create(  # noqa: F841
-        thread_id=thread.id,
-        role="user",
-        content=message.text,
-    )
+        conversation.save(get_system_user())
 
-    run = OPENAI_CLIENT.beta.threads.runs.create_and_poll(
-        assistant_id=conversation.assistant_id,
-        thread_id=thread.id,
-    )
+    thread_id = add_message_to_thread(conversation, message)
 
-    if run.status == "completed":
-        latest_messages = OPENAI_CLIENT.beta.threads.messages.list(thread_id=thread.id).data[0]
+    if settings.CHATBOT_RUN_POLLER:
+        # the worker is free again right away, run_reply_poller streams or polls the run and stores the reply
+        run_id = None
+        if settings.CHATBOT_REPLY_MODE != "stream":
+            run_id = get_llm_provider().start_run(conversation.assistant_id, thread_id)  # type: ignore
+        poller.hand_off_run(conversation.id, thread_id, run_id)
+        return None
 
-        message_reply = models.Message(
-            conversation=conversation,
-            type=models.Message.Type.CHATBOT,
-            text=latest_messages.content[0].text.value,  # type: ignore
-        )
-        message_reply.save(User.objects.get(email="admin@email.com"))
+    if settings.CHATBOT_REPLY_MODE == "stream":
+        text = stream_reply(conversation, thread_id)
+        if text is None:
+            return None
+
+        return save_reply(conversation, text).text
+
+    result = get_llm_provider().run(conversation.assistant_id, thread_id)  # type: ignore
+    if result.text is None:
+        # failed, cancelled or expired run, nothing to store
+        utils.fail_reply(conversation.id, result.status)
+        return None
 
-    return message_reply.text
+    return save_reply(conversation, result.text).text
@@ -0,0 +1,1059 @@
+import asyncio
+import hashlib
+import json
+import tempfile
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from io import StringIO
+from unittest import mock
+from unittest import skipUnless
+from uuid import UUID
+from uuid import uuid4
+
+import redis
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase
+from django.test import TestCase
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from ninja_jwt.tokens import RefreshToken
+
+from core.broker import get_broker
+from core.broker import get_redis_client
+from core.models import User
+from core.providers import RunResult
+from core.providers import get_llm_provider
+from core.storage import get_file_storage
+from core.utils import invalidate_system_user
+
+from . import ingestion
+from . import models
+from . import poller
+from . import tasks
+from . import utils
+
+
+def redis_is_reachable() -> bool:
+    """Whether the redis of `settings.REDIS_URL` answers."""
+    try:
+        return redis.Redis.from_url(settings.REDIS_URL, socket_connect_timeout=1).ping()
+    except redis.RedisError:
+        return False
+
+
+@override_settings(
+    ALLOWED_HOSTS=["testserver"],
+    MESSAGE_BROKER_BACKEND="core.broker.InProcessBroker",
+    LLM_PROVIDER_BACKEND="core.providers.FakeLLMProvider",
+    LLM_FAKE_LATENCY_SECONDS=0,
+    LLM_FAKE_TOKENS_PER_SECOND=100_000,
+    CHATBOT_REPLY_ENGINE="ASSISTANTS",
+    CHATBOT_RUN_POLLER=False,
+)
+class ChatbotTestCase(TestCase):
+    """Base test case with an authenticated user, the in-process broker and the fake LLM provider."""
+
+    def setUp(self) -> None:
+        """Create the user and reset the process wide backends."""
+        get_broker.cache_clear()
+        get_llm_provider.cache_clear()
+        invalidate_system_user()
+
+        self.user = User.objects.create_user(email="user@example.com", password="password")  # noqa: S106
+        self.auth_headers = {"Authorization": f"Bearer {RefreshToken.for_user(self.user).access_token}"}
+        self.auth = {f"HTTP_{name.upper()}": value for name, value in self.auth_headers.items()}
+
+    def create_conversation(self, name: str = "conversation") -> models.Conversation:
+        """Create a conversation of the user with an assistant."""
+        conversation = models.Conversation(name=name, assistant_id="fake-asst")
+        conversation.create(self.user)
+        return conversation
+
+    def use_temporary_file_storage(self) -> None:
+        """Store the uploaded records in a temporary directory for the duration of the test."""
+        storage_root = tempfile.TemporaryDirectory()
+        self.addCleanup(storage_root.cleanup)
+        storage_settings = self.settings(
+            FILE_STORAGE_BACKEND="core.storage.LocalFileSystemStorage",
+            LOCAL_FILE_STORAGE_ROOT=storage_root.name,
+        )
+        storage_settings.enable()
+        self.addCleanup(storage_settings.disable)
+        get_file_storage.cache_clear()
+        self.addCleanup(get_file_storage.cache_clear)
+
+
+class MessageBatchTests(ChatbotTestCase):
+    """Batch routes of the generated message CRUD controller."""
+
+    def test_create_batch_counts_messages_and_replies_once_per_conversation(self) -> None:
+        """Messages are created in bulk, counted, and only the latest one of each conversation is replied to."""
+        first, second = self.create_conversation("first"), self.create_conversation("second")
+        body = [
+            {"conversation_id": str(first.id), "text": "one"},
+            {"conversation_id": str(first.id), "text": "two"},
+            {"conversation_id": str(second.id), "text": "three"},
+        ]
+
+        with mock.patch.object(tasks.reply_message, "delay") as delay, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/api/message/batch", body, content_type="application/json", **self.auth)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 3)
+        self.assertQuerySetEqual(
+            models.Message.objects.filter(conversation=first).order_by("text").values_list("text", flat=True),
+            ["one", "two"],
+        )
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.message_count, second.message_count), (2, 1))
+        self.assertEqual(first.state, models.Conversation.State.PENDING)
+        self.assertCountEqual(
+            [call.kwargs["conversation_id"] for call in delay.call_args_list],
+            [first.id, second.id],
+        )
+
+    def test_update_and_delete_batch(self) -> None:
+        """Batch updates write the given texts and batch deletes uncount the messages."""
+        conversation = self.create_conversation()
+        messages = [models.Message(conversation=conversation, text=text) for text in ("one", "two")]
+        with mock.patch.object(tasks.reply_message, "delay"):
+            models.Message.create_batch(self.user, messages)
+
+        body = [{"id": str(message.id), "text": f"edited {message.text}"} for message in messages]
+        response = self.client.put("/api/message/batch", body, content_type="application/json", **self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertCountEqual(
+            models.Message.objects.values_list("text", flat=True),
+            ["edited one", "edited two"],
+        )
+
+        body = {"ids": [str(messages[0].id)]}
+        response = self.client.delete("/api/message/batch", body, content_type="application/json", **self.auth)
+        self.assertEqual(response.status_code, 200)
+        conversation.refresh_from_db()
+        self.assertEqual(conversation.message_count, 1)
+
+    def test_batch_routes_reject_messages_of_other_users(self) -> None:
+        """Only the creator of the messages may change them."""
+        conversation = self.create_conversation()
+        other = User.objects.create_user(email="other@example.com", password="password")  # noqa: S106
+        message = models.Message(conversation=conversation, text="theirs")
+        with mock.patch.object(tasks.reply_message, "delay"):
+            message.create(other)
+
+        body = [{"id": str(message.id), "text": "mine"}]
+        response = self.client.put("/api/message/batch", body, content_type="application/json", **self.auth)
+        self.assertEqual(response.status_code, 403)
+        response = self.client.delete(
+            "/api/message/batch",
+            {"ids": [str(message.id)]},
+            content_type="application/json",
+            **self.auth,
+        )
+        self.assertEqual(response.status_code, 403)
+
+    def test_create_routes_reject_conversations_of_other_users(self) -> None:
+        """Messages may only be created in conversations of the user, nothing is written otherwise."""
+        mine = self.create_conversation("mine")
+        other = User.objects.create_user(email="other@example.com", password="password")  # noqa: S106
+        theirs = models.Conversation(name="theirs", assistant_id="fake-asst")
+        theirs.create(other)
+
+        with mock.patch.object(tasks.reply_message, "delay") as delay:
+            body = {"conversation_id": str(theirs.id), "text": "hello"}
+            response = self.client.post("/api/message", body, content_type="application/json", **self.auth)
+            self.assertEqual(response.status_code, 403)
+
+            body = [
+                {"conversation_id": str(mine.id), "text": "one"},
+                {"conversation_id": str(theirs.id), "text": "two"},
+            ]
+            response = self.client.post("/api/message/batch", body, content_type="application/json", **self.auth)
+            self.assertEqual(response.status_code, 403)
+
+            body = [{"conversation_id": str(uuid4()), "text": "three"}]
+            response = self.client.post("/api/message/batch", body, content_type="application/json", **self.auth)
+            self.assertEqual(response.status_code, 404)
+
+        self.assertFalse(models.Message.objects.exists())
+        delay.assert_not_called()
+
+    def test_create_ignores_the_message_type(self) -> None:
+        """Clients can only write user messages, chatbot replies are written by the backend."""
+        conversation = self.create_conversation()
+        body = {"conversation_id": str(conversation.id), "text": "hello", "type": models.Message.Type.CHATBOT}
+
+        with mock.patch.object(tasks.reply_message, "delay"), self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/api/message", body, content_type="application/json", **self.auth)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(models.Message.objects.get().type, models.Message.Type.USER)
+
+    def test_conversation_crud_routes_are_not_exposed(self) -> None:
+        """Conversations are only written through the chatbot routes, which manage their LLM resources."""
+        body = {"name": "mine", "assistant_id": "asst", "state": models.Conversation.State.COMPLETE}
+        response = self.client.post("/api/conversation", body, content_type="application/json", **self.auth)
+        self.assertEqual(response.status_code, 404)
+
+
+class DirtySaveTests(ChatbotTestCase):
+    """`BaseModel.save` only writes the changed columns of loaded objects."""
+
+    def test_save_writes_only_changed_columns(self) -> None:
+        """Renaming writes the name and the update stamps, not the state or the counters."""
+        conversation = models.Conversation.objects.get(pk=self.create_conversation("before").pk)
+        models.Conversation.objects.filter(pk=conversation.pk).update(
+            message_count=5,
+            state=models.Conversation.State.PENDING,
+        )
+
+        conversation.name = "after"
+        with CaptureQueriesContext(connection) as queries:
+            conversation.save(self.user)
+
+        (update,) = [query["sql"] for query in queries if query["sql"].startswith("UPDATE")]
+        assignments = update.split(" SET ", 1)[1].split(" WHERE ", 1)[0]
+        self.assertCountEqual(
+            [assignment.split(" = ")[0].strip('"') for assignment in assignments.split(", ")],
+            ["name", "updated_at", "updated_by_user_id"],
+        )
+        conversation.refresh_from_db()
+        self.assertEqual(
+            (conversation.name, conversation.state, conversation.message_count),
+            ("after", models.Conversation.State.PENDING, 5),
+        )
+        self.assertEqual(conversation.get_dirty_fields(), [])
+
+
+class PollerTests(ChatbotTestCase):
+    """The `run_reply_poller` side of the runs handed over by reply_message."""
+
+    def setUp(self) -> None:
+        """Create a conversation waiting for the reply to the user message of its thread."""
+        super().setUp()
+        self.conversation = self.create_conversation()
+        models.Conversation.objects.filter(id=self.conversation.id).update(state=models.Conversation.State.PENDING)
+        self.thread_id = get_llm_provider().create_thread([{"role": "user", "content": "hello"}])
+
+    async def follow(self, run_id: str | None) -> list[dict]:
+        """Follow a run of the conversation and return the reply events published meanwhile."""
+        entry = {"conversation_id": str(self.conversation.id), "thread_id": self.thread_id, "run_id": run_id}
+        events = []
+        async with get_broker().subscribe(utils.reply_stream_channel(self.conversation.id)) as subscription:
+            await poller.follow_queued_run(json.dumps(entry).encode(), poll_interval=0)
+            while (event := await subscription.get(max_wait=0.1)) is not None:
+                events.append(event)
+        return events
+
+    async def test_streamed_run_publishes_the_deltas_in_order(self) -> None:
+        """The deltas add up to the stored reply, which ends the stream."""
+        events = await self.follow(run_id=None)
+
+        *deltas, done = events
+        reply = await models.Message.objects.aget(conversation=self.conversation, type=models.Message.Type.CHATBOT)
+        self.assertEqual(done["event"], "done")
+        self.assertEqual(done["data"]["text"], reply.text)
+        self.assertEqual("".join(delta["data"]["text"] for delta in deltas).strip(), reply.text)
+
+    async def test_started_run_is_waited_for(self) -> None:
+        """A run started by reply_message is waited for and its reply stored."""
+        run_id = get_llm_provider().start_run("fake-asst", self.thread_id)
+
+        events = await self.follow(run_id=run_id)
+
+        self.assertEqual([event["event"] for event in events], ["done"])
+        replies = models.Message.objects.filter(conversation=self.conversation, type=models.Message.Type.CHATBOT)
+        self.assertTrue(await replies.aexists())
+
+    async def assert_failed(self, events: list[dict], status: str) -> None:
+        """Check the reply stream ended with an error and the conversation failed without a reply."""
+        self.assertEqual(events, [{"event": "error", "data": {"status": status}}])
+        await self.conversation.arefresh_from_db(fields=["state"])
+        self.assertEqual(self.conversation.state, models.Conversation.State.FAILED)
+        replies = models.Message.objects.filter(conversation=self.conversation, type=models.Message.Type.CHATBOT)
+        self.assertFalse(await replies.aexists())
+
+    async def test_failed_run_fails_the_reply(self) -> None:
+        """A run that did not complete fails the reply with its status."""
+        provider = get_llm_provider()
+
+        with mock.patch.object(provider, "await_run", return_value=RunResult(status="failed", text=None)):
+            events = await self.follow(run_id="run")
+
+        await self.assert_failed(events, "failed")
+
+    async def test_error_fails_the_reply(self) -> None:
+        """An error raised while following a run fails the reply."""
+        provider = get_llm_provider()
+
+        with mock.patch.object(provider, "astream", side_effect=RuntimeError), self.assertLogs(poller.logger):
+            events = await self.follow(run_id=None)
+
+        await self.assert_failed(events, "failed")
+
+    @skipUnless(redis_is_reachable(), "needs the redis of settings.REDIS_URL")
+    async def test_only_runs_of_stopped_pollers_are_requeued(self) -> None:
+        """The processing list of a poller is requeued once its heartbeat expired, not before."""
+        client = get_redis_client()
+        queue_key = f"test:runs:{uuid4().hex}"
+        live, stopped = uuid4().hex, uuid4().hex
+        keys = [queue_key, *(poller.RUN_PROCESSING_KEY.format(worker_id=worker) for worker in (live, stopped))]
+        self.addCleanup(client.delete, *keys, poller.RUN_HEARTBEAT_KEY.format(worker_id=live))
+
+        client.set(poller.RUN_HEARTBEAT_KEY.format(worker_id=live), 1, ex=60)
+        client.rpush(keys[1], json.dumps({"run": "live"}))
+        client.rpush(keys[2], json.dumps({"run": "stopped"}))
+
+        with mock.patch.object(poller, "RUN_QUEUE_KEY", queue_key):
+            self.assertEqual(await poller.requeue_abandoned_runs(), 1)
+
+        self.assertEqual([json.loads(raw) for raw in client.lrange(queue_key, 0, -1)], [{"run": "stopped"}])
+        self.assertEqual(client.llen(keys[1]), 1)
+        self.assertEqual(client.llen(keys[2]), 0)
+
+
+@override_settings(CHATBOT_REPLY_MODE="stream")
+class ReplyStreamTests(ChatbotTestCase):
+    """The reply tokens streamed to GET /chatbot/{conversation_id}/stream as Server-Sent-Events."""
+
+    def stream_url(self, conversation: models.Conversation) -> str:
+        """URL of the reply stream of a conversation."""
+        return f"/api/chatbot/{conversation.id}/stream"
+
+    @staticmethod
+    def parse_frames(body: str) -> list[tuple[str, dict]]:
+        """Parse SSE frames into (event, data) pairs, skipping keep-alive comments."""
+        frames = []
+        for frame in body.split("\n\n"):
+            fields = dict(line.split(": ", 1) for line in frame.splitlines() if not line.startswith(":"))
+            if fields:
+                frames.append((fields["event"], json.loads(fields["data"])))
+        return frames
+
+    async def test_stream_of_a_replied_conversation_ends_at_once(self) -> None:
+        """Without a pending reply the stream is a single `done` event with the state."""
+        conversation = await sync_to_async(self.create_conversation)()
+
+        response = await self.async_client.get(self.stream_url(conversation), headers=self.auth_headers)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        body = "".join([chunk.decode() async for chunk in response.streaming_content])
+        self.assertEqual(self.parse_frames(body), [("done", {"state": models.Conversation.State.COMPLETE})])
+
+    async def test_stream_pushes_the_reply_tokens_then_the_stored_reply(self) -> None:
+        """The `delta` events add up to the reply sent with the final `done` event."""
+        conversation = await sync_to_async(self.create_conversation)()
+        message = models.Message(conversation=conversation, text="hello")
+        with mock.patch.object(tasks.reply_message, "delay"):
+            await sync_to_async(message.create)(self.user)
+
+        broker = get_broker()
+        subscribe = broker.subscribe
+        subscribed = asyncio.Event()
+
+        @asynccontextmanager
+        async def signalling_subscribe(channel: str) -> AsyncIterator:
+            async with subscribe(channel) as subscription:
+                subscribed.set()
+                yield subscription
+
+        with mock.patch.object(broker, "subscribe", signalling_subscribe):
+            response = await self.async_client.get(self.stream_url(conversation), headers=self.auth_headers)
+
+            async def read_body() -> str:
+                return "".join([chunk.decode() async for chunk in response.streaming_content])
+
+            body = asyncio.create_task(read_body())
+            await subscribed.wait()
+            await sync_to_async(tasks.reply_message)(conversation.id, message.id)
+            frames = self.parse_frames(await body)
+
+        *deltas, (event, data) = frames
+        reply = await models.Message.objects.aget(conversation=conversation, type=models.Message.Type.CHATBOT)
+        self.assertEqual(event, "done")
+        self.assertEqual((data["message_id"], data["text"]), (str(reply.id), reply.text))
+        self.assertTrue(deltas)
+        self.assertEqual({event for event, _ in deltas}, {"delta"})
+        self.assertEqual("".join(delta["text"] for _, delta in deltas).strip(), reply.text)
+
+    async def test_stream_ends_when_the_state_changes_without_an_event(self) -> None:
+        """The state read on a keep-alive ends the stream of a reply whose last event was missed."""
+        conversation = await sync_to_async(self.create_conversation)()
+        conversations = models.Conversation.objects.filter(id=conversation.id)
+        await conversations.aupdate(state=models.Conversation.State.PENDING)
+
+        with self.settings(CHATBOT_STREAM_KEEPALIVE_SECONDS=0.05):
+            response = await self.async_client.get(self.stream_url(conversation), headers=self.auth_headers)
+            chunks = aiter(response.streaming_content)
+            self.assertEqual((await anext(chunks)).decode(), ": keep-alive\n\n")
+
+            await conversations.aupdate(state=models.Conversation.State.FAILED)
+            body = "".join([chunk.decode() async for chunk in chunks])
+
+        self.assertEqual(self.parse_frames(body), [("done", {"state": models.Conversation.State.FAILED})])
+
+    async def test_stream_times_out(self) -> None:
+        """A reply still pending after CHATBOT_STREAM_MAX_SECONDS ends the stream with a timeout error."""
+        conversation = await sync_to_async(self.create_conversation)()
+        await models.Conversation.objects.filter(id=conversation.id).aupdate(state=models.Conversation.State.PENDING)
+
+        with self.settings(CHATBOT_STREAM_KEEPALIVE_SECONDS=0.05, CHATBOT_STREAM_MAX_SECONDS=0.2):
+            response = await self.async_client.get(self.stream_url(conversation), headers=self.auth_headers)
+            body = "".join([chunk.decode() async for chunk in response.streaming_content])
+
+        self.assertIn(": keep-alive", body)
+        self.assertEqual(self.parse_frames(body), [("error", {"status": "timeout"})])
+
+
+class StateWaitTests(ChatbotTestCase):
+    """Long-polling the conversation state with GET /chatbot/{conversation_id}/state/wait."""
+
+    async def wait(self, conversation_id: UUID, state: str, max_wait: float) -> tuple[int, dict]:
+        """Long-poll the state of a conversation, returning the response status and body."""
+        response = await self.async_client.get(
+            f"/api/chatbot/{conversation_id}/state/wait",
+            {"state": state, "timeout": max_wait},
+            headers=self.auth_headers,
+        )
+        return response.status_code, response.json()
+
+    async def test_returns_the_known_state_after_the_timeout(self) -> None:
+        """Without a change the current state is returned once the timeout elapsed."""
+        conversation = await sync_to_async(self.create_conversation)()
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+
+        result = await self.wait(conversation.id, models.Conversation.State.COMPLETE, max_wait=0.2)
+
+        self.assertEqual(result, (200, {"state": models.Conversation.State.COMPLETE}))
+        self.assertGreaterEqual(loop.time() - start, 0.2)
+
+    async def test_returns_at_once_when_the_state_differs(self) -> None:
+        """A client knowing an outdated state gets the current one without waiting."""
+        conversation = await sync_to_async(self.create_conversation)()
+
+        result = await asyncio.wait_for(self.wait(conversation.id, models.Conversation.State.PENDING, max_wait=5), 1)
+
+        self.assertEqual(result, (200, {"state": models.Conversation.State.COMPLETE}))
+
+    async def test_returns_when_the_state_changes(self) -> None:
+        """A published state change ends the wait."""
+        conversation = await sync_to_async(self.create_conversation)()
+        broker = get_broker()
+
+        waiting = asyncio.create_task(self.wait(conversation.id, models.Conversation.State.COMPLETE, max_wait=5))
+        while utils.state_channel(conversation.id) not in broker.subscribers:  # noqa: ASYNC110
+            await asyncio.sleep(0.01)
+        utils.publish_state(conversation.id, models.Conversation.State.PENDING)
+
+        result = await asyncio.wait_for(waiting, 1)
+        self.assertEqual(result, (200, {"state": models.Conversation.State.PENDING}))
+
+    async def test_unknown_conversation(self) -> None:
+        """Waiting on a conversation that does not exist is a 404."""
+        status, _ = await self.wait(uuid4(), models.Conversation.State.COMPLETE, max_wait=0.1)
+
+        self.assertEqual(status, 404)
+
+
+class ThreadReuseTests(ChatbotTestCase):
+    """One LLM thread per conversation, reused across messages and rebuilt when it is gone."""
+
+    def post(self, conversation: models.Conversation, text: str) -> models.Message:
+        """Create a user message and reply to it like the reply_message task does."""
+        message = models.Message(conversation=conversation, text=text)
+        with mock.patch.object(tasks.reply_message, "delay"):
+            message.create(self.user)
+        tasks.reply_message(conversation.id, message.id)
+        return message
+
+    def test_thread_is_created_once_and_reused(self) -> None:
+        """The first message creates the thread, the next ones are added to it."""
+        conversation = self.create_conversation()
+        provider = get_llm_provider()
+
+        with mock.patch.object(provider, "create_thread", wraps=provider.create_thread) as create_thread:
+            self.post(conversation, "one")
+            conversation.refresh_from_db()
+            thread_id = conversation.thread_id
+            self.post(conversation, "two")
+
+        create_thread.assert_called_once()
+        conversation.refresh_from_db()
+        self.assertEqual(conversation.thread_id, thread_id)
+        thread = provider.threads[thread_id]
+        self.assertEqual([m["content"] for m in thread if m["role"] == "user"], ["one", "two"])
+        self.assertEqual([m["role"] for m in thread], ["user", "assistant", "user", "assistant"])
+
+    def test_missing_thread_is_rebuilt_from_the_stored_messages(self) -> None:
+        """A thread unknown to the provider is replaced by one seeded with the stored messages."""
+        conversation = self.create_conversation()
+        self.post(conversation, "one")
+        conversation.refresh_from_db()
+        get_llm_provider().threads.pop(conversation.thread_id)
+
+        self.post(conversation, "two")
+
+        conversation.refresh_from_db()
+        thread = get_llm_provider().threads[conversation.thread_id]
+        replies = models.Message.objects.filter(conversation=conversation, type=models.Message.Type.CHATBOT)
+        self.assertEqual(replies.count(), 2)
+        self.assertEqual(
+            [(m["role"], m["content"]) for m in thread[:3]],
+            [("user", "one"), ("assistant", replies.order_by("created_at").first().text), ("user", "two")],
+        )
+
+
+@override_settings(CHATBOT_REPLY_ENGINE="CHAT")
+class ChatReplyTests(ChatbotTestCase):
+    """Replies of the CHAT engine, a single chat completion of the persona and the latest messages."""
+
+    def test_reply_is_a_chat_completion_of_the_persona(self) -> None:
+        """The persona of the assistant leads the prompt, no thread or run is involved."""
+        assistant = models.Assistant(
+            content_hash="0" * 64,
+            assistant_id="fake-asst",
+            model="persona-model",
+            instructions="reply like B",
+        )
+        assistant.create(self.user)
+        conversation = self.create_conversation()
+        message = models.Message(conversation=conversation, text="hello")
+        with mock.patch.object(tasks.reply_message, "delay"):
+            message.create(self.user)
+        provider = get_llm_provider()
+
+        with (
+            mock.patch.object(provider, "stream_chat", wraps=provider.stream_chat) as stream_chat,
+            mock.patch.object(provider, "create_thread") as create_thread,
+            mock.patch.object(provider, "run") as run,
+        ):
+            text = tasks.reply_message(conversation.id, message.id)
+
+        model, messages, _ = stream_chat.call_args.args
+        self.assertEqual(model, "persona-model")
+        self.assertEqual(
+            messages,
+            [{"role": "system", "content": "reply like B"}, {"role": "user", "content": "hello"}],
+        )
+        create_thread.assert_not_called()
+        run.assert_not_called()
+        reply = models.Message.objects.get(conversation=conversation, type=models.Message.Type.CHATBOT)
+        self.assertEqual(reply.text, text)
+        conversation.refresh_from_db()
+        self.assertEqual(conversation.state, models.Conversation.State.COMPLETE)
+
+
+class ReplyFailureTests(ChatbotTestCase):
+    """A reply that fails ends the reply stream and leaves the conversation in the FAILED state."""
+
+    def setUp(self) -> None:
+        """Create a conversation waiting for the reply to a user message."""
+        super().setUp()
+        self.conversation = self.create_conversation()
+        self.message = models.Message(conversation=self.conversation, text="hello")
+        with mock.patch.object(tasks.reply_message, "delay"):
+            self.message.create(self.user)
+
+    def assert_failed(self, publish_reply_event: mock.Mock, publish_state: mock.Mock, status: str) -> None:
+        """Check the conversation failed and the failure was published."""
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.state, models.Conversation.State.FAILED)
+        publish_reply_event.assert_called_with(self.conversation.id, "error", status=status)
+        publish_state.assert_called_with(self.conversation.id, models.Conversation.State.FAILED)
+        self.assertFalse(models.Message.objects.filter(type=models.Message.Type.CHATBOT).exists())
+
+    def test_failed_run(self) -> None:
+        """A run that does not complete fails the reply with its status."""
+        provider = get_llm_provider()
+
+        with (
+            mock.patch.object(provider, "run", return_value=RunResult(status="expired", text=None)),
+            mock.patch.object(utils, "publish_reply_event") as publish_reply_event,
+            mock.patch.object(utils, "publish_state") as publish_state,
+        ):
+            self.assertIsNone(tasks.reply_message(self.conversation.id, self.message.id))
+
+        self.assert_failed(publish_reply_event, publish_state, "expired")
+
+    def test_exception(self) -> None:
+        """An error raised while replying fails the reply and is raised again."""
+        provider = get_llm_provider()
+
+        with (
+            mock.patch.object(provider, "create_thread", side_effect=RuntimeError),
+            mock.patch.object(utils, "publish_reply_event") as publish_reply_event,
+            mock.patch.object(utils, "publish_state") as publish_state,
+            self.assertRaises(RuntimeError),
+        ):
+            tasks.reply_message(self.conversation.id, self.message.id)
+
+        self.assert_failed(publish_reply_event, publish_state, "failed")
+
+    def test_next_message_is_replied_to(self) -> None:
+        """A failed conversation accepts new messages, which make it PENDING again."""
+        utils.fail_reply(self.conversation.id, "failed")
+        self.conversation.refresh_from_db()
+
+        message = models.Message(conversation=self.conversation, text="again")
+        with mock.patch.object(tasks.reply_message, "delay"):
+            message.create(self.user)
+
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.state, models.Conversation.State.PENDING)
+
+
+class ConversationCreationTests(ChatbotTestCase):
+    """POST /chatbot, with the assistant optionally created in a task and deduplicated by content."""
+
+    RECORD = "A: hi there\nB: hello, how are you\nA: fine thanks, you?\nB: great, see you later\n"
+
+    def setUp(self) -> None:
+        """Store the uploaded records in a temporary directory."""
+        super().setUp()
+        self.use_temporary_file_storage()
+
+    def new_chatbot(self, name: str, target: str = "B") -> dict:
+        """Create a conversation from RECORD through the API."""
+        record = SimpleUploadedFile("record.txt", self.RECORD.encode(), content_type="text/plain")
+        response = self.client.post("/api/chatbot", {"name": name, "target": target, "file": record}, **self.auth)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_identical_records_share_one_assistant(self) -> None:
+        """The assistant of a record and target is created once, other targets get their own."""
+        provider = get_llm_provider()
+
+        with mock.patch.object(provider, "create_assistant", wraps=provider.create_assistant) as create_assistant:
+            first, second, other = self.new_chatbot("first"), self.new_chatbot("second"), self.new_chatbot("other", "A")
+
+        self.assertEqual(create_assistant.call_count, 2)
+        self.assertEqual(first["assistant_id"], second["assistant_id"])
+        self.assertNotEqual(first["assistant_id"], other["assistant_id"])
+        self.assertEqual(models.Assistant.objects.count(), 2)
+
+    @override_settings(CHATBOT_DEFERRED_ASSISTANT_CREATION=True)
+    def test_deferred_creation_provisions_the_assistant_after_commit(self) -> None:
+        """The conversation is created PROVISIONING, the task fills in its assistant once committed."""
+        with mock.patch.object(tasks.create_assistant, "delay") as delay, self.captureOnCommitCallbacks(execute=True):
+            created = self.new_chatbot("deferred")
+            # the assistant is only created once the conversation is committed
+            delay.assert_not_called()
+
+        self.assertEqual(created["state"], models.Conversation.State.PROVISIONING)
+        self.assertIsNone(created["assistant_id"])
+        delay.assert_called_once()
+        tasks.create_assistant(**delay.call_args.kwargs)
+
+        conversation = models.Conversation.objects.get(name="deferred")
+        self.assertEqual(conversation.state, models.Conversation.State.COMPLETE)
+        self.assertEqual(
+            conversation.assistant_id,
+            models.Assistant.objects.values_list("assistant_id", flat=True).get(),
+        )
+
+    def test_deferred_creation_reuses_a_registered_assistant_at_once(self) -> None:
+        """A record whose assistant is already registered needs no task."""
+        registered = self.new_chatbot("first")
+
+        with self.settings(CHATBOT_DEFERRED_ASSISTANT_CREATION=True), self.captureOnCommitCallbacks() as callbacks:
+            created = self.new_chatbot("second")
+
+        self.assertEqual(callbacks, [])
+        self.assertEqual(created["assistant_id"], registered["assistant_id"])
+        self.assertNotEqual(created["state"], models.Conversation.State.PROVISIONING)
+
+    def test_record_is_deleted_when_the_creation_fails(self) -> None:
+        """A record no conversation refers to is not left behind in the storage."""
+        record = SimpleUploadedFile("record.txt", self.RECORD.encode(), content_type="text/plain")
+
+        with (
+            mock.patch.object(get_llm_provider(), "create_assistant", side_effect=RuntimeError),
+            self.assertRaises(RuntimeError),
+        ):
+            utils.create_conversation(self.user, "failed", record, "B")
+
+        self.assertFalse(models.Conversation.objects.filter(name="failed").exists())
+        self.assertEqual([path for path in get_file_storage().root.rglob("*") if path.is_file()], [])
+
+
+class AsyncChatbotApiTests(ChatbotTestCase):
+    """Routes of the async controller under /async/chatbot, on the async ORM and the asynchronous provider."""
+
+    def setUp(self) -> None:
+        """Store the uploaded records in a temporary directory."""
+        super().setUp()
+        self.use_temporary_file_storage()
+
+    async def test_new_chatbot_creates_the_assistant_with_the_async_provider(self) -> None:
+        """The assistant is created with `acreate_assistant` and the conversation is owned by the user."""
+        provider = get_llm_provider()
+        record = SimpleUploadedFile("record.txt", ConversationCreationTests.RECORD.encode(), content_type="text/plain")
+
+        with (
+            mock.patch.object(provider, "acreate_assistant", wraps=provider.acreate_assistant) as acreate_assistant,
+            mock.patch.object(provider, "create_assistant") as create_assistant,
+        ):
+            response = await self.async_client.post(
+                "/api/async/chatbot",
+                {"name": "async", "target": "B", "file": record},
+                headers=self.auth_headers,
+            )
+
+        self.assertEqual(response.status_code, 200)
+        acreate_assistant.assert_called_once()
+        create_assistant.assert_not_called()
+        conversation = await models.Conversation.objects.aget(id=response.json()["id"])
+        self.assertEqual(conversation.created_by_user_id, self.user.id)
+        self.assertEqual(
+            conversation.assistant_id,
+            await models.Assistant.objects.values_list("assistant_id", flat=True).aget(),
+        )
+
+    async def test_record_is_deleted_when_the_creation_fails(self) -> None:
+        """A record no conversation refers to is not left behind in the storage."""
+        record = SimpleUploadedFile("record.txt", ConversationCreationTests.RECORD.encode(), content_type="text/plain")
+
+        with (
+            mock.patch.object(get_llm_provider(), "acreate_assistant", side_effect=RuntimeError),
+            self.assertRaises(RuntimeError),
+        ):
+            await utils.acreate_conversation(self.user, "failed", record, "B")
+
+        self.assertFalse(await models.Conversation.objects.filter(name="failed").aexists())
+        self.assertEqual([path for path in get_file_storage().root.rglob("*") if path.is_file()], [])
+
+    async def test_conversation_routes(self) -> None:
+        """Posting, listing, renaming, reading and deleting go through the async routes."""
+        conversation = await sync_to_async(self.create_conversation)()
+        url = f"/api/async/chatbot/{conversation.id}"
+
+        with mock.patch.object(tasks.reply_message, "delay"):
+            response = await self.async_client.post(
+                url,
+                {"text": "hello"},
+                content_type="application/json",
+                headers=self.auth_headers,
+            )
+        self.assertEqual(response.status_code, 200)
+        message = await models.Message.objects.aget(id=response.json()["id"])
+        self.assertEqual(message.created_by_user_id, self.user.id)
+
+        response = await self.async_client.get("/api/async/chatbot", headers=self.auth_headers)
+        self.assertEqual([item["last_message"] for item in response.json()["items"]], ["hello"])
+        response = await self.async_client.get(url, headers=self.auth_headers)
+        self.assertEqual([item["text"] for item in response.json()["items"]], ["hello"])
+        response = await self.async_client.get(f"{url}/state", headers=self.auth_headers)
+        self.assertEqual(response.json(), {"state": models.Conversation.State.PENDING})
+
+        response = await self.async_client.put(
+            url,
+            {"name": "renamed"},
+            content_type="application/json",
+            headers=self.auth_headers,
+        )
+        self.assertEqual(response.json()["name"], "renamed")
+        response = await self.async_client.put(f"{url}/read", headers=self.auth_headers)
+        self.assertEqual(response.status_code, 200)
+
+        response = await self.async_client.delete(url, headers=self.auth_headers)
+        self.assertEqual(response.json(), {"id": str(conversation.id)})
+        response = await self.async_client.get(f"{url}/state", headers=self.auth_headers)
+        self.assertEqual(response.status_code, 404)
+        await conversation.arefresh_from_db(fields=["name", "last_read_at"])
+        self.assertEqual(conversation.name, "renamed")
+        self.assertIsNotNone(conversation.last_read_at)
+
+
+class MessagePaginationTests(ChatbotTestCase):
+    """Keyset pagination of GET /chatbot/{conversation_id}."""
+
+    def setUp(self) -> None:
+        """Create a conversation with five messages, three of them created at the same time."""
+        super().setUp()
+        self.conversation = self.create_conversation()
+        with mock.patch.object(tasks.reply_message, "delay"):
+            for i in range(5):
+                models.Message(conversation=self.conversation, text=f"message {i}").create(self.user)
+
+        messages = models.Message.objects.filter(conversation=self.conversation).order_by("created_at")
+        tied = list(messages.values_list("id", flat=True)[1:4])
+        models.Message.objects.filter(id__in=tied).update(created_at=messages[1].created_at)
+        self.ids = [str(pk) for pk in messages.order_by("created_at", "id").values_list("id", flat=True)]
+
+    def get_page(self, **params: str | int) -> dict:
+        """Get a page of the messages of the conversation."""
+        response = self.client.get(f"/api/chatbot/{self.conversation.id}", params, **self.auth)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_pages_back_to_the_first_message_and_forward_again(self) -> None:
+        """`before` pages to older messages and `after` to newer ones, ties on created_at included."""
+        page = self.get_page(limit=2)
+        self.assertEqual([item["id"] for item in page["items"]], self.ids[3:])
+        self.assertTrue(page["has_more"])
+
+        older = []
+        while page["has_more"]:
+            page = self.get_page(limit=2, before=page["before"])
+            older = [item["id"] for item in page["items"]] + older
+        self.assertEqual(older, self.ids[:3])
+
+        page = self.get_page(limit=3, after=page["after"])
+        self.assertEqual([item["id"] for item in page["items"]], self.ids[1:4])
+        self.assertTrue(page["has_more"])
+        page = self.get_page(limit=3, after=page["after"])
+        self.assertEqual([item["id"] for item in page["items"]], self.ids[4:])
+        self.assertFalse(page["has_more"])
+
+    def test_rejects_two_cursors_and_malformed_cursors(self) -> None:
+        """Only one well formed cursor may be given."""
+        cursor = self.get_page(limit=1)["before"]
+        url = f"/api/chatbot/{self.conversation.id}"
+
+        response = self.client.get(url, {"before": cursor, "after": cursor}, **self.auth)
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(url, {"before": "not a cursor"}, **self.auth)
+        self.assertEqual(response.status_code, 400)
+
+
+class MessageSyncTests(ChatbotTestCase):
+    """Delta sync of GET /chatbot/{conversation_id}/sync."""
+
+    def setUp(self) -> None:
+        """Create a conversation with three messages."""
+        super().setUp()
+        self.conversation = self.create_conversation()
+        self.messages = [models.Message(conversation=self.conversation, text=f"message {i}") for i in range(3)]
+        with mock.patch.object(tasks.reply_message, "delay"):
+            for message in self.messages:
+                message.create(self.user)
+
+    def sync(self, **params: str | int | None) -> dict:
+        """Sync the messages of the conversation."""
+        params = {key: value for key, value in params.items() if value is not None}
+        response = self.client.get(f"/api/chatbot/{self.conversation.id}/sync", params, **self.auth)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_pages_through_the_changes(self) -> None:
+        """A full sync pages through every message in change order."""
+        first = self.sync(limit=2)
+        second = self.sync(limit=2, watermark=first["watermark"])
+
+        self.assertTrue(first["has_more"])
+        self.assertFalse(second["has_more"])
+        self.assertEqual(
+            [item["id"] for item in first["items"] + second["items"]],
+            [str(message.id) for message in self.messages],
+        )
+        self.assertEqual(second["state"], self.conversation.state)
+
+    @override_settings(CHATBOT_SYNC_OVERLAP_SECONDS=0)
+    def test_returns_edited_and_deleted_messages(self) -> None:
+        """Messages changed after the watermark are returned, soft deleted ones flagged."""
+        watermark = self.sync()["watermark"]
+        self.assertEqual(self.sync(watermark=watermark)["items"], [])
+
+        self.messages[0].text = "edited"
+        self.messages[0].save(self.user)
+        self.messages[1].delete(self.user)
+
+        changes = {item["id"]: item for item in self.sync(watermark=watermark)["items"]}
+        self.assertEqual(set(changes), {str(self.messages[0].id), str(self.messages[1].id)})
+        self.assertEqual(changes[str(self.messages[0].id)]["text"], "edited")
+        self.assertTrue(changes[str(self.messages[1].id)]["is_delete"])
+
+    def test_last_page_watermark_overlaps_recent_changes(self) -> None:
+        """Messages changed within the overlap window are returned again by the next sync."""
+        watermark = self.sync()["watermark"]
+
+        again = self.sync(watermark=watermark)
+
+        self.assertEqual([item["id"] for item in again["items"]], [str(message.id) for message in self.messages])
+        self.assertFalse(again["has_more"])
+
+
+class ConversationListTests(ChatbotTestCase):
+    """GET /chatbot, a filterable page of conversations with their last message preview."""
+
+    def get_page(self, **params: str | int) -> dict:
+        """Get a page of the conversations of the user."""
+        response = self.client.get("/api/chatbot", params, **self.auth)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_lists_own_conversations_with_preview_and_unread_count(self) -> None:
+        """Conversations with recent activity come first, with their last message and unread replies."""
+        quiet, active = self.create_conversation("quiet"), self.create_conversation("active")
+        other = User.objects.create_user(email="other@example.com", password="password")  # noqa: S106
+        models.Conversation(name="theirs", assistant_id="fake-asst").create(other)
+
+        with mock.patch.object(tasks.reply_message, "delay"):
+            models.Message(conversation=quiet, text="hello").create(self.user)
+        tasks.save_reply(quiet, "first reply")
+        tasks.save_reply(quiet, "second reply")
+
+        items = self.get_page()["items"]
+        self.assertEqual([item["name"] for item in items], ["quiet", "active"])
+        self.assertEqual((items[0]["last_message"], items[0]["unread_count"]), ("second reply", 2))
+        self.assertEqual((items[1]["last_message"], items[1]["unread_count"]), (None, 0))
+
+        response = self.client.put(f"/api/chatbot/{quiet.id}/read", **self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_page()["items"][0]["unread_count"], 0)
+        self.assertEqual(active.id, UUID(self.get_page()["items"][1]["id"]))
+
+    def test_filters_by_name_and_pages_with_the_after_cursor(self) -> None:
+        """The `after` cursor pages through the matching conversations in name order, names holding "|" included."""
+        for name in ("alpha c", "beta", "alpha a", "alpha b|x", "alpha d"):
+            self.create_conversation(name)
+
+        names, page = [], {"after": None, "has_more": True}
+        while page["has_more"]:
+            params = {"name": "alpha", "order": "name", "limit": 2}
+            page = self.get_page(**params, **({"after": page["after"]} if page["after"] else {}))
+            names += [item["name"] for item in page["items"]]
+
+        self.assertEqual(names, ["alpha a", "alpha b|x", "alpha c", "alpha d"])
+
+
+class MessageCounterTests(ChatbotTestCase):
+    """The denormalized `message_count` and `last_message_at` of conversations."""
+
+    def setUp(self) -> None:
+        """Create a conversation with two messages."""
+        super().setUp()
+        self.conversation = self.create_conversation()
+        self.messages = [models.Message(conversation=self.conversation, text=text) for text in ("one", "two")]
+        with mock.patch.object(tasks.reply_message, "delay"):
+            for message in self.messages:
+                message.create(self.user)
+
+    def counters(self) -> tuple:
+        """Stored message count and last message time of the conversation."""
+        return models.Conversation.objects.values_list("message_count", "last_message_at").get(
+            pk=self.conversation.pk,
+        )
+
+    def test_counts_created_and_deleted_messages(self) -> None:
+        """Creating counts the message, deleting uncounts it and falls back to the previous message."""
+        self.assertEqual(self.counters(), (2, self.messages[1].created_at))
+
+        self.messages[1].delete(self.user)
+        self.assertEqual(self.counters(), (1, self.messages[0].created_at))
+
+        self.messages[1].delete(self.user)
+        self.messages[0].delete(self.user)
+        self.assertEqual(self.counters(), (0, None))
+
+    def test_rebuild_command_repairs_drifted_counters(self) -> None:
+        """rebuild_conversation_counters recomputes the counters from the messages."""
+        models.Conversation.objects.filter(pk=self.conversation.pk).update(message_count=7, last_message_at=None)
+
+        call_command("rebuild_conversation_counters", batch_size=1, stdout=StringIO())
+
+        self.assertEqual(self.counters(), (2, self.messages[1].created_at))
+
+
+def chunked(data: bytes, size: int) -> list[bytes]:
+    """Split bytes into chunks of `size` bytes, like `UploadedFile.chunks` with a tiny chunk size."""
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+class IngestionTests(SimpleTestCase):
+    """Streaming ingestion of uploaded chat records."""
+
+    def test_lines_are_decoded_across_chunks(self) -> None:
+        """Multibyte characters and CRLF line breaks split across chunks are decoded once whole."""
+        data = "甲：你好嗎\r\nB: fine\n乙：再見".encode()
+
+        for size in (1, 2, 3, 5):
+            with self.subTest(size=size):
+                self.assertEqual(
+                    list(ingestion.iter_lines(chunked(data, size))),
+                    ["甲：你好嗎", "B: fine", "乙：再見"],
+                )
+
+    def test_untimestamped_lines_of_unknown_speakers_continue_the_turn(self) -> None:
+        """Past MIN_SPEAKERS speakers a `xx: yy` line of an unknown speaker is message text."""
+        lines = ["A: hi", "B: look at this", "note: it is text", "", "A: ok"]
+
+        self.assertEqual(
+            list(ingestion.iter_turns(lines)),
+            [("A", "hi"), ("B", "look at this\nnote: it is text"), ("A", "ok")],
+        )
+
+    def test_unknown_speakers_start_turns_below_min_speakers(self) -> None:
+        """With fewer than MIN_SPEAKERS known speakers an unknown speaker starts a turn."""
+        self.assertEqual(
+            list(ingestion.iter_turns(["A: hi", "B: hello"], speakers=["A"])),
+            [("A", "hi"), ("B", "hello")],
+        )
+
+    def test_fullwidth_colons(self) -> None:
+        """Speakers are also separated from their text by a fullwidth colon."""
+        self.assertEqual(
+            list(ingestion.iter_turns(["甲：你好", "乙 ： 你好嗎"])),
+            [("甲", "你好"), ("乙", "你好嗎")],
+        )
+
+    def test_timestamped_and_line_exports_always_start_turns(self) -> None:
+        """Timestamped lines and LINE tab exports start a turn even for speakers not seen before."""
+        lines = ["A: hi", "B: hello", "12/01/2024, 10:00 - Carol: hey", "10:01\tDave\tyo", "10:02\tA\tbye"]
+
+        self.assertEqual(
+            list(ingestion.iter_turns(lines)),
+            [("A", "hi"), ("B", "hello"), ("Carol", "hey"), ("Dave", "yo"), ("A", "bye")],
+        )
+
+    def test_starts_turn(self) -> None:
+        """Unmatched lines never start a turn, known speakers always do."""
+        match = ingestion.COLON_TURN_PATTERN.match("C: text")
+
+        self.assertFalse(ingestion.starts_turn(None, set()))
+        self.assertTrue(ingestion.starts_turn(match, {"A"}))
+        self.assertFalse(ingestion.starts_turn(match, {"A", "B"}))
+        self.assertTrue(ingestion.starts_turn(match, {"A", "B", "C"}))
+
+    def test_excerpt_keeps_the_best_turns_within_the_token_budget(self) -> None:
+        """Turns are selected by score within the budget and kept in record order."""
+        turns = [f"B: turn {i} is written the way B usually writes" for i in range(20)]
+        turns[3] = turns[11] = "B: ok"
+        data = "\n".join(turns).encode()
+        token_budget = 60
+
+        digest = ingestion.ingest_record(chunked(data, 7), "B", token_budget=token_budget)
+
+        excerpt = digest.excerpt.splitlines()
+        self.assertEqual(digest.sha256, hashlib.sha256(data).hexdigest())
+        self.assertTrue(excerpt)
+        self.assertLessEqual(sum(ingestion.estimate_tokens(line) for line in excerpt), token_budget)
+        self.assertNotIn("B：ok", excerpt)
+        positions = [turns.index(line.replace("：", ": ", 1)) for line in excerpt]
+        self.assertEqual(positions, sorted(positions))
+
+    def test_excerpt_pairs_the_target_turns_with_their_prompt(self) -> None:
+        """A turn answering another speaker is selected with the line it answers."""
+        data = "A: how are you?\nB: 我很好，謝謝\n".encode()
+
+        digest = ingestion.ingest_record(chunked(data, 2), "B", token_budget=100)
+
+        self.assertEqual(digest.excerpt, "A：how are you?\nB：我很好，謝謝")
+
+    def test_excerpt_falls_back_to_the_record_head(self) -> None:
+        """Without a turn of the target the excerpt is the head of the record within the budget."""
+        lines = [f"line {i} of a record in an unknown format" for i in range(50)]
+
+        digest = ingestion.ingest_record(chunked("\n".join(lines).encode(), 16), "B", token_budget=40)
+
+        head = digest.excerpt.splitlines()
+        self.assertTrue(head)
+        self.assertEqual(head, lines[: len(head)])
+        self.assertLessEqual(sum(ingestion.estimate_tokens(line) for line in head), 40)
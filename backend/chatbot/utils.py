@@ -0,0 +1,924 @@
+import asyncio
+import hashlib
+import json
+from collections.abc import AsyncIterator
+from datetime import datetime
+from datetime import timedelta
+from functools import partial
+from typing import Any
+from uuid import UUID
+from uuid import uuid4
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AbstractBaseUser
+from django.core.files.uploadedfile import UploadedFile
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Count
+from django.db.models import IntegerField
+from django.db.models import OuterRef
+from django.db.models import Q
+from django.db.models import QuerySet
+from django.db.models import Subquery
+from django.db.models import Value
+from django.db.models.functions import Coalesce
+from django.db.models.functions import Left
+from django.db.utils import IntegrityError
+from django.utils import timezone
+from django.utils.text import get_valid_filename
+
+from core import exceptions as core_exceptions
+from core.broker import get_broker
+from core.providers import get_llm_provider
+from core.storage import get_file_storage
+from core.utils import decode_cursor
+from core.utils import encode_cursor
+from core.utils import get_system_user
+
+from . import ingestion
+from . import models
+
+
+ASSISTANT_MODEL = "gpt-4o-2024-11-20"
+MESSAGE_PREVIEW_CHARS = 100
+# sort key and direction of the conversation list orderings, ties are broken on id in the same direction.
+# "recent" sorts on the latest message, falling back to the creation of conversations without messages.
+CONVERSATION_ORDERINGS = {
+    "recent": (Coalesce("last_message_at", "created_at"), True),
+    "name": (Coalesce("name", Value("")), False),
+}
+
+
+def build_assistant_instructions(record: str, target: str) -> str:
+    """Build the instructions of a chatbot assistant imitating a speaker of a chat record.
+
+    Args:
+        record (str): content, or selected excerpt, of the uploaded chat record.
+        target (str): the speaker in the record the assistant should imitate.
+
+    Returns:
+        str: assistant instructions, empty when there is no record.
+    """
+    if record == "":
+        return ""
+    return f"Your conversation with the chatbot. you need to reply message like style of following record content {target}'s role\n\n {record}"
+
+
+def save_record_file(user: AbstractBaseUser, file: UploadedFile) -> str:
+    """Stream an uploaded chat record to the file storage.
+
+    Args:
+        user (AbstractBaseUser): the user uploading the record.
+        file (UploadedFile): the uploaded record.
+
+    Returns:
+        str: storage key of the record.
+    """
+    key = f"records/{user.pk}/{uuid4().hex}/{get_valid_filename(file.name or 'record.txt')[:100]}"
+    file.seek(0)
+    return get_file_storage().save(key, file)  # type: ignore
+
+
+def assistant_content_hash(record_sha256: str, target: str, model: str = ASSISTANT_MODEL) -> str:
+    """Hash the content an assistant is built from.
+
+    Args:
+        record_sha256 (str): hex sha256 of the raw uploaded chat record, see `ingestion.ingest_record`.
+        target (str): the speaker in the record the assistant imitates.
+        model (str, optional): OpenAI model of the assistant. Defaults to ASSISTANT_MODEL.
+
+    Returns:
+        str: hex sha256 digest.
+    """
+    return hashlib.sha256(f"{record_sha256}\0{target}\0{model}".encode()).hexdigest()
+
+
+def get_or_create_assistant(user: AbstractBaseUser, name: str, instructions: str, content_hash: str) -> str:
+    """Get the assistant registered for a content hash, creating it on the LLM provider when there is none.
+
+    Args:
+        user (AbstractBaseUser): the user registering the assistant.
+        name (str): name of a newly created assistant.
+        instructions (str): instructions of a newly created assistant.
+        content_hash (str): hash of the content the assistant is built from, see `assistant_content_hash`.
+
+    Returns:
+        str: id of the assistant.
+    """
+    registered = models.Assistant.objects.filter(content_hash=content_hash).values_list("assistant_id", flat=True)
+    if (assistant_id := registered.first()) is not None:
+        return assistant_id
+
+    assistant_id = get_llm_provider().create_assistant(name, instructions, ASSISTANT_MODEL)
+
+    entry = models.Assistant(
+        content_hash=content_hash,
+        assistant_id=assistant_id,
+        model=ASSISTANT_MODEL,
+        instructions=instructions,
+    )
+    try:
+        with transaction.atomic():
+            entry.create(user)
+    except IntegrityError:
+        # registered concurrently by an identical upload
+        return models.Assistant.objects.get(content_hash=content_hash).assistant_id
+
+    return assistant_id
+
+
+async def aget_or_create_assistant(user: AbstractBaseUser, name: str, instructions: str, content_hash: str) -> str:
+    """Asynchronous version of `get_or_create_assistant`, the assistant is created with the asynchronous provider."""
+    registered = models.Assistant.objects.filter(content_hash=content_hash).values_list("assistant_id", flat=True)
+    if (assistant_id := await registered.afirst()) is not None:
+        return assistant_id
+
+    assistant_id = await get_llm_provider().acreate_assistant(name, instructions, ASSISTANT_MODEL)
+
+    try:
+        await models.Assistant.objects.acreate(
+            created_by_user=user,
+            content_hash=content_hash,
+            assistant_id=assistant_id,
+            model=ASSISTANT_MODEL,
+            instructions=instructions,
+        )
+    except IntegrityError:
+        # registered concurrently by an identical upload
+        return (await models.Assistant.objects.aget(content_hash=content_hash)).assistant_id
+
+    return assistant_id
+
+
+def reply_stream_channel(conversation_id: UUID) -> str:
+    """Get the pub/sub channel the chatbot reply of a conversation is streamed to.
+
+    Args:
+        conversation_id (UUID): id of the conversation.
+
+    Returns:
+        str: channel name.
+    """
+    return f"chatbot:reply-stream:{conversation_id}"
+
+
+def publish_reply_event(conversation_id: UUID, event: str, **data: Any) -> None:
+    """Publish a reply stream event of a conversation.
+
+    Args:
+        conversation_id (UUID): id of the conversation.
+        event (str): event name, one of `delta`, `done` or `error`.
+        **data (Any): event payload.
+    """
+    get_broker().publish(reply_stream_channel(conversation_id), {"event": event, "data": data})
+
+
+async def apublish_reply_event(conversation_id: UUID, event: str, **data: Any) -> None:
+    """Asynchronous version of `publish_reply_event`."""
+    await get_broker().apublish(reply_stream_channel(conversation_id), {"event": event, "data": data})
+
+
+def format_sse(event: str, data: dict[str, Any]) -> str:
+    """Format an event as a Server-Sent-Events frame.
+
+    Args:
+        event (str): event name.
+        data (dict[str, Any]): event payload.
+
+    Returns:
+        str: SSE frame.
+    """
+    return f"event: {event}\ndata: {json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False)}\n\n"
+
+
+async def reply_event_stream(conversation_id: UUID) -> AsyncIterator[str]:
+    """Stream the chatbot reply of a conversation as Server-Sent-Events.
+
+    The channel is subscribed before the conversation state is read, so a reply finishing in between
+    is never missed. The stream ends after the `done` or `error` event. The state is read again on every
+    keep-alive, a reply whose last event was lost (or a conversation deleted meanwhile) ends the stream
+    with a `done` event, and it ends with a "timeout" `error` event after `settings.CHATBOT_STREAM_MAX_SECONDS`.
+
+    Args:
+        conversation_id (UUID): id of the conversation.
+
+    Yields:
+        str: SSE frames.
+    """
+    states = models.Conversation.objects.filter(id=conversation_id).values_list("state", flat=True)
+    async with get_broker().subscribe(reply_stream_channel(conversation_id)) as subscription:
+        state = await states.afirst()
+        if state != models.Conversation.State.PENDING:
+            yield format_sse("done", {"state": state})
+            return
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.CHATBOT_STREAM_MAX_SECONDS
+        while (remaining := deadline - loop.time()) > 0:
+            message = await subscription.get(max_wait=min(settings.CHATBOT_STREAM_KEEPALIVE_SECONDS, remaining))
+            if message is None:
+                state = await states.afirst()
+                if state != models.Conversation.State.PENDING:
+                    yield format_sse("done", {"state": state})
+                    return
+
+                yield ": keep-alive\n\n"
+                continue
+
+            yield format_sse(message["event"], message["data"])
+            if message["event"] in ("done", "error"):
+                return
+
+        yield format_sse("error", {"status": "timeout"})
+
+
+def state_channel(conversation_id: UUID) -> str:
+    """Get the pub/sub channel the state changes of a conversation are published to.
+
+    Args:
+        conversation_id (UUID): id of the conversation.
+
+    Returns:
+        str: channel name.
+    """
+    return f"chatbot:state:{conversation_id}"
+
+
+def publish_state(conversation_id: UUID, state: str) -> None:
+    """Publish the new state of a conversation.
+
+    Args:
+        conversation_id (UUID): id of the conversation.
+        state (str): the new state.
+    """
+    get_broker().publish(state_channel(conversation_id), {"state": state})
+
+
+def fail_reply(conversation_id: UUID, status: str) -> None:
+    """Give up on the pending reply of a conversation.
+
+    The conversation leaves the PENDING state for FAILED, so clients waiting for a state change stop
+    waiting, and an `error` event ends the reply stream. It accepts new messages as usual.
+
+    Args:
+        conversation_id (UUID): id of the conversation.
+        status (str): why the reply failed, the final status of the run or "failed" for an error.
+    """
+    failed = models.Conversation.objects.filter(
+        id=conversation_id,
+        state=models.Conversation.State.PENDING,
+    ).update(
+        state=models.Conversation.State.FAILED,
+        updated_at=timezone.now(),
+        updated_by_user=get_system_user(),
+    )
+    publish_reply_event(conversation_id, "error", status=status)
+    if failed:
+        publish_state(conversation_id, models.Conversation.State.FAILED)
+
+
+async def wait_for_state_change(conversation_id: UUID, known_state: str | None, max_wait: float) -> str | None:
+    """Wait until the state of a conversation differs from the state the client knows.
+
+    The channel is subscribed before the state is read, so a change in between is never missed.
+
+    Args:
+        conversation_id (UUID): id of the conversation.
+        known_state (str | None): the state the client knows, None to return the current state at once.
+        max_wait (float): seconds to wait for a change.
+
+    Returns:
+        str | None: the current state, or None if the conversation does not exist.
+    """
+    async with get_broker().subscribe(state_channel(conversation_id)) as subscription:
+        state = await models.Conversation.objects.filter(id=conversation_id).values_list("state", flat=True).afirst()
+        if state is None:
+            return None
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + max_wait
+        while state == known_state and (remaining := deadline - loop.time()) > 0:
+            message = await subscription.get(max_wait=remaining)
+            if message is not None:
+                state = message["state"]
+
+        return state
+
+
+def _decode_message_cursor(cursor: str) -> tuple[datetime, UUID]:
+    timestamp, message_id = decode_cursor(cursor, 2)
+    try:
+        return datetime.fromisoformat(timestamp), UUID(message_id)
+    except ValueError as e:
+        raise core_exceptions.Http400BadRequestException("Invalid cursor") from e
+
+
+def message_page_queryset(
+    conversation: models.Conversation,
+    *,
+    before: str | None,
+    after: str | None,
+    limit: int,
+) -> QuerySet:
+    """Build the keyset query of a page of messages, ordered on (created_at, id).
+
+    Without cursors the page holds the latest messages. The query fetches one extra row to tell whether
+    more messages follow, see `build_message_page`.
+
+    Args:
+        conversation (models.Conversation): conversation to list the messages of.
+        before (str | None): cursor of the message the page ends before.
+        after (str | None): cursor of the message the page starts after.
+        limit (int): page size.
+
+    Raises:
+        Http400BadRequestException: both cursors are given or a cursor is malformed.
+
+    Returns:
+        QuerySet: message rows, in ascending order when paging `after` a cursor, descending otherwise.
+    """
+    if before is not None and after is not None:
+        raise core_exceptions.Http400BadRequestException("Only one of before and after may be given")
+
+    queryset = models.Message.objects.filter(conversation=conversation)
+
+    if after is not None:
+        created_at, message_id = _decode_message_cursor(after)
+        queryset = queryset.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=message_id))
+        return queryset.order_by("created_at", "id").values()[: limit + 1]
+
+    if before is not None:
+        created_at, message_id = _decode_message_cursor(before)
+        queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=message_id))
+    return queryset.order_by("-created_at", "-id").values()[: limit + 1]
+
+
+def build_message_page(rows: list[dict], limit: int, *, forward: bool) -> dict:
+    """Build a page of messages from the rows fetched by `message_page_queryset`.
+
+    Args:
+        rows (list[dict]): the fetched message rows.
+        limit (int): page size.
+        forward (bool): whether the rows were fetched `after` a cursor.
+
+    Returns:
+        dict: the messages in ascending order, the cursors of the first and last message, and whether
+            more messages follow in the paging direction.
+    """
+    has_more = len(rows) > limit
+    items = rows[:limit] if forward else rows[:limit][::-1]
+
+    return {
+        "items": items,
+        "before": encode_cursor(items[0]["created_at"].isoformat(), items[0]["id"]) if items else None,
+        "after": encode_cursor(items[-1]["created_at"].isoformat(), items[-1]["id"]) if items else None,
+        "has_more": has_more,
+    }
+
+
+def message_sync_queryset(conversation: models.Conversation, *, watermark: str | None, limit: int) -> QuerySet:
+    """Build the query of the messages created, edited or soft deleted after a watermark.
+
+    Rows are ordered on (updated_at, id), one extra row is fetched to tell whether more changes follow.
+
+    Args:
+        conversation (models.Conversation): conversation to sync the messages of.
+        watermark (str | None): watermark returned by the previous sync, None for a full sync.
+        limit (int): maximum number of messages.
+
+    Raises:
+        Http400BadRequestException: the watermark is malformed.
+
+    Returns:
+        QuerySet: message rows, soft deleted messages included.
+    """
+    queryset = models.Message.all_objects.filter(conversation=conversation)
+
+    if watermark is not None:
+        updated_at, message_id = _decode_message_cursor(watermark)
+        queryset = queryset.filter(Q(updated_at__gt=updated_at) | Q(updated_at=updated_at, id__gt=message_id))
+
+    return queryset.order_by("updated_at", "id").values()[: limit + 1]
+
+
+def build_message_sync(rows: list[dict], limit: int, *, watermark: str | None, state: str) -> dict:
+    """Build the delta sync response from the rows fetched by `message_sync_queryset`.
+
+    `updated_at` is stamped when a row is saved, not when its transaction commits, so a row may become
+    visible behind rows stamped later. The watermark of the last page is therefore held back to
+    `settings.CHATBOT_SYNC_OVERLAP_SECONDS` ago: messages changed since are returned again by the next
+    sync, and clients upsert them by id.
+
+    Args:
+        rows (list[dict]): the fetched message rows.
+        limit (int): maximum number of messages.
+        watermark (str | None): watermark the client synced from.
+        state (str): current state of the conversation.
+
+    Returns:
+        dict: the changed messages, the new watermark, whether more changes follow and the conversation state.
+    """
+    items = rows[:limit]
+    has_more = len(rows) > limit
+
+    if items:
+        updated_at, message_id = items[-1]["updated_at"], items[-1]["id"]
+        horizon = timezone.now() - timedelta(seconds=settings.CHATBOT_SYNC_OVERLAP_SECONDS)
+        if not has_more and updated_at > horizon:
+            updated_at, message_id = horizon, UUID(int=0)
+        watermark = encode_cursor(updated_at.isoformat(), message_id)
+
+    return {
+        "items": items,
+        "watermark": watermark,
+        "has_more": has_more,
+        "state": state,
+    }
+
+
+def _decode_conversation_cursor(cursor: str, order: str) -> tuple[datetime | str, UUID]:
+    sort_key, conversation_id = decode_cursor(cursor, 2)
+    try:
+        return datetime.fromisoformat(sort_key) if order == "recent" else sort_key, UUID(conversation_id)
+    except ValueError as e:
+        raise core_exceptions.Http400BadRequestException("Invalid cursor") from e
+
+
+def conversation_list_queryset(
+    user_id: UUID | str,
+    *,
+    name: str | None,
+    order: str,
+    after: str | None,
+    limit: int,
+) -> QuerySet:
+    """Build the keyset query of a page of conversations with their last message preview and unread count.
+
+    The preview and the unread count are correlated subqueries and `message_count`/`last_message_at` are
+    denormalized on the conversation, so the whole page is fetched in a single query.
+    The query fetches one extra row to tell whether more conversations follow, see `build_conversation_page`.
+
+    Args:
+        user_id (UUID | str): id of the user owning the conversations.
+        name (str | None): only list conversations whose name contains this text.
+        order (str): key of CONVERSATION_ORDERINGS, "recent" lists the latest active conversations first.
+        after (str | None): cursor of the conversation the page starts after.
+        limit (int): page size.
+
+    Raises:
+        Http400BadRequestException: the cursor is malformed.
+
+    Returns:
+        QuerySet: conversation rows with `sort_key`, `last_message` and `unread_count`.
+    """
+    latest_messages = models.Message.objects.filter(conversation=OuterRef("pk")).order_by("-created_at", "-id")
+    unread_messages = (
+        models.Message.objects.filter(
+            conversation=OuterRef("pk"),
+            type=models.Message.Type.CHATBOT,
+            created_at__gt=Coalesce(OuterRef("last_read_at"), OuterRef("created_at")),
+        )
+        .order_by()
+        .values("conversation")
+        .annotate(count=Count("id"))
+        .values("count")
+    )
+
+    queryset = models.Conversation.objects.filter(created_by_user_id=user_id)
+    if name:
+        queryset = queryset.filter(name__icontains=name)
+
+    sort_key, descending = CONVERSATION_ORDERINGS[order]
+    queryset = queryset.annotate(sort_key=sort_key)
+    if after is not None:
+        sort_value, conversation_id = _decode_conversation_cursor(after, order)
+        lookup = "lt" if descending else "gt"
+        queryset = queryset.filter(
+            Q(**{f"sort_key__{lookup}": sort_value}) | Q(sort_key=sort_value, **{f"id__{lookup}": conversation_id}),
+        )
+
+    queryset = queryset.annotate(
+        last_message=Left(Subquery(latest_messages.values("text")[:1]), MESSAGE_PREVIEW_CHARS),
+        unread_count=Coalesce(Subquery(unread_messages, output_field=IntegerField()), Value(0)),
+    )
+    ordering = ("-sort_key", "-id") if descending else ("sort_key", "id")
+    return queryset.order_by(*ordering).values()[: limit + 1]
+
+
+def build_conversation_page(rows: list[dict], limit: int) -> dict:
+    """Build a page of conversations from the rows fetched by `conversation_list_queryset`.
+
+    Args:
+        rows (list[dict]): the fetched conversation rows.
+        limit (int): page size.
+
+    Returns:
+        dict: the conversations, the cursor of the last one and whether more conversations follow.
+    """
+    items = rows[:limit]
+    if items:
+        sort_key = items[-1]["sort_key"]
+        after = encode_cursor(sort_key.isoformat() if isinstance(sort_key, datetime) else sort_key, items[-1]["id"])
+    else:
+        after = None
+
+    return {
+        "items": items,
+        "after": after,
+        "has_more": len(rows) > limit,
+    }
+
+
+def get_conversation(conversation_id: UUID) -> models.Conversation:
+    """Get a conversation by id.
+
+    Args:
+        conversation_id (UUID): id of the conversation.
+
+    Raises:
+        Http404NotFoundException: there is no such conversation.
+
+    Returns:
+        models.Conversation: the conversation.
+    """
+    try:
+        return models.Conversation.objects.get(id=conversation_id)
+    except models.Conversation.DoesNotExist as err:
+        raise core_exceptions.Http404NotFoundException from err
+
+
+async def aget_conversation(conversation_id: UUID) -> models.Conversation:
+    """Asynchronous version of `get_conversation`."""
+    try:
+        return await models.Conversation.objects.aget(id=conversation_id)
+    except models.Conversation.DoesNotExist as err:
+        raise core_exceptions.Http404NotFoundException from err
+
+
+def create_conversation(user: AbstractBaseUser, name: str, file: UploadedFile, target: str) -> models.Conversation:
+    """Create a chatbot conversation imitating a speaker of an uploaded chat record.
+
+    With deferred assistant creation, a conversation whose assistant is not registered yet is created in the
+    PROVISIONING state and the assistant is created by a task once the transaction commits.
+
+    The record is stored before the conversation is inserted, it is deleted again when the conversation cannot
+    be created.
+
+    Args:
+        user (AbstractBaseUser): the user creating the conversation.
+        name (str): name of the conversation.
+        file (UploadedFile): the uploaded chat record.
+        target (str): the speaker in the record the chatbot imitates.
+
+    Returns:
+        models.Conversation: the created conversation.
+    """
+    record = ingestion.ingest_record(file.chunks(settings.CHATBOT_RECORD_CHUNK_SIZE), target)
+
+    instructions = build_assistant_instructions(record.excerpt, target)
+    content_hash = assistant_content_hash(record.sha256, target)
+    record_file_s3_key = save_record_file(user, file)
+    try:
+        return _create_conversation(user, name, record_file_s3_key, instructions, content_hash)
+    except Exception:
+        # no conversation refers to the record, it would be left behind in the storage
+        get_file_storage().delete(record_file_s3_key)
+        raise
+
+
+def _create_conversation(
+    user: AbstractBaseUser,
+    name: str,
+    record_file_s3_key: str,
+    instructions: str,
+    content_hash: str,
+) -> models.Conversation:
+    from .tasks import create_assistant
+
+    registered = models.Assistant.objects.filter(content_hash=content_hash)
+    if settings.CHATBOT_DEFERRED_ASSISTANT_CREATION and not registered.exists():
+        conversation = models.Conversation(
+            name=name,
+            record_file_s3_key=record_file_s3_key,
+            state=models.Conversation.State.PROVISIONING,
+        )
+        conversation.create(user)
+
+        transaction.on_commit(
+            partial(
+                create_assistant.delay,
+                conversation_id=conversation.id,
+                instructions=instructions,
+                content_hash=content_hash,
+            ),
+        )
+        return conversation
+
+    conversation = models.Conversation(
+        name=name,
+        record_file_s3_key=record_file_s3_key,
+        assistant_id=get_or_create_assistant(user, name, instructions, content_hash),
+    )
+    conversation.create(user)
+    return conversation
+
+
+async def acreate_conversation(
+    user: AbstractBaseUser,
+    name: str,
+    file: UploadedFile,
+    target: str,
+) -> models.Conversation:
+    """Asynchronous version of `create_conversation`, the assistant is created with the asynchronous provider.
+
+    Ingesting and storing the record run in a worker thread, they read the whole upload.
+    """
+    chunks = file.chunks(settings.CHATBOT_RECORD_CHUNK_SIZE)
+    record = await sync_to_async(ingestion.ingest_record)(chunks, target)
+
+    instructions = build_assistant_instructions(record.excerpt, target)
+    content_hash = assistant_content_hash(record.sha256, target)
+    record_file_s3_key = await sync_to_async(save_record_file)(user, file)
+    try:
+        return await _acreate_conversation(user, name, record_file_s3_key, instructions, content_hash)
+    except Exception:
+        await sync_to_async(get_file_storage().delete)(record_file_s3_key)
+        raise
+
+
+async def _acreate_conversation(
+    user: AbstractBaseUser,
+    name: str,
+    record_file_s3_key: str,
+    instructions: str,
+    content_hash: str,
+) -> models.Conversation:
+    from .tasks import create_assistant
+
+    registered = models.Assistant.objects.filter(content_hash=content_hash)
+    if settings.CHATBOT_DEFERRED_ASSISTANT_CREATION and not await registered.aexists():
+        conversation = await models.Conversation.objects.acreate(
+            created_by_user=user,
+            name=name,
+            record_file_s3_key=record_file_s3_key,
+            state=models.Conversation.State.PROVISIONING,
+        )
+        # there is no transaction around async code, the conversation is committed already
+        await sync_to_async(create_assistant.delay)(
+            conversation_id=conversation.id,
+            instructions=instructions,
+            content_hash=content_hash,
+        )
+        return conversation
+
+    return await models.Conversation.objects.acreate(
+        created_by_user=user,
+        name=name,
+        record_file_s3_key=record_file_s3_key,
+        assistant_id=await aget_or_create_assistant(user, name, instructions, content_hash),
+    )
+
+
+def delete_conversation(user: AbstractBaseUser, conversation_id: UUID) -> models.Conversation:
+    """Soft delete a conversation.
+
+    Args:
+        user (AbstractBaseUser): the user deleting the conversation.
+        conversation_id (UUID): id of the conversation.
+
+    Returns:
+        models.Conversation: the deleted conversation.
+    """
+    conversation = get_conversation(conversation_id)
+    conversation.delete(user)
+    return conversation
+
+
+async def adelete_conversation(user: AbstractBaseUser, conversation_id: UUID) -> dict:
+    """Asynchronous version of `delete_conversation`, soft deleting the conversation with a single UPDATE.
+
+    Returns:
+        dict: the id of the deleted conversation.
+    """
+    now = timezone.now()
+    deleted = await models.Conversation.objects.filter(id=conversation_id).aupdate(
+        is_delete=True,
+        deleted_by_user=user,
+        deleted_at=now,
+        updated_at=now,
+        updated_by_user=user,
+    )
+    if not deleted:
+        raise core_exceptions.Http404NotFoundException
+
+    return {"id": conversation_id}
+
+
+def rename_conversation(user: AbstractBaseUser, conversation_id: UUID, name: str) -> models.Conversation:
+    """Rename a conversation.
+
+    Args:
+        user (AbstractBaseUser): the user renaming the conversation.
+        conversation_id (UUID): id of the conversation.
+        name (str): the new name.
+
+    Returns:
+        models.Conversation: the renamed conversation.
+    """
+    conversation = get_conversation(conversation_id)
+    conversation.name = name
+    conversation.save(user)
+    return conversation
+
+
+async def arename_conversation(user: AbstractBaseUser, conversation_id: UUID, name: str) -> models.Conversation:
+    """Asynchronous version of `rename_conversation`."""
+    conversation = await aget_conversation(conversation_id)
+    await models.Conversation.objects.filter(id=conversation_id).aupdate(
+        name=name,
+        updated_at=timezone.now(),
+        updated_by_user=user,
+    )
+    conversation.name = name
+    return conversation
+
+
+def mark_conversation_read(user_id: UUID | str, conversation_id: UUID) -> dict:
+    """Mark a conversation as read, resetting its unread count.
+
+    Only `last_read_at` is written so reading does not reorder the conversations by recent activity.
+
+    Args:
+        user_id (UUID | str): id of the user owning the conversation.
+        conversation_id (UUID): id of the conversation.
+
+    Raises:
+        Http404NotFoundException: the user owns no such conversation.
+
+    Returns:
+        dict: the conversation id and its new `last_read_at`.
+    """
+    last_read_at = timezone.now()
+    updated = models.Conversation.objects.filter(
+        id=conversation_id,
+        created_by_user_id=user_id,
+    ).update(last_read_at=last_read_at)
+    if not updated:
+        raise core_exceptions.Http404NotFoundException
+
+    return {"id": conversation_id, "last_read_at": last_read_at}
+
+
+async def amark_conversation_read(user_id: UUID | str, conversation_id: UUID) -> dict:
+    """Asynchronous version of `mark_conversation_read`."""
+    last_read_at = timezone.now()
+    updated = await models.Conversation.objects.filter(
+        id=conversation_id,
+        created_by_user_id=user_id,
+    ).aupdate(last_read_at=last_read_at)
+    if not updated:
+        raise core_exceptions.Http404NotFoundException
+
+    return {"id": conversation_id, "last_read_at": last_read_at}
+
+
+def list_conversations(user_id: UUID | str, *, name: str | None, order: str, after: str | None, limit: int) -> dict:
+    """List a page of conversations with their last message preview and unread count.
+
+    Args:
+        user_id (UUID | str): id of the user owning the conversations.
+        name (str | None): only list conversations whose name contains this text.
+        order (str): key of CONVERSATION_ORDERINGS.
+        after (str | None): cursor of the conversation the page starts after.
+        limit (int): requested page size, clamped to `settings.CHATBOT_CONVERSATION_PAGE_MAX_SIZE`.
+
+    Returns:
+        dict: the page, see `build_conversation_page`.
+    """
+    limit = min(max(limit, 1), settings.CHATBOT_CONVERSATION_PAGE_MAX_SIZE)
+    queryset = conversation_list_queryset(user_id, name=name, order=order, after=after, limit=limit)
+    return build_conversation_page(list(queryset), limit)
+
+
+async def alist_conversations(
+    user_id: UUID | str,
+    *,
+    name: str | None,
+    order: str,
+    after: str | None,
+    limit: int,
+) -> dict:
+    """Asynchronous version of `list_conversations`."""
+    limit = min(max(limit, 1), settings.CHATBOT_CONVERSATION_PAGE_MAX_SIZE)
+    queryset = conversation_list_queryset(user_id, name=name, order=order, after=after, limit=limit)
+    return build_conversation_page([row async for row in queryset], limit)
+
+
+def list_messages(conversation_id: UUID, *, before: str | None, after: str | None, limit: int) -> dict:
+    """List a page of messages in a conversation.
+
+    Args:
+        conversation_id (UUID): id of the conversation.
+        before (str | None): cursor of the message the page ends before.
+        after (str | None): cursor of the message the page starts after.
+        limit (int): requested page size, clamped to `settings.CHATBOT_MESSAGE_PAGE_MAX_SIZE`.
+
+    Returns:
+        dict: the page, see `build_message_page`.
+    """
+    conversation = get_conversation(conversation_id)
+
+    limit = min(max(limit, 1), settings.CHATBOT_MESSAGE_PAGE_MAX_SIZE)
+    queryset = message_page_queryset(conversation, before=before, after=after, limit=limit)
+    return build_message_page(list(queryset), limit, forward=after is not None)
+
+
+async def alist_messages(conversation_id: UUID, *, before: str | None, after: str | None, limit: int) -> dict:
+    """Asynchronous version of `list_messages`."""
+    conversation = await aget_conversation(conversation_id)
+
+    limit = min(max(limit, 1), settings.CHATBOT_MESSAGE_PAGE_MAX_SIZE)
+    queryset = message_page_queryset(conversation, before=before, after=after, limit=limit)
+    return build_message_page([row async for row in queryset], limit, forward=after is not None)
+
+
+def sync_messages(conversation_id: UUID, *, watermark: str | None, limit: int) -> dict:
+    """Sync the messages of a conversation changed since a watermark.
+
+    Args:
+        conversation_id (UUID): id of the conversation.
+        watermark (str | None): watermark returned by the previous sync, None for a full sync.
+        limit (int): requested number of messages, clamped to `settings.CHATBOT_MESSAGE_PAGE_MAX_SIZE`.
+
+    Returns:
+        dict: the changes, see `build_message_sync`.
+    """
+    conversation = get_conversation(conversation_id)
+
+    limit = min(max(limit, 1), settings.CHATBOT_MESSAGE_PAGE_MAX_SIZE)
+    queryset = message_sync_queryset(conversation, watermark=watermark, limit=limit)
+    return build_message_sync(list(queryset), limit, watermark=watermark, state=conversation.state)
+
+
+async def async_messages(conversation_id: UUID, *, watermark: str | None, limit: int) -> dict:
+    """Asynchronous version of `sync_messages`."""
+    conversation = await aget_conversation(conversation_id)
+
+    limit = min(max(limit, 1), settings.CHATBOT_MESSAGE_PAGE_MAX_SIZE)
+    queryset = message_sync_queryset(conversation, watermark=watermark, limit=limit)
+    rows = [row async for row in queryset]
+    return build_message_sync(rows, limit, watermark=watermark, state=conversation.state)
+
+
+def post_message(user: AbstractBaseUser, conversation_id: UUID, text: str) -> models.Message:
+    """Post a user message to a conversation, the chatbot reply follows asynchronously.
+
+    Args:
+        user (AbstractBaseUser): the user posting the message.
+        conversation_id (UUID): id of the conversation.
+        text (str): text of the message.
+
+    Raises:
+        Http400BadRequestException: the chatbot is still being provisioned.
+
+    Returns:
+        models.Message: the posted message.
+    """
+    conversation = get_conversation(conversation_id)
+    if conversation.state == models.Conversation.State.PROVISIONING:
+        raise core_exceptions.Http400BadRequestException("Chatbot is still being provisioned")
+
+    message = models.Message(conversation=conversation, text=text)
+    message.create(user)
+    return message
+
+
+async def apost_message(user: AbstractBaseUser, conversation_id: UUID, text: str) -> models.Message:
+    """Asynchronous version of `post_message`."""
+    conversation = await aget_conversation(conversation_id)
+    if conversation.state == models.Conversation.State.PROVISIONING:
+        raise core_exceptions.Http400BadRequestException("Chatbot is still being provisioned")
+
+    return await models.Message.objects.acreate(created_by_user=user, conversation=conversation, text=text)
+
+
+def get_conversation_state(conversation_id: UUID) -> dict:
+    """Get the state of a conversation.
+
+    Args:
+        conversation_id (UUID): id of the conversation.
+
+    Returns:
+        dict: the state.
+    """
+    return {"state": get_conversation(conversation_id).state}
+
+
+async def aget_conversation_state(conversation_id: UUID) -> dict:
+    """Asynchronous version of `get_conversation_state`."""
+    state = await models.Conversation.objects.filter(id=conversation_id).values_list("state", flat=True).afirst()
+    if state is None:
+        raise core_exceptions.Http404NotFoundException
+
+    return {"state": state}
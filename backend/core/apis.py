@@ -4,16 +4,16 @@ from django.core.handlers.wsgi import WSGIRequest
 from ninja_extra import api_controller
 from ninja_extra import route
 from ninja_extra.permissions import IsAuthenticated
-from ninja_jwt.authentication import JWTAuth
 
 from core import schemas as core_schemas
+from core.authentication import CustomJWTAuth
 
 from . import schemas
 
 
 @api_controller(
     prefix_or_class="user",
-    auth=JWTAuth(),
+    auth=CustomJWTAuth(),
     tags=["edit user"],
     permissions=[IsAuthenticated],
 )
@@ -37,6 +37,8 @@ class UserEditController:
         user = request.user
 
         user.name = body.name  # type: ignore
-        user.save()
+        # the user may be rebuilt from the authentication cache, only the edited columns are written so the
+        # possibly stale cached ones (is_active) are not. Saving also drops the user from the cache.
+        user.save(update_fields=["name", "updated_at"])
 
         return user
@@ -6,3 +6,6 @@ class CoreConfig(AppConfig):
 
     default_auto_field = "django.db.models.BigAutoField"
     name = "core"
+
+    def ready(self):  # noqa: D102
+        from . import signals  # noqa: F401
@@ -1,14 +1,81 @@
+from django.conf import settings
 from django.contrib.auth.models import AbstractBaseUser
+from django.core.cache import cache
 from django.utils.translation import gettext_lazy as _
 from ninja_jwt.authentication import AsyncJWTAuth
+from ninja_jwt.authentication import AsyncJWTTokenUserAuth
 from ninja_jwt.authentication import JWTAuth
+from ninja_jwt.authentication import JWTTokenUserAuth
 from ninja_jwt.exceptions import AuthenticationFailed
 from ninja_jwt.exceptions import InvalidToken
+from ninja_jwt.models import TokenUser
 from ninja_jwt.settings import api_settings
 
 
+# fields of the user kept in the authentication cache, secrets like the password hash are never cached
+AUTH_USER_CACHE_FIELDS = ("id", "email", "name", "is_active", "is_staff", "is_superuser", "is_delete")
+
+
+def user_cache_key(user_id: object) -> str:
+    """Get the cache key of an authenticated user.
+
+    Args:
+        user_id (object): id of the user.
+
+    Returns:
+        str: cache key.
+    """
+    return f"core:user:{user_id}"
+
+
+def invalidate_cached_user(user_id: object) -> None:
+    """Drop a user from the authentication cache.
+
+    Args:
+        user_id (object): id of the user.
+    """
+    cache.delete(user_cache_key(user_id))
+
+
+def revoked_user_cache_key(user_id: object) -> str:
+    """Get the cache key marking a user as inactive for the stateless authentication.
+
+    Args:
+        user_id (object): id of the user.
+
+    Returns:
+        str: cache key.
+    """
+    return f"core:user-revoked:{user_id}"
+
+
+def update_revoked_user(user_id: object, *, is_active: bool) -> None:
+    """Add an inactive user to, or remove an active user from, the revocation set.
+
+    Entries live as long as an access token, tokens issued before the deactivation are rejected
+    until they expire. This is called from the user model signals only, so deactivating users with
+    `QuerySet.update` bypasses it, and with a per process cache (the LocMem fallback) it only reaches
+    the current process.
+
+    Args:
+        user_id (object): id of the user.
+        is_active (bool): whether the user may still authenticate.
+    """
+    if is_active:
+        cache.delete(revoked_user_cache_key(user_id))
+    else:
+        cache.set(revoked_user_cache_key(user_id), True, api_settings.ACCESS_TOKEN_LIFETIME.total_seconds())
+
+
 class CustomJWTAuth(JWTAuth):
-    """Custom JWT authentication class, for remove the avatar field from the user model."""
+    """Custom JWT authentication class, for remove the avatar field from the user model.
+
+    Users are cached for `settings.AUTH_USER_CACHE_TIMEOUT` seconds as their AUTH_USER_CACHE_FIELDS only,
+    `request.user` is rebuilt with the other fields deferred. The cache is invalidated whenever a user is
+    saved or deleted (see `core.signals`). Writes through `QuerySet.update` send no signal, and with a per
+    process cache the invalidation only reaches the current process, so such changes, deactivation
+    included, take effect once the entry expires.
+    """
 
     def get_user(self, validated_token: dict) -> AbstractBaseUser:
         """Retrieve the user associated with the given validated token.
@@ -28,10 +95,22 @@ class CustomJWTAuth(JWTAuth):
         except KeyError as e:
             raise InvalidToken(_("Token contained no recognizable user identification")) from e
 
-        try:
-            user = self.user_model.objects.get(**{api_settings.USER_ID_FIELD: user_id})
-        except self.user_model.DoesNotExist as e:
-            raise AuthenticationFailed(_("User not found")) from e
+        values = cache.get(user_cache_key(user_id))
+        if values is None:
+            try:
+                user = self.user_model.objects.only(*AUTH_USER_CACHE_FIELDS).get(
+                    **{api_settings.USER_ID_FIELD: user_id},
+                )
+            except self.user_model.DoesNotExist as e:
+                raise AuthenticationFailed(_("User not found")) from e
+
+            values = {field: getattr(user, field) for field in AUTH_USER_CACHE_FIELDS}
+            cache.set(user_cache_key(user_id), values, settings.AUTH_USER_CACHE_TIMEOUT)
+        else:
+            # from_db takes the loaded values in the order of the model fields
+            concrete_fields = self.user_model._meta.concrete_fields  # noqa: SLF001
+            fields = [field.attname for field in concrete_fields if field.attname in values]
+            user = self.user_model.from_db(self.user_model.objects.db, fields, [values[field] for field in fields])
 
         if not user.is_active:
             raise AuthenticationFailed(_("User is inactive"))
@@ -41,3 +120,35 @@ class CustomJWTAuth(JWTAuth):
 
 class CustomAsyncJWTAuth(AsyncJWTAuth, CustomJWTAuth):
     """Custom asynchronous JWT authentication class, for remove the avatar field from the user model."""
+
+
+class CustomJWTTokenUserAuth(JWTTokenUserAuth):
+    """Stateless JWT authentication for routes that only need the user id.
+
+    `request.user` is a `TokenUser` built from the token claims, no user row is loaded. Inactive users
+    are rejected through the revocation set kept in cache (see `update_revoked_user`).
+    """
+
+    def get_user(self, validated_token: dict) -> TokenUser:
+        """Build the token user of the given validated token.
+
+        Args:
+            validated_token: The token that has been validated.
+
+        Returns:
+            TokenUser: The user described by the token.
+
+        Raises:
+            InvalidToken: If the token does not contain a recognizable user identification.
+            AuthenticationFailed: If the user is inactive.
+        """
+        user = super().get_user(validated_token)
+
+        if cache.get(revoked_user_cache_key(user.id)):
+            raise AuthenticationFailed(_("User is inactive"))
+
+        return user
+
+
+class CustomAsyncJWTTokenUserAuth(AsyncJWTTokenUserAuth, CustomJWTTokenUserAuth):
+    """Asynchronous version of the stateless JWT authentication."""
@@ -0,0 +1,196 @@
+import asyncio
+import json
+import threading
+import weakref
+from asyncio import AbstractEventLoop
+from asyncio import get_running_loop
+from collections import defaultdict
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from functools import cache
+from typing import Any
+
+import redis
+import redis.asyncio as aioredis
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.module_loading import import_string
+
+
+_sync_client: redis.Redis | None = None
+_async_clients: weakref.WeakKeyDictionary[AbstractEventLoop, aioredis.Redis] = weakref.WeakKeyDictionary()
+
+
+def get_redis_client() -> redis.Redis:
+    """Get the process wide synchronous redis client.
+
+    Returns:
+        redis.Redis: redis client built from `settings.REDIS_URL`.
+    """
+    global _sync_client  # noqa: PLW0603
+
+    if _sync_client is None:
+        _sync_client = redis.Redis.from_url(settings.REDIS_URL)
+    return _sync_client
+
+
+def get_async_redis_client() -> aioredis.Redis:
+    """Get the asynchronous redis client bound to the running event loop.
+
+    Returns:
+        aioredis.Redis: redis client built from `settings.REDIS_URL`.
+    """
+    loop = get_running_loop()
+    if loop not in _async_clients:
+        _async_clients[loop] = aioredis.Redis.from_url(settings.REDIS_URL)
+    return _async_clients[loop]
+
+
+class RedisSubscription:
+    """Subscription to a single redis pub/sub channel."""
+
+    def __init__(self, pubsub: aioredis.client.PubSub) -> None:
+        """Wrap a pub/sub connection subscribed to the channel.
+
+        Args:
+            pubsub (aioredis.client.PubSub): the subscribed connection.
+        """
+        self.pubsub = pubsub
+
+    async def get(self, max_wait: float) -> dict[str, Any] | None:
+        """Wait for the next message published to the channel.
+
+        Args:
+            max_wait (float): seconds to wait before giving up.
+
+        Returns:
+            dict[str, Any] | None: the decoded message, or None if nothing arrived in time.
+        """
+        message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=max_wait)
+        if message is None:
+            return None
+        return json.loads(message["data"])
+
+
+class RedisBroker:
+    """Publish/subscribe broker backed by redis pub/sub."""
+
+    def publish(self, channel: str, message: dict[str, Any]) -> None:
+        """Publish a message to a channel.
+
+        Args:
+            channel (str): channel name.
+            message (dict[str, Any]): JSON serializable message.
+        """
+        get_redis_client().publish(channel, json.dumps(message, cls=DjangoJSONEncoder))
+
+    async def apublish(self, channel: str, message: dict[str, Any]) -> None:
+        """Asynchronous version of `publish`, for event loops."""
+        await get_async_redis_client().publish(channel, json.dumps(message, cls=DjangoJSONEncoder))
+
+    @asynccontextmanager
+    async def subscribe(self, channel: str) -> AsyncIterator[RedisSubscription]:
+        """Subscribe to a channel for the lifetime of the context.
+
+        Args:
+            channel (str): channel name.
+
+        Yields:
+            RedisSubscription: subscription to read messages from.
+        """
+        pubsub = get_async_redis_client().pubsub()
+        await pubsub.subscribe(channel)
+        try:
+            yield RedisSubscription(pubsub)
+        finally:
+            await pubsub.unsubscribe(channel)
+            await pubsub.aclose()
+
+
+class InProcessSubscription:
+    """Subscription to a channel of the in-process broker."""
+
+    def __init__(self, queue: asyncio.Queue) -> None:
+        """Wrap the queue the broker hands the messages of the channel to.
+
+        Args:
+            queue (asyncio.Queue): the queue of the subscriber.
+        """
+        self.queue = queue
+
+    async def get(self, max_wait: float) -> dict[str, Any] | None:
+        """Wait for the next message published to the channel.
+
+        Args:
+            max_wait (float): seconds to wait before giving up.
+
+        Returns:
+            dict[str, Any] | None: the message, or None if nothing arrived in time.
+        """
+        try:
+            return await asyncio.wait_for(self.queue.get(), max_wait)
+        except TimeoutError:
+            return None
+
+
+class InProcessBroker:
+    """Publish/subscribe broker delivering messages inside the current process, for tests and local runs.
+
+    Messages may be published from any thread, they are handed to the event loop of each subscriber.
+    """
+
+    def __init__(self) -> None:
+        """Start without subscribers."""
+        self.lock = threading.Lock()
+        self.subscribers: defaultdict[str, set[tuple[AbstractEventLoop, asyncio.Queue]]] = defaultdict(set)
+
+    def publish(self, channel: str, message: dict[str, Any]) -> None:
+        """Publish a message to a channel.
+
+        Args:
+            channel (str): channel name.
+            message (dict[str, Any]): JSON serializable message.
+        """
+        # round trip through JSON so subscribers see the same payload as with redis
+        message = json.loads(json.dumps(message, cls=DjangoJSONEncoder))
+        with self.lock:
+            subscribers = list(self.subscribers.get(channel, ()))
+
+        for loop, queue in subscribers:
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(queue.put_nowait, message)
+
+    async def apublish(self, channel: str, message: dict[str, Any]) -> None:
+        """Asynchronous version of `publish`, which does not block."""
+        self.publish(channel, message)
+
+    @asynccontextmanager
+    async def subscribe(self, channel: str) -> AsyncIterator[InProcessSubscription]:
+        """Subscribe to a channel for the lifetime of the context.
+
+        Args:
+            channel (str): channel name.
+
+        Yields:
+            InProcessSubscription: subscription to read messages from.
+        """
+        subscriber = (get_running_loop(), asyncio.Queue())
+        with self.lock:
+            self.subscribers[channel].add(subscriber)
+        try:
+            yield InProcessSubscription(subscriber[1])
+        finally:
+            with self.lock:
+                self.subscribers[channel].discard(subscriber)
+                if not self.subscribers[channel]:
+                    del self.subscribers[channel]
+
+
+@cache
+def get_broker() -> RedisBroker | InProcessBroker:
+    """Get the process wide broker configured by `settings.MESSAGE_BROKER_BACKEND`.
+
+    Returns:
+        RedisBroker | InProcessBroker: the broker.
+    """
+    return import_string(settings.MESSAGE_BROKER_BACKEND)()
@@ -0,0 +1,63 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+from argparse import ArgumentParser
+from typing import Any
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+# run in a fresh interpreter per sample, the current process already has everything imported
+SAMPLE_SCRIPT = """
+import importlib, json, sys, time
+start = time.perf_counter()
+import django
+django.setup()
+for module in sys.argv[1:]:
+    importlib.import_module(module)
+elapsed = time.perf_counter() - start
+print(json.dumps({"seconds": elapsed, "loaded": [m for m in ("openai", "httpx") if m in sys.modules]}))
+"""
+
+
+class Command(BaseCommand):
+    """Benchmark the startup import time of a Django process."""
+
+    help = (
+        "Measure, in fresh interpreters, how long `django.setup()` plus importing the given modules takes, "
+        "and whether openai/httpx got imported on the way."
+    )
+
+    def add_arguments(self, parser: ArgumentParser):  # noqa: D102
+        parser.add_argument("modules", nargs="*", default=["config.urls"], help="modules imported after setup")
+        parser.add_argument("--repeat", type=int, default=10, help="number of fresh interpreters")
+
+    def handle(self, *args: Any, **options: Any):  # noqa: ARG002, D102
+        env = {
+            **os.environ,
+            "DJANGO_SETTINGS_MODULE": os.environ["DJANGO_SETTINGS_MODULE"],
+            "PYTHONPATH": os.pathsep.join([str(settings.BASE_DIR), str(settings.BASE_DIR / "backend")]),
+        }
+
+        samples = []
+        for _ in range(options["repeat"]):
+            output = subprocess.run(  # noqa: S603
+                [sys.executable, "-c", SAMPLE_SCRIPT, *options["modules"]],
+                cwd=settings.BASE_DIR,
+                env=env,
+                capture_output=True,
+                check=True,
+                text=True,
+            ).stdout
+            samples.append(json.loads(output.splitlines()[-1]))
+
+        seconds = [sample["seconds"] for sample in samples]
+        self.stdout.write(
+            f"import of {', '.join(options['modules'])}: median {statistics.median(seconds) * 1000:.1f} ms, "
+            f"min {min(seconds) * 1000:.1f} ms over {len(seconds)} runs",
+        )
+        loaded = ", ".join(samples[-1]["loaded"]) or "neither openai nor httpx"
+        self.stdout.write(f"modules loaded at startup: {loaded}")
@@ -1,3 +1,5 @@
+from typing import Any
+
 from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import UserManager as DjangoUserManager
 from django.db.models import Manager
@@ -58,19 +60,47 @@ class UserManager(DjangoUserManager, Manager):
     def get_queryset(self) -> QuerySet:
         """Overwritten get_queryset method for soft delete.
 
+        The filter matches the `is_delete = false` condition of the partial indexes, so they can serve it.
+
         Returns:
             QuerySet: QuerySet object.
         """
-        return super().get_queryset().exclude(is_delete=True)
+        return super().get_queryset().filter(is_delete=False)
+
+
+class BaseModelQuerySet(QuerySet):
+    """QuerySet of the models with user information."""
+
+    def create(self, **kwargs: Any) -> Any:
+        """Create an object with `BaseModel.create`, `created_by_user` is the user responsible for it.
+
+        `acreate` goes through this method as well, so asynchronous code records the user too.
+
+        Args:
+            **kwargs (Any): fields of the object, `created_by_user` is required.
+
+        Returns:
+            BaseModel: The created object.
+        """
+        user = kwargs.pop("created_by_user")
+        obj = self.model(**kwargs)
+        obj.create(user, force_insert=True, using=self.db)
+        return obj
 
 
-class BaseModelManager(Manager):
+class BaseModelManager(Manager.from_queryset(BaseModelQuerySet)):
     """Base model manager for all models."""
 
     def get_queryset(self) -> QuerySet:
         """Overwritten get_queryset method for soft delete.
 
+        The filter matches the `is_delete = false` condition of the partial indexes, so they can serve it.
+
         Returns:
             QuerySet: QuerySet object.
         """
-        return super().get_queryset().exclude(is_delete=True)
+        return super().get_queryset().filter(is_delete=False)
+
+
+class AllObjectsManager(Manager):
+    """Manager of all records of a model, soft deleted ones included."""
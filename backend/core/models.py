@@ -4,15 +4,27 @@ from typing import Any
 from typing import ClassVar
 
 import pytz
+from django.conf import settings
 from django.contrib.auth.models import AbstractBaseUser
 from django.contrib.auth.models import AbstractUser
+from django.core.exceptions import ValidationError
 from django.db import models
+from django.db import transaction
+from django.dispatch import Signal
 from django.utils import timezone
 
+from .managers import AllObjectsManager
 from .managers import BaseModelManager
 from .managers import UserManager
 
 
+# sent by `BaseModel.create_batch` with `sender` the model class and `objs` the created objects,
+# bulk inserts do not send `post_save`.
+post_bulk_create = Signal()
+# sent by `BaseModel.delete_batch` with `sender` the model class and `pks` the soft deleted primary keys.
+post_bulk_delete = Signal()
+
+
 class User(AbstractUser):
     """Custom user model representing a user in the application.
 
@@ -105,6 +117,24 @@ class BaseModel(models.Model):
 
         delete(self, user: AbstractBaseUser) -> None:
             Marks the model instance as deleted, associating the user who marked it as deleted.
+
+        create_batch(cls, user: AbstractBaseUser, objs: list[BaseModel], batch_size: int | None = None):
+            Validates and inserts many new model instances with bulk INSERTs.
+
+        update_batch(cls, user: AbstractBaseUser, objs: list[BaseModel], fields: list[str]):
+            Writes the given fields of many model instances with bulk UPDATEs.
+
+        delete_batch(cls, user: AbstractBaseUser, pks: list[Any]) -> int:
+            Marks many model instances as deleted with a single UPDATE.
+
+        asave, acreate, adelete:
+            Asynchronous versions of save, create and delete.
+
+        get_dirty_fields(self) -> list[str] | None:
+            Lists the fields changed since the model instance was loaded or saved.
+
+        snapshot_loaded_values(self) -> None:
+            Remembers the current field values as the database state.
     """
 
     id = models.UUIDField(
@@ -140,7 +170,13 @@ class BaseModel(models.Model):
         related_name="%(class)s_deleted_by_user",
     )
 
+    # columns maintained in the database with F-expressions, never written back from a possibly stale instance
+    COUNTER_FIELDS: ClassVar[tuple[str, ...]] = ()
+    # keyword arguments of `save` passed on to Django instead of being applied to the object
+    SAVE_OPTIONS: ClassVar[tuple[str, ...]] = ("force_insert", "force_update", "using", "update_fields")
+
     objects = BaseModelManager()
+    all_objects = AllObjectsManager()
 
     class Meta:
         abstract = True
@@ -149,7 +185,11 @@ class BaseModel(models.Model):
         """Save and update the object with user information.
 
         This method saves or updates the object and sets the 'updated_by_user' field to the specified user.
-        Additionally, any extra keyword arguments provided will be applied to the object.
+        Additionally, any extra keyword arguments provided will be applied to the object, except the
+        `SAVE_OPTIONS` which are passed on to Django.
+
+        Updating an existing row only writes `update_fields`, or the dirty fields when not given, plus
+        `updated_at` and `updated_by_user`.
 
         Args:
             user (AbstractBaseUser): The user responsible for the update.
@@ -160,10 +200,12 @@ class BaseModel(models.Model):
             None
 
         """
-        for k, v in kwargs.items():
-            setattr(self, k, v)
+        options = self._split_save_options(kwargs)
         self.updated_by_user = user
-        super().save(*args, **kwargs)  # type: ignore
+        if not args and not self._state.adding and not options.get("force_insert"):
+            options["update_fields"] = self._get_update_fields(options.get("update_fields"))  # type: ignore
+        super().save(*args, **options)  # type: ignore
+        self.snapshot_loaded_values()
 
     def create(self, user: AbstractBaseUser, *args: list[Any], **kwargs: dict[Any, Any]):
         """Create a new object with user information.
@@ -180,11 +222,11 @@ class BaseModel(models.Model):
             None
 
         """
-        for k, v in kwargs.items():
-            setattr(self, k, v)
+        options = self._split_save_options(kwargs)
         self.created_by_user = user
         self.updated_by_user = user
-        super().save(*args, **kwargs)  # type: ignore
+        super().save(*args, **options)  # type: ignore
+        self.snapshot_loaded_values()
 
     def delete(self, user: AbstractBaseUser) -> None:
         """Marks this object as deleted and assigns the user responsible for the deletion. (soft delete).
@@ -206,3 +248,163 @@ class BaseModel(models.Model):
         self.deleted_by_user = user
         self.deleted_at = datetime.now(tz=pytz.timezone("Asia/Taipei"))
         self.save(user)
+
+    @classmethod
+    def from_db(cls, db: str | None, field_names: list[str], values: list[Any]) -> "BaseModel":  # noqa: D102
+        instance = super().from_db(db, field_names, values)
+        instance.snapshot_loaded_values()
+        return instance
+
+    def refresh_from_db(self, using: str | None = None, fields: list[str] | None = None):  # noqa: D102
+        super().refresh_from_db(using=using, fields=fields)
+        loaded_values = getattr(self, "_loaded_values", None)
+        if loaded_values is None or fields is None:
+            self.snapshot_loaded_values()
+            return
+
+        for field in self._meta.concrete_fields:
+            if field.name in fields or field.attname in fields:
+                loaded_values[field.attname] = getattr(self, field.attname)
+
+    def snapshot_loaded_values(self) -> None:
+        """Remember the current field values as the database state `get_dirty_fields` compares against."""
+        deferred_fields = self.get_deferred_fields()
+        self._loaded_values = {
+            field.attname: getattr(self, field.attname)
+            for field in self._meta.concrete_fields
+            if field.attname not in deferred_fields
+        }
+
+    def get_dirty_fields(self) -> list[str] | None:
+        """List the fields changed since the object was loaded from, or last written to, the database.
+
+        Returns:
+            list[str] | None: names of the changed fields, None if the object was not loaded from the database.
+        """
+        loaded_values = getattr(self, "_loaded_values", None)
+        if loaded_values is None:
+            return None
+
+        deferred_fields = self.get_deferred_fields()
+        return [
+            field.name
+            for field in self._meta.concrete_fields
+            if not field.primary_key
+            and field.name not in self.COUNTER_FIELDS
+            and field.attname not in deferred_fields
+            and (field.attname not in loaded_values or loaded_values[field.attname] != getattr(self, field.attname))
+        ]
+
+    def _get_update_fields(self, update_fields: list[str] | None) -> list[str] | None:
+        if update_fields is None:
+            update_fields = self.get_dirty_fields()
+        if update_fields is not None:
+            return list({*update_fields, "updated_at", "updated_by_user"})
+
+        if not self.COUNTER_FIELDS:
+            return None
+        return [
+            field.name
+            for field in self._meta.concrete_fields
+            if not field.primary_key and field.name not in self.COUNTER_FIELDS
+        ]
+
+    def _split_save_options(self, kwargs: dict[str, Any]) -> dict[str, Any]:
+        options = {key: kwargs.pop(key) for key in self.SAVE_OPTIONS if key in kwargs}
+        for k, v in kwargs.items():
+            setattr(self, k, v)
+        return options
+
+    @classmethod
+    def create_batch(
+        cls,
+        user: AbstractBaseUser,
+        objs: list["BaseModel"],
+        batch_size: int | None = None,
+    ) -> list["BaseModel"]:
+        """Validate and create many new objects with user information using bulk INSERTs.
+
+        Fields are validated in memory and foreign keys with one query per relation, `post_save` is not sent,
+        `post_bulk_create` is sent once with all objects instead.
+
+        Args:
+            user (AbstractBaseUser): The user responsible for creating the objects.
+            objs (list[BaseModel]): The new objects.
+            batch_size (int | None, optional): rows per INSERT. Defaults to `settings.BULK_CREATE_BATCH_SIZE`.
+
+        Raises:
+            ValidationError: a field of an object is invalid or references a missing object.
+
+        Returns:
+            list[BaseModel]: The created objects.
+        """
+        relations = [field for field in cls._meta.concrete_fields if field.is_relation]
+
+        for obj in objs:
+            obj.clean_fields(exclude=[field.name for field in relations])
+
+        for field in relations:
+            pks = {getattr(obj, field.attname) for obj in objs} - {None}
+            related_manager = field.related_model._default_manager  # type: ignore # noqa: SLF001
+            if pks and related_manager.filter(pk__in=pks).count() != len(pks):
+                raise ValidationError({field.name: "One or more referenced objects do not exist."})
+
+        for obj in objs:
+            obj.created_by_user = user
+            obj.updated_by_user = user
+
+        cls._default_manager.bulk_create(objs, batch_size=batch_size or settings.BULK_CREATE_BATCH_SIZE)
+        post_bulk_create.send(sender=cls, objs=objs)
+        return objs
+
+    @classmethod
+    def update_batch(
+        cls,
+        user: AbstractBaseUser,
+        objs: list["BaseModel"],
+        fields: list[str],
+        batch_size: int | None = None,
+    ) -> None:
+        """Write the given fields of many objects with bulk UPDATEs, `post_save` is not sent.
+
+        Args:
+            user (AbstractBaseUser): The user responsible for the update.
+            objs (list[BaseModel]): The objects, they only need their primary key and the given fields.
+            fields (list[str]): The fields to write.
+            batch_size (int | None, optional): rows per UPDATE. Defaults to `settings.BULK_CREATE_BATCH_SIZE`.
+        """
+        now = timezone.now()
+        for obj in objs:
+            obj.updated_at = now
+            obj.updated_by_user = user
+
+        cls._default_manager.bulk_update(
+            objs,
+            [*fields, "updated_at", "updated_by_user"],
+            batch_size=batch_size or settings.BULK_CREATE_BATCH_SIZE,
+        )
+
+    @classmethod
+    def delete_batch(cls, user: AbstractBaseUser, pks: list[Any]) -> int:
+        """Mark many objects as deleted with a single UPDATE, `post_bulk_delete` is sent once afterwards.
+
+        Args:
+            user (AbstractBaseUser): The user who is initiating the deletion.
+            pks (list[Any]): The primary keys of the objects.
+
+        Returns:
+            int: The number of objects marked as deleted, already deleted objects are skipped.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            # lock the rows so `post_bulk_delete` receivers get exactly the objects this call deleted
+            live_pks = list(cls._default_manager.select_for_update().filter(pk__in=pks).values_list("pk", flat=True))
+            cls._default_manager.filter(pk__in=live_pks).update(
+                is_delete=True,
+                deleted_by_user=user,
+                deleted_at=now,
+                updated_at=now,
+                updated_by_user=user,
+            )
+            post_bulk_delete.send(sender=cls, pks=live_pks)
+        return len(live_pks)
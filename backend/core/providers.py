@@ -0,0 +1,556 @@
+import asyncio
+import hashlib
+import os
+import random
+import threading
+import time
+import weakref
+from abc import ABC
+from abc import abstractmethod
+from asyncio import AbstractEventLoop
+from asyncio import get_running_loop
+from collections.abc import Awaitable
+from collections.abc import Callable
+from dataclasses import dataclass
+from functools import cache
+from typing import TYPE_CHECKING
+from typing import TypeVar
+from uuid import uuid4
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .ratelimit import RateLimiter
+
+
+if TYPE_CHECKING:
+    import httpx
+    from openai import AsyncOpenAI
+    from openai import OpenAI
+
+
+T = TypeVar("T")
+
+# openai and httpx are only imported once a client is needed, processes that never call OpenAI
+# (migrate, celery beat, flower) do not pay for them at startup.
+_openai_client: "tuple[int, OpenAI] | None" = None
+_openai_client_lock = threading.Lock()
+_async_openai_clients: "weakref.WeakKeyDictionary[AbstractEventLoop, tuple[int, AsyncOpenAI]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def _openai_http_limits() -> "httpx.Limits":
+    import httpx
+
+    return httpx.Limits(
+        max_connections=settings.OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.OPENAI_KEEPALIVE_EXPIRY_SECONDS,
+    )
+
+
+def get_openai_client() -> "OpenAI":
+    """Get the OpenAI client of the current process, created on first use.
+
+    A client inherited through fork (celery prefork workers, gunicorn) is replaced, so processes never
+    share the sockets of a connection pool. The pool is tuned by the `settings.OPENAI_*` settings.
+
+    Returns:
+        OpenAI: the client.
+    """
+    global _openai_client  # noqa: PLW0603
+
+    pid = os.getpid()
+    with _openai_client_lock:
+        if _openai_client is None or _openai_client[0] != pid:
+            from openai import DefaultHttpxClient
+            from openai import OpenAI
+
+            http_client = DefaultHttpxClient(limits=_openai_http_limits(), http2=settings.OPENAI_HTTP2)
+            # retries are left to the shared rate limiter, see `openai_call`
+            client = OpenAI(api_key=settings.OPENAI_API_KEY, http_client=http_client, max_retries=0)
+            _openai_client = (pid, client)
+        return _openai_client[1]
+
+
+def get_async_openai_client() -> "AsyncOpenAI":
+    """Get the asynchronous OpenAI client of the current process bound to the running event loop.
+
+    Returns:
+        AsyncOpenAI: the client, created on first use like `get_openai_client`.
+    """
+    loop = get_running_loop()
+    pid = os.getpid()
+    entry = _async_openai_clients.get(loop)
+    if entry is None or entry[0] != pid:
+        from openai import AsyncOpenAI
+        from openai import DefaultAsyncHttpxClient
+
+        http_client = DefaultAsyncHttpxClient(limits=_openai_http_limits(), http2=settings.OPENAI_HTTP2)
+        entry = (pid, AsyncOpenAI(api_key=settings.OPENAI_API_KEY, http_client=http_client, max_retries=0))
+        _async_openai_clients[loop] = entry
+    return entry[1]
+
+
+@cache
+def get_openai_rate_limiter() -> RateLimiter:
+    """Get the rate limiter of the OpenAI calls configured by the `settings.OPENAI_*` rate limit settings.
+
+    Returns:
+        RateLimiter: the limiter.
+    """
+    return RateLimiter(
+        "openai",
+        requests_per_minute=settings.OPENAI_REQUESTS_PER_MINUTE,
+        tokens_per_minute=settings.OPENAI_TOKENS_PER_MINUTE,
+        min_concurrency=settings.OPENAI_MIN_CONCURRENCY,
+        max_concurrency=settings.OPENAI_MAX_CONCURRENCY,
+        lease_seconds=settings.OPENAI_LEASE_SECONDS,
+        timeout=settings.OPENAI_RATE_LIMIT_TIMEOUT_SECONDS,
+        max_retries=settings.OPENAI_MAX_RETRIES,
+        retry_base_seconds=settings.OPENAI_RETRY_BASE_SECONDS,
+        retry_max_seconds=settings.OPENAI_RETRY_MAX_SECONDS,
+        enabled=settings.OPENAI_RATE_LIMIT_ENABLED,
+    )
+
+
+def _openai_overload_errors() -> tuple[type[Exception], ...]:
+    from openai import APIConnectionError
+    from openai import InternalServerError
+    from openai import RateLimitError
+
+    return (RateLimitError, InternalServerError, APIConnectionError)
+
+
+def openai_call(fn: Callable[[], T], *, tokens: int = 0, can_retry: Callable[[], bool] | None = None) -> T:
+    """Call OpenAI through the shared rate limiter, retrying on 429, 5xx and connection errors.
+
+    Args:
+        fn (Callable[[], T]): the call.
+        tokens (int, optional): estimated tokens used by the call. Defaults to 0.
+        can_retry (Callable[[], bool] | None, optional): whether a failed call may be repeated. Defaults to always.
+
+    Returns:
+        T: the result of `fn`.
+    """
+    limiter = get_openai_rate_limiter()
+    return limiter.call(fn, tokens=tokens, retry_on=_openai_overload_errors(), can_retry=can_retry)
+
+
+async def aopenai_call(
+    fn: Callable[[], Awaitable[T]],
+    *,
+    tokens: int = 0,
+    can_retry: Callable[[], bool] | None = None,
+) -> T:
+    """Asynchronous version of `openai_call`."""
+    limiter = get_openai_rate_limiter()
+    return await limiter.acall(fn, tokens=tokens, retry_on=_openai_overload_errors(), can_retry=can_retry)
+
+
+def _estimate_chat_tokens(messages: list[dict[str, str]]) -> int:
+    # about four characters per token, plus the reply
+    return sum(len(message["content"]) for message in messages) // 4 + settings.OPENAI_REPLY_TOKEN_ESTIMATE
+
+
+class ThreadNotFoundError(Exception):
+    """The thread does not exist on the provider (anymore)."""
+
+
+@dataclass
+class RunResult:
+    """Result of running an assistant on a thread.
+
+    Attributes:
+        status (str): final status of the run, "completed" when the assistant replied.
+        text (str | None): the reply text, None if the run did not complete.
+    """
+
+    status: str
+    text: str | None
+
+
+class BaseLLMProvider(ABC):
+    """Base class of the LLM providers, the assistant/thread/run operations the chatbot is built on.
+
+    Messages are dicts with a `role` ("user" or "assistant") and a `content`.
+    """
+
+    @abstractmethod
+    def create_assistant(self, name: str, instructions: str, model: str) -> str:
+        """Create an assistant.
+
+        Args:
+            name (str): name of the assistant.
+            instructions (str): instructions of the assistant.
+            model (str): model of the assistant.
+
+        Returns:
+            str: id of the assistant.
+        """
+
+    @abstractmethod
+    async def acreate_assistant(self, name: str, instructions: str, model: str) -> str:
+        """Asynchronous version of `create_assistant`."""
+
+    @abstractmethod
+    def create_thread(self, messages: list[dict[str, str]]) -> str:
+        """Create a thread seeded with messages.
+
+        Args:
+            messages (list[dict[str, str]]): the messages, oldest first.
+
+        Returns:
+            str: id of the thread.
+        """
+
+    @abstractmethod
+    def add_message(self, thread_id: str, content: str) -> None:
+        """Add a user message to a thread.
+
+        Args:
+            thread_id (str): id of the thread.
+            content (str): text of the message.
+
+        Raises:
+            ThreadNotFoundError: the thread does not exist.
+        """
+
+    @abstractmethod
+    def run(self, assistant_id: str, thread_id: str) -> RunResult:
+        """Run an assistant on a thread and wait for its reply.
+
+        Args:
+            assistant_id (str): id of the assistant.
+            thread_id (str): id of the thread.
+
+        Returns:
+            RunResult: status and reply of the run.
+        """
+
+    @abstractmethod
+    def start_run(self, assistant_id: str, thread_id: str) -> str:
+        """Start running an assistant on a thread without waiting for its reply, see `await_run`.
+
+        Args:
+            assistant_id (str): id of the assistant.
+            thread_id (str): id of the thread.
+
+        Returns:
+            str: id of the run.
+        """
+
+    @abstractmethod
+    async def await_run(self, thread_id: str, run_id: str, poll_interval: float) -> RunResult:
+        """Wait for a run started by `start_run` to finish.
+
+        Args:
+            thread_id (str): id of the thread.
+            run_id (str): id of the run.
+            poll_interval (float): seconds between two checks of the run, for providers that poll.
+
+        Returns:
+            RunResult: status and reply of the run.
+        """
+
+    @abstractmethod
+    def stream(self, assistant_id: str, thread_id: str, on_delta: Callable[[str], None]) -> RunResult:
+        """Run an assistant on a thread, handing the reply text to `on_delta` while it is generated.
+
+        Args:
+            assistant_id (str): id of the assistant.
+            thread_id (str): id of the thread.
+            on_delta (Callable[[str], None]): called with each new piece of the reply text.
+
+        Returns:
+            RunResult: status and full reply of the run.
+        """
+
+    @abstractmethod
+    async def astream(self, assistant_id: str, thread_id: str, on_delta: Callable[[str], None]) -> RunResult:
+        """Asynchronous version of `stream`."""
+
+    @abstractmethod
+    def stream_chat(self, model: str, messages: list[dict[str, str]], on_delta: Callable[[str], None]) -> str:
+        """Complete a chat in one call, handing the reply text to `on_delta` while it is generated.
+
+        Args:
+            model (str): model to complete the chat with.
+            messages (list[dict[str, str]]): the chat, oldest first, led by a "system" message.
+            on_delta (Callable[[str], None]): called with each new piece of the reply text.
+
+        Returns:
+            str: the full reply text.
+        """
+
+
+class OpenAIProvider(BaseLLMProvider):
+    """Provider backed by the OpenAI Assistants and Chat Completions APIs.
+
+    Every call goes through `openai_call`, within the organization rate limits shared by all processes.
+    """
+
+    RUNNING_STATUSES = ("queued", "in_progress", "cancelling")
+
+    def create_assistant(self, name: str, instructions: str, model: str) -> str:  # noqa: D102
+        assistants = get_openai_client().beta.assistants
+        return openai_call(lambda: assistants.create(name=name, instructions=instructions, model=model)).id
+
+    async def acreate_assistant(self, name: str, instructions: str, model: str) -> str:  # noqa: D102
+        assistants = get_async_openai_client().beta.assistants
+        assistant = await aopenai_call(lambda: assistants.create(name=name, instructions=instructions, model=model))
+        return assistant.id
+
+    def create_thread(self, messages: list[dict[str, str]]) -> str:  # noqa: D102
+        threads = get_openai_client().beta.threads
+        return openai_call(lambda: threads.create(messages=messages)).id  # type: ignore
+
+    def add_message(self, thread_id: str, content: str) -> None:  # noqa: D102
+        from openai import NotFoundError
+
+        messages = get_openai_client().beta.threads.messages
+        try:
+            openai_call(lambda: messages.create(thread_id=thread_id, role="user", content=content))
+        except NotFoundError as e:
+            raise ThreadNotFoundError(thread_id) from e
+
+    def run(self, assistant_id: str, thread_id: str) -> RunResult:  # noqa: D102
+        client = get_openai_client()
+        # only the creation is retried as a whole, retrying the polling must not start a second run on the thread
+        run_id = self.start_run(assistant_id, thread_id)
+        run = openai_call(lambda: client.beta.threads.runs.poll(run_id, thread_id=thread_id))
+        if run.status != "completed":
+            return RunResult(status=run.status, text=None)
+
+        latest_message = openai_call(lambda: client.beta.threads.messages.list(thread_id=thread_id)).data[0]
+        return RunResult(status=run.status, text=latest_message.content[0].text.value)  # type: ignore
+
+    def start_run(self, assistant_id: str, thread_id: str) -> str:  # noqa: D102
+        runs = get_openai_client().beta.threads.runs
+        run = openai_call(
+            lambda: runs.create(assistant_id=assistant_id, thread_id=thread_id),
+            tokens=settings.OPENAI_RUN_TOKEN_ESTIMATE,
+        )
+        return run.id
+
+    async def await_run(self, thread_id: str, run_id: str, poll_interval: float) -> RunResult:  # noqa: D102
+        client = get_async_openai_client()
+        # each check takes its own lease, a waiting run does not hold one of the concurrency limit
+        while True:
+            run = await aopenai_call(lambda: client.beta.threads.runs.retrieve(run_id, thread_id=thread_id))
+            if run.status not in self.RUNNING_STATUSES:
+                break
+            await asyncio.sleep(poll_interval)
+
+        if run.status != "completed":
+            return RunResult(status=run.status, text=None)
+
+        messages = await aopenai_call(lambda: client.beta.threads.messages.list(thread_id=thread_id, run_id=run_id))
+        return RunResult(status=run.status, text=messages.data[0].content[0].text.value)  # type: ignore
+
+    def stream(self, assistant_id: str, thread_id: str, on_delta: Callable[[str], None]) -> RunResult:  # noqa: D102
+        runs = get_openai_client().beta.threads.runs
+        started = False
+
+        def stream_run() -> RunResult:
+            nonlocal started
+            with runs.stream(assistant_id=assistant_id, thread_id=thread_id) as stream:
+                for delta in stream.text_deltas:
+                    started = True
+                    on_delta(delta)
+
+                run = stream.get_final_run()
+                if run.status != "completed":
+                    return RunResult(status=run.status, text=None)
+
+                latest_message = stream.get_final_messages()[-1]
+                return RunResult(status=run.status, text=latest_message.content[0].text.value)  # type: ignore
+
+        # a run is not repeated once part of its reply was pushed to the client
+        return openai_call(stream_run, tokens=settings.OPENAI_RUN_TOKEN_ESTIMATE, can_retry=lambda: not started)
+
+    async def astream(  # noqa: D102
+        self,
+        assistant_id: str,
+        thread_id: str,
+        on_delta: Callable[[str], None],
+    ) -> RunResult:
+        runs = get_async_openai_client().beta.threads.runs
+        started = False
+
+        async def stream_run() -> RunResult:
+            nonlocal started
+            async with runs.stream(assistant_id=assistant_id, thread_id=thread_id) as stream:
+                async for delta in stream.text_deltas:
+                    started = True
+                    on_delta(delta)
+
+                run = await stream.get_final_run()
+                if run.status != "completed":
+                    return RunResult(status=run.status, text=None)
+
+                latest_message = (await stream.get_final_messages())[-1]
+                return RunResult(status=run.status, text=latest_message.content[0].text.value)  # type: ignore
+
+        return await aopenai_call(stream_run, tokens=settings.OPENAI_RUN_TOKEN_ESTIMATE, can_retry=lambda: not started)
+
+    def stream_chat(  # noqa: D102
+        self,
+        model: str,
+        messages: list[dict[str, str]],
+        on_delta: Callable[[str], None],
+    ) -> str:
+        completions = get_openai_client().chat.completions
+        parts = []
+
+        def stream_completion() -> str:
+            chunks = completions.create(model=model, messages=messages, stream=True)  # type: ignore
+            for chunk in chunks:
+                if chunk.choices and (delta := chunk.choices[0].delta.content):
+                    parts.append(delta)
+                    on_delta(delta)
+            return "".join(parts)
+
+        return openai_call(stream_completion, tokens=_estimate_chat_tokens(messages), can_retry=lambda: not parts)
+
+
+class FakeLLMProvider(BaseLLMProvider):
+    """Deterministic in-process provider for load tests and offline runs, no network and no tokens spent.
+
+    Every call waits `settings.LLM_FAKE_LATENCY_SECONDS`, replies are `settings.LLM_FAKE_REPLY_TOKENS` words
+    derived from the last user message and are generated at `settings.LLM_FAKE_TOKENS_PER_SECOND`.
+    Threads only live in the memory of the process that created them.
+    """
+
+    WORDS = ("lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing", "elit", "sed", "do")
+
+    def __init__(self) -> None:
+        """Start without threads or runs, with the latency and speed of the LLM_FAKE_* settings."""
+        self.latency = settings.LLM_FAKE_LATENCY_SECONDS
+        self.token_interval = 1 / settings.LLM_FAKE_TOKENS_PER_SECOND
+        self.reply_tokens = settings.LLM_FAKE_REPLY_TOKENS
+        self.lock = threading.Lock()
+        self.threads: dict[str, list[dict[str, str]]] = {}
+        # run id -> thread id, monotonic time the reply is ready at, reply tokens
+        self.runs: dict[str, tuple[str, float, list[str]]] = {}
+
+    def _reply(self, thread_id: str) -> list[str]:
+        with self.lock:
+            messages = self.threads.get(thread_id)
+            if messages is None:
+                raise ThreadNotFoundError(thread_id)
+            return self._generate(messages)
+
+    def _generate(self, messages: list[dict[str, str]]) -> list[str]:
+        prompt = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+        seed = int.from_bytes(hashlib.sha256(prompt.encode()).digest()[:8], "big")
+        rng = random.Random(seed)  # noqa: S311
+        return [f"{rng.choice(self.WORDS)} " for _ in range(self.reply_tokens)]
+
+    def _add(self, thread_id: str, role: str, content: str) -> None:
+        with self.lock:
+            if thread_id not in self.threads:
+                raise ThreadNotFoundError(thread_id)
+            self.threads[thread_id].append({"role": role, "content": content})
+
+    def create_assistant(self, name: str, instructions: str, model: str) -> str:  # noqa: ARG002, D102
+        time.sleep(self.latency)
+        return f"fake-asst-{uuid4().hex}"
+
+    async def acreate_assistant(self, name: str, instructions: str, model: str) -> str:  # noqa: ARG002, D102
+        await asyncio.sleep(self.latency)
+        return f"fake-asst-{uuid4().hex}"
+
+    def create_thread(self, messages: list[dict[str, str]]) -> str:  # noqa: D102
+        time.sleep(self.latency)
+        thread_id = f"fake-thread-{uuid4().hex}"
+        with self.lock:
+            self.threads[thread_id] = list(messages)
+        return thread_id
+
+    def add_message(self, thread_id: str, content: str) -> None:  # noqa: D102
+        time.sleep(self.latency)
+        self._add(thread_id, "user", content)
+
+    def run(self, assistant_id: str, thread_id: str) -> RunResult:  # noqa: ARG002, D102
+        time.sleep(self.latency)
+        tokens = self._reply(thread_id)
+        time.sleep(len(tokens) * self.token_interval)
+
+        text = "".join(tokens).strip()
+        self._add(thread_id, "assistant", text)
+        return RunResult(status="completed", text=text)
+
+    def start_run(self, assistant_id: str, thread_id: str) -> str:  # noqa: ARG002, D102
+        time.sleep(self.latency)
+        tokens = self._reply(thread_id)
+        run_id = f"fake-run-{uuid4().hex}"
+        with self.lock:
+            self.runs[run_id] = (thread_id, time.monotonic() + len(tokens) * self.token_interval, tokens)
+        return run_id
+
+    async def await_run(self, thread_id: str, run_id: str, poll_interval: float) -> RunResult:  # noqa: ARG002, D102
+        with self.lock:
+            thread_id, ready_at, tokens = self.runs.pop(run_id)
+        await asyncio.sleep(self.latency + max(0, ready_at - time.monotonic()))
+
+        text = "".join(tokens).strip()
+        self._add(thread_id, "assistant", text)
+        return RunResult(status="completed", text=text)
+
+    def stream(  # noqa: D102
+        self,
+        assistant_id: str,  # noqa: ARG002
+        thread_id: str,
+        on_delta: Callable[[str], None],
+    ) -> RunResult:
+        time.sleep(self.latency)
+        tokens = self._reply(thread_id)
+        for token in tokens:
+            time.sleep(self.token_interval)
+            on_delta(token)
+
+        text = "".join(tokens).strip()
+        self._add(thread_id, "assistant", text)
+        return RunResult(status="completed", text=text)
+
+    async def astream(  # noqa: D102
+        self,
+        assistant_id: str,  # noqa: ARG002
+        thread_id: str,
+        on_delta: Callable[[str], None],
+    ) -> RunResult:
+        await asyncio.sleep(self.latency)
+        tokens = self._reply(thread_id)
+        for token in tokens:
+            await asyncio.sleep(self.token_interval)
+            on_delta(token)
+
+        text = "".join(tokens).strip()
+        self._add(thread_id, "assistant", text)
+        return RunResult(status="completed", text=text)
+
+    def stream_chat(  # noqa: D102
+        self,
+        model: str,  # noqa: ARG002
+        messages: list[dict[str, str]],
+        on_delta: Callable[[str], None],
+    ) -> str:
+        time.sleep(self.latency)
+        tokens = self._generate(messages)
+        for token in tokens:
+            time.sleep(self.token_interval)
+            on_delta(token)
+
+        return "".join(tokens).strip()
+
+
+@cache
+def get_llm_provider() -> BaseLLMProvider:
+    """Get the process wide LLM provider configured by `settings.LLM_PROVIDER_BACKEND`.
+
+    Returns:
+        BaseLLMProvider: the provider.
+    """
+    return import_string(settings.LLM_PROVIDER_BACKEND)()
@@ -0,0 +1,348 @@
+import asyncio
+import random
+import threading
+import time
+from collections.abc import Awaitable
+from collections.abc import Callable
+from typing import Any
+from typing import TypeVar
+from uuid import uuid4
+
+from .broker import get_async_redis_client
+from .broker import get_redis_client
+
+
+T = TypeVar("T")
+
+# Both buckets refill continuously up to their per minute capacity. Returns "0" and takes one request
+# and ARGV[3] tokens when both have enough, otherwise the seconds to wait before trying again.
+TOKEN_BUCKET_SCRIPT = """
+local now = redis.call("TIME")
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+
+local function refill(key, per_minute)
+    local state = redis.call("HMGET", key, "level", "updated_at")
+    local level = tonumber(state[1]) or per_minute
+    local updated_at = tonumber(state[2]) or now
+    return math.min(per_minute, level + (now - updated_at) * per_minute / 60)
+end
+
+local requests_per_minute, tokens_per_minute = tonumber(ARGV[1]), tonumber(ARGV[2])
+-- a request larger than the bucket waits for a full bucket instead of forever
+local cost = math.min(tonumber(ARGV[3]), tokens_per_minute)
+local requests = refill(KEYS[1], requests_per_minute)
+local tokens = refill(KEYS[2], tokens_per_minute)
+
+local wait = 0
+if requests < 1 then
+    wait = math.max(wait, (1 - requests) * 60 / requests_per_minute)
+end
+if tokens < cost then
+    wait = math.max(wait, (cost - tokens) * 60 / tokens_per_minute)
+end
+if wait == 0 then
+    requests = requests - 1
+    tokens = tokens - cost
+end
+
+redis.call("HSET", KEYS[1], "level", requests, "updated_at", now)
+redis.call("HSET", KEYS[2], "level", tokens, "updated_at", now)
+redis.call("EXPIRE", KEYS[1], 120)
+redis.call("EXPIRE", KEYS[2], 120)
+return tostring(wait)
+"""  # noqa: S105
+
+# Takes a concurrency lease expiring after ARGV[2] seconds when fewer leases than the current AIMD limit
+# are held, leases of crashed callers expire on their own. Returns 1 when the lease was taken.
+LEASE_SCRIPT = """
+local now = redis.call("TIME")
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+
+redis.call("ZREMRANGEBYSCORE", KEYS[1], "-inf", now)
+local limit = tonumber(redis.call("HGET", KEYS[2], "limit")) or tonumber(ARGV[3])
+if redis.call("ZCARD", KEYS[1]) >= math.max(1, math.floor(limit)) then
+    return 0
+end
+
+redis.call("ZADD", KEYS[1], now + tonumber(ARGV[2]), ARGV[1])
+redis.call("EXPIRE", KEYS[1], math.ceil(tonumber(ARGV[2])))
+return 1
+"""
+
+# Pushes back the expiry of lease ARGV[1] by ARGV[2] seconds, unless it already expired and was dropped.
+# Returns 1 when the lease was renewed.
+RENEW_LEASE_SCRIPT = """
+local now = redis.call("TIME")
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+
+if not redis.call("ZSCORE", KEYS[1], ARGV[1]) then
+    return 0
+end
+
+redis.call("ZADD", KEYS[1], now + tonumber(ARGV[2]), ARGV[1])
+redis.call("EXPIRE", KEYS[1], math.ceil(tonumber(ARGV[2])))
+return 1
+"""
+
+# Additive increase by 1/limit per success (about +1 per round of calls), multiplicative decrease on
+# overload at most once per ARGV[5] seconds so a burst of failures counts as one congestion signal.
+AIMD_SCRIPT = """
+local now = redis.call("TIME")
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+
+local min_limit, max_limit = tonumber(ARGV[2]), tonumber(ARGV[3])
+local limit = tonumber(redis.call("HGET", KEYS[1], "limit")) or max_limit
+
+if ARGV[1] == "success" then
+    limit = math.min(max_limit, limit + 1 / limit)
+else
+    local decreased_at = tonumber(redis.call("HGET", KEYS[1], "decreased_at")) or 0
+    if now - decreased_at >= tonumber(ARGV[5]) then
+        limit = math.max(min_limit, limit * tonumber(ARGV[4]))
+        redis.call("HSET", KEYS[1], "decreased_at", now)
+    end
+end
+
+redis.call("HSET", KEYS[1], "limit", limit)
+return tostring(limit)
+"""
+
+
+class RateLimitTimeoutError(Exception):
+    """No capacity became available before the limiter timeout."""
+
+
+class RateLimiter:
+    """Rate limiter shared by every process through redis, for calls to a rate limited API.
+
+    Each call takes a concurrency lease, whose limit adapts AIMD style to overload errors, and then
+    one request and its estimated tokens from per minute token buckets. Overload errors are retried
+    with full jitter exponential backoff, honouring Retry-After. Leases are renewed while a call runs,
+    so long streams keep theirs, and only expire when their caller crashed.
+    """
+
+    LEASE_POLL_SECONDS = 0.1
+    DECREASE_FACTOR = 0.5
+
+    def __init__(
+        self,
+        name: str,
+        *,
+        requests_per_minute: int,
+        tokens_per_minute: int,
+        min_concurrency: int,
+        max_concurrency: int,
+        lease_seconds: float,
+        timeout: float,
+        max_retries: int,
+        retry_base_seconds: float,
+        retry_max_seconds: float,
+        enabled: bool = True,
+    ) -> None:
+        """Configure the limiter, its redis keys are prefixed by `name`.
+
+        Args:
+            name (str): name of the rate limited API, processes sharing it share the limits.
+            requests_per_minute (int): requests allowed per minute.
+            tokens_per_minute (int): tokens allowed per minute.
+            min_concurrency (int): lowest concurrency limit AIMD decreases to.
+            max_concurrency (int): highest and initial concurrency limit.
+            lease_seconds (float): expiry of a concurrency lease that is not renewed.
+            timeout (float): longest wait for capacity before `RateLimitTimeoutError`.
+            max_retries (int): retries of a call failing with an overload error.
+            retry_base_seconds (float): base of the exponential backoff.
+            retry_max_seconds (float): cap of the exponential backoff.
+            enabled (bool, optional): whether calls are limited at all. Defaults to True.
+        """
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.lease_seconds = lease_seconds
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.enabled = enabled
+
+        self.bucket_keys = [f"ratelimit:{name}:requests", f"ratelimit:{name}:tokens"]
+        self.lease_key = f"ratelimit:{name}:leases"
+        self.aimd_key = f"ratelimit:{name}:aimd"
+
+    def _token_bucket_args(self, tokens: int) -> list[Any]:
+        return [self.requests_per_minute, self.tokens_per_minute, tokens]
+
+    def _lease_args(self, lease_id: str) -> list[Any]:
+        return [lease_id, self.lease_seconds, self.max_concurrency]
+
+    def _renew_args(self, lease_id: str) -> list[Any]:
+        return [lease_id, self.lease_seconds]
+
+    def _aimd_args(self, outcome: str) -> list[Any]:
+        return [outcome, self.min_concurrency, self.max_concurrency, self.DECREASE_FACTOR, self.retry_base_seconds]
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        delay = random.uniform(0, min(self.retry_max_seconds, self.retry_base_seconds * 2**attempt))  # noqa: S311
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        try:
+            return max(delay, float(retry_after)) if retry_after else delay
+        except ValueError:
+            return delay
+
+    def _acquire(self, tokens: int) -> str:
+        client = get_redis_client()
+        deadline = time.monotonic() + self.timeout
+        lease_id = uuid4().hex
+
+        while not client.eval(LEASE_SCRIPT, 2, self.lease_key, self.aimd_key, *self._lease_args(lease_id)):
+            if time.monotonic() > deadline:
+                raise RateLimitTimeoutError(self.lease_key)
+            time.sleep(self.LEASE_POLL_SECONDS * random.uniform(0.5, 1.5))  # noqa: S311
+
+        try:
+            self._take_tokens(tokens, deadline)
+        except BaseException:
+            client.zrem(self.lease_key, lease_id)
+            raise
+
+        return lease_id
+
+    def _take_tokens(self, tokens: int, deadline: float) -> None:
+        client = get_redis_client()
+        while wait := float(client.eval(TOKEN_BUCKET_SCRIPT, 2, *self.bucket_keys, *self._token_bucket_args(tokens))):
+            if time.monotonic() + wait > deadline:
+                raise RateLimitTimeoutError(self.bucket_keys[0])
+            time.sleep(wait * random.uniform(1, 1.2))  # noqa: S311
+
+    def _renew_until(self, lease_id: str, stop: threading.Event) -> None:
+        client = get_redis_client()
+        while not stop.wait(self.lease_seconds / 3):
+            client.eval(RENEW_LEASE_SCRIPT, 1, self.lease_key, *self._renew_args(lease_id))
+
+    def _release(self, lease_id: str, outcome: str | None) -> None:
+        client = get_redis_client()
+        client.zrem(self.lease_key, lease_id)
+        if outcome is not None:
+            client.eval(AIMD_SCRIPT, 1, self.aimd_key, *self._aimd_args(outcome))
+
+    def call(
+        self,
+        fn: Callable[[], T],
+        *,
+        tokens: int = 0,
+        retry_on: tuple[type[Exception], ...] = (),
+        can_retry: Callable[[], bool] | None = None,
+    ) -> T:
+        """Call `fn` within the rate limits, retrying it on overload errors.
+
+        Args:
+            fn (Callable[[], T]): the call.
+            tokens (int, optional): estimated tokens used by the call. Defaults to 0.
+            retry_on (tuple[type[Exception], ...], optional): overload errors to back off and retry on.
+            can_retry (Callable[[], bool] | None, optional): whether a failed call may be repeated, e.g. not once
+                a stream started to be consumed. Defaults to always.
+
+        Only successes and overload errors adjust the concurrency limit, other errors say nothing about
+        the load of the API.
+
+        Raises:
+            RateLimitTimeoutError: no capacity became available before the timeout.
+
+        Returns:
+            T: the result of `fn`.
+        """
+        for attempt in range(self.max_retries + 1):
+            lease_id = self._acquire(tokens) if self.enabled else None
+            stop_renewing = threading.Event()
+            if lease_id is not None:
+                threading.Thread(target=self._renew_until, args=(lease_id, stop_renewing), daemon=True).start()
+            outcome = None
+            try:
+                result = fn()
+            except retry_on as e:
+                outcome = "overload"
+                if attempt == self.max_retries or (can_retry is not None and not can_retry()):
+                    raise
+                delay = self._backoff(attempt, e)
+            else:
+                outcome = "success"
+                return result
+            finally:
+                stop_renewing.set()
+                if lease_id is not None:
+                    self._release(lease_id, outcome)
+            time.sleep(delay)
+
+        raise AssertionError  # unreachable, the last attempt returns or raises
+
+    async def _aacquire(self, tokens: int) -> str:
+        client = get_async_redis_client()
+        deadline = time.monotonic() + self.timeout
+        lease_id = uuid4().hex
+
+        while not await client.eval(LEASE_SCRIPT, 2, self.lease_key, self.aimd_key, *self._lease_args(lease_id)):
+            if time.monotonic() > deadline:
+                raise RateLimitTimeoutError(self.lease_key)
+            await asyncio.sleep(self.LEASE_POLL_SECONDS * random.uniform(0.5, 1.5))  # noqa: S311
+
+        try:
+            await self._atake_tokens(tokens, deadline)
+        except BaseException:
+            await client.zrem(self.lease_key, lease_id)
+            raise
+
+        return lease_id
+
+    async def _atake_tokens(self, tokens: int, deadline: float) -> None:
+        client = get_async_redis_client()
+        while wait := float(
+            await client.eval(TOKEN_BUCKET_SCRIPT, 2, *self.bucket_keys, *self._token_bucket_args(tokens)),
+        ):
+            if time.monotonic() + wait > deadline:
+                raise RateLimitTimeoutError(self.bucket_keys[0])
+            await asyncio.sleep(wait * random.uniform(1, 1.2))  # noqa: S311
+
+    async def _arenew_forever(self, lease_id: str) -> None:
+        client = get_async_redis_client()
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            await client.eval(RENEW_LEASE_SCRIPT, 1, self.lease_key, *self._renew_args(lease_id))
+
+    async def _arelease(self, lease_id: str, outcome: str | None) -> None:
+        client = get_async_redis_client()
+        await client.zrem(self.lease_key, lease_id)
+        if outcome is not None:
+            await client.eval(AIMD_SCRIPT, 1, self.aimd_key, *self._aimd_args(outcome))
+
+    async def acall(
+        self,
+        fn: Callable[[], Awaitable[T]],
+        *,
+        tokens: int = 0,
+        retry_on: tuple[type[Exception], ...] = (),
+        can_retry: Callable[[], bool] | None = None,
+    ) -> T:
+        """Asynchronous version of `call`, `fn` returns an awaitable."""
+        for attempt in range(self.max_retries + 1):
+            lease_id = await self._aacquire(tokens) if self.enabled else None
+            renewing = asyncio.create_task(self._arenew_forever(lease_id)) if lease_id is not None else None
+            outcome = None
+            try:
+                result = await fn()
+            except retry_on as e:
+                outcome = "overload"
+                if attempt == self.max_retries or (can_retry is not None and not can_retry()):
+                    raise
+                delay = self._backoff(attempt, e)
+            else:
+                outcome = "success"
+                return result
+            finally:
+                if renewing is not None:
+                    renewing.cancel()
+                if lease_id is not None:
+                    await self._arelease(lease_id, outcome)
+            await asyncio.sleep(delay)
+
+        raise AssertionError  # unreachable, the last attempt returns or raises
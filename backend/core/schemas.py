@@ -1,3 +1,5 @@
+from uuid import UUID
+
 from ninja import Schema
 
 
@@ -31,6 +33,12 @@ class BaseResponseSchema(Schema):
     msg: str
 
 
+class BatchDeleteRequestSchema(Schema):
+    """Batch delete request schema."""
+
+    ids: list[UUID]
+
+
 class UserLoginResponseSchema(Schema):
     """User login response schema."""
 
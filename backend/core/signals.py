@@ -0,0 +1,49 @@
+from django.db.models import signals
+from django.db.models.base import ModelBase
+from django.dispatch import receiver
+
+from .authentication import invalidate_cached_user
+from .authentication import update_revoked_user
+from .models import User
+from .utils import invalidate_system_user
+
+
+@receiver(signals.post_save, sender=User)
+def user_post_save_signal(
+    sender: ModelBase,  # noqa: ARG001
+    instance: User,
+    update_fields: frozenset[str] | None,
+    **kwargs,  # noqa: ANN003, ARG001
+):
+    """Drop a saved user from the authentication and system user caches and refresh its revocation state.
+
+    The revocation state is left alone by saves that do not write `is_active` or `is_delete`.
+
+    Args:
+        sender (ModelBase): The model class of the sender.
+        instance (User): The instance of the user.
+        update_fields (frozenset[str] | None): The fields written, None if all were.
+        **kwargs: Additional keyword arguments.
+    """
+    invalidate_cached_user(instance.pk)
+    invalidate_system_user(instance.pk)
+    if update_fields is None or {"is_active", "is_delete"} & update_fields:
+        update_revoked_user(instance.pk, is_active=instance.is_active and not instance.is_delete)
+
+
+@receiver(signals.post_delete, sender=User)
+def user_post_delete_signal(
+    sender: ModelBase,  # noqa: ARG001
+    instance: User,
+    **kwargs,  # noqa: ANN003, ARG001
+):
+    """Drop a deleted user from the authentication and system user caches and revoke its tokens.
+
+    Args:
+        sender (ModelBase): The model class of the sender.
+        instance (User): The instance of the user.
+        **kwargs: Additional keyword arguments.
+    """
+    invalidate_cached_user(instance.pk)
+    invalidate_system_user(instance.pk)
+    update_revoked_user(instance.pk, is_active=False)
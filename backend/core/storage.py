@@ -0,0 +1,110 @@
+import shutil
+from abc import ABC
+from abc import abstractmethod
+from functools import cache
+from pathlib import Path
+from typing import BinaryIO
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class BaseStorage(ABC):
+    """Base class of the file storages, streams file objects in and out by key."""
+
+    @abstractmethod
+    def save(self, key: str, fileobj: BinaryIO) -> str:
+        """Store a file object under a key, reading it from its current position.
+
+        Args:
+            key (str): key to store the file under.
+            fileobj (BinaryIO): readable binary file object.
+
+        Returns:
+            str: the key the file was stored under.
+        """
+
+    @abstractmethod
+    def open(self, key: str) -> BinaryIO:
+        """Open a stored file for streaming reads.
+
+        Args:
+            key (str): key of the stored file.
+
+        Returns:
+            BinaryIO: readable binary file object, the caller closes it.
+        """
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        """Delete a stored file, a missing file is not an error.
+
+        Args:
+            key (str): key of the stored file.
+        """
+
+
+class S3Storage(BaseStorage):
+    """Storage backed by the `settings.AWS_S3_BUCKET_NAME` S3 bucket.
+
+    Files are sent as multipart uploads of `settings.AWS_S3_MULTIPART_CHUNK_SIZE` bytes, so only a few parts
+    are held in memory at a time no matter how large the file is.
+    """
+
+    def __init__(self) -> None:
+        """Create the S3 client from the AWS settings."""
+        self.bucket = settings.AWS_S3_BUCKET_NAME
+        self.client = boto3.client(
+            "s3",
+            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+            region_name=settings.AWS_REGION,
+        )
+        self.transfer_config = TransferConfig(
+            multipart_threshold=settings.AWS_S3_MULTIPART_CHUNK_SIZE,
+            multipart_chunksize=settings.AWS_S3_MULTIPART_CHUNK_SIZE,
+            max_concurrency=settings.AWS_S3_MAX_CONCURRENCY,
+        )
+
+    def save(self, key: str, fileobj: BinaryIO) -> str:  # noqa: D102
+        self.client.upload_fileobj(fileobj, self.bucket, key, Config=self.transfer_config)
+        return key
+
+    def open(self, key: str) -> BinaryIO:  # noqa: D102
+        return self.client.get_object(Bucket=self.bucket, Key=key)["Body"]
+
+    def delete(self, key: str) -> None:  # noqa: D102
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+
+class LocalFileSystemStorage(BaseStorage):
+    """Storage writing to `settings.LOCAL_FILE_STORAGE_ROOT`, a stand-in for S3 in local development and tests."""
+
+    def __init__(self) -> None:
+        """Store under `settings.LOCAL_FILE_STORAGE_ROOT`."""
+        self.root = Path(settings.LOCAL_FILE_STORAGE_ROOT)
+
+    def save(self, key: str, fileobj: BinaryIO) -> str:  # noqa: D102
+        path = self.root / key
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("wb") as f:
+            shutil.copyfileobj(fileobj, f)
+        return key
+
+    def open(self, key: str) -> BinaryIO:  # noqa: D102
+        return (self.root / key).open("rb")
+
+    def delete(self, key: str) -> None:  # noqa: D102
+        (self.root / key).unlink(missing_ok=True)
+
+
+@cache
+def get_file_storage() -> BaseStorage:
+    """Get the process wide storage configured by `settings.FILE_STORAGE_BACKEND`.
+
+    Returns:
+        BaseStorage: the file storage.
+    """
+    return import_string(settings.FILE_STORAGE_BACKEND)()
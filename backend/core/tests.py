@@ -1 +1,316 @@
-# Create your tests here.
+import io
+import tempfile
+import time
+from unittest import mock
+from unittest import skipUnless
+from uuid import uuid4
+
+import redis
+from django.conf import settings
+from django.core.cache import cache
+from django.test import SimpleTestCase
+from django.test import TestCase
+from django.test import override_settings
+from ninja_jwt.exceptions import AuthenticationFailed
+from ninja_jwt.tokens import AccessToken
+
+from .authentication import CustomJWTAuth
+from .authentication import CustomJWTTokenUserAuth
+from .authentication import user_cache_key
+from .broker import get_redis_client
+from .models import User
+from .ratelimit import RateLimiter
+from .ratelimit import RateLimitTimeoutError
+from .storage import LocalFileSystemStorage
+from .storage import S3Storage
+
+
+def redis_is_reachable() -> bool:
+    """Whether the redis of `settings.REDIS_URL` answers."""
+    try:
+        return redis.Redis.from_url(settings.REDIS_URL, socket_connect_timeout=1).ping()
+    except redis.RedisError:
+        return False
+
+
+class OverloadError(Exception):
+    """Stands for a 429 of the rate limited API."""
+
+
+@skipUnless(redis_is_reachable(), "needs the redis of settings.REDIS_URL")
+class RateLimiterTests(SimpleTestCase):
+    """`RateLimiter` against the redis of `settings.REDIS_URL`, each test under its own keys."""
+
+    def setUp(self) -> None:
+        """Create a limiter with short waits under a unique name."""
+        self.limiter = self.create_limiter()
+
+    def tearDown(self) -> None:
+        """Drop the redis keys of the limiter."""
+        get_redis_client().delete(*self.limiter.bucket_keys, self.limiter.lease_key, self.limiter.aimd_key)
+
+    def create_limiter(self, **kwargs: float) -> RateLimiter:
+        """Create a limiter with a unique name, overriding its defaults with `kwargs`."""
+        options = {
+            "requests_per_minute": 6000,
+            "tokens_per_minute": 60000,
+            "min_concurrency": 1,
+            "max_concurrency": 4,
+            "lease_seconds": 10,
+            "timeout": 1,
+            "max_retries": 2,
+            "retry_base_seconds": 0.01,
+            "retry_max_seconds": 0.01,
+        } | kwargs
+        return RateLimiter(f"test-{uuid4().hex}", **options)  # type: ignore
+
+    def limit(self) -> float | None:
+        """Current AIMD concurrency limit, None before the first adjustment."""
+        limit = get_redis_client().hget(self.limiter.aimd_key, "limit")
+        return float(limit) if limit is not None else None
+
+    def leases(self) -> int:
+        """Number of leases held."""
+        return get_redis_client().zcard(self.limiter.lease_key)
+
+    def test_call_returns_and_releases_its_lease(self) -> None:
+        """A successful call takes and releases one lease and keeps the limit at its maximum."""
+        self.assertEqual(self.limiter.call(self.leases), 1)
+        self.assertEqual(self.leases(), 0)
+        self.assertEqual(self.limit(), 4)
+
+    def test_overload_errors_are_retried_and_decrease_the_limit(self) -> None:
+        """Overload errors back off and retry, and halve the concurrency limit."""
+        attempts = []
+
+        def flaky() -> str:
+            attempts.append(None)
+            if len(attempts) < 3:  # noqa: PLR2004
+                raise OverloadError
+            return "done"
+
+        self.assertEqual(self.limiter.call(flaky, retry_on=(OverloadError,)), "done")
+        self.assertEqual(len(attempts), 3)
+        self.assertLess(self.limit(), 4)
+        self.assertEqual(self.leases(), 0)
+
+    def test_other_errors_are_not_retried_and_leave_the_limit(self) -> None:
+        """Errors other than overload ones are raised at once and do not count as a success."""
+        attempts = []
+
+        def failing() -> None:
+            attempts.append(None)
+            raise ValueError
+
+        with self.assertRaises(ValueError):
+            self.limiter.call(failing, retry_on=(OverloadError,))
+        self.assertEqual(len(attempts), 1)
+        self.assertIsNone(self.limit())
+        self.assertEqual(self.leases(), 0)
+
+    def test_can_retry_stops_retries(self) -> None:
+        """A call that may not be repeated raises its overload error."""
+        attempts = []
+
+        def overloaded() -> None:
+            attempts.append(None)
+            raise OverloadError
+
+        with self.assertRaises(OverloadError):
+            self.limiter.call(overloaded, retry_on=(OverloadError,), can_retry=lambda: False)
+        self.assertEqual(len(attempts), 1)
+
+    def test_lease_is_renewed_while_the_call_runs(self) -> None:
+        """A call running longer than the lease keeps it."""
+        self.limiter = self.create_limiter(lease_seconds=0.3)
+
+        def long_call() -> int:
+            time.sleep(0.6)
+            return self.limiter.call(self.leases)
+
+        # the inner call runs once the outer lease would have expired without renewal
+        self.assertEqual(self.limiter.call(long_call), 2)
+        self.assertEqual(self.leases(), 0)
+
+    def test_times_out_when_no_lease_is_free(self) -> None:
+        """A caller waits for a free lease at most `timeout` seconds."""
+        self.limiter = self.create_limiter(max_concurrency=1, timeout=0.2)
+
+        with self.assertRaises(RateLimitTimeoutError):
+            self.limiter.call(lambda: self.limiter.call(self.leases))
+        self.assertEqual(self.leases(), 0)
+
+    async def test_acall_retries_overload_errors(self) -> None:
+        """The asynchronous version retries overload errors the same way."""
+        attempts = []
+
+        async def flaky() -> str:
+            attempts.append(None)
+            if len(attempts) < 2:  # noqa: PLR2004
+                raise OverloadError
+            return "done"
+
+        self.assertEqual(await self.limiter.acall(flaky, retry_on=(OverloadError,)), "done")
+        self.assertEqual(len(attempts), 2)
+        self.assertEqual(self.leases(), 0)
+
+
+@override_settings(ALLOWED_HOSTS=["testserver"])
+class AuthenticationTests(TestCase):
+    """Cached and stateless JWT authentication, and their invalidation when users change."""
+
+    def setUp(self) -> None:
+        """Create a user with an access token, starting from an empty cache."""
+        cache.clear()
+        self.user = User.objects.create_user(email="user@example.com", password="password")  # noqa: S106
+        self.token = AccessToken.for_user(self.user)
+
+    def test_user_is_cached(self) -> None:
+        """Only the first authentication loads the user, the cached one has no password hash."""
+        with self.assertNumQueries(1):
+            CustomJWTAuth().get_user(self.token)
+        with self.assertNumQueries(0):
+            user = CustomJWTAuth().get_user(self.token)
+
+        self.assertEqual((user.pk, user.email), (self.user.pk, self.user.email))
+        self.assertNotIn("password", cache.get(user_cache_key(self.user.pk)))
+
+    def test_saving_the_user_invalidates_the_cache(self) -> None:
+        """A saved user is loaded again, a deactivated one is rejected."""
+        CustomJWTAuth().get_user(self.token)
+
+        self.user.name = "renamed"
+        self.user.save()
+        self.assertIsNone(cache.get(user_cache_key(self.user.pk)))
+        self.assertEqual(CustomJWTAuth().get_user(self.token).name, "renamed")
+
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            CustomJWTAuth().get_user(self.token)
+
+    def test_token_user_needs_no_query_and_is_revoked(self) -> None:
+        """The stateless authentication rejects the tokens of deactivated or deleted users until reactivated."""
+        with self.assertNumQueries(0):
+            self.assertEqual(str(CustomJWTTokenUserAuth().get_user(self.token).id), str(self.user.pk))
+
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            CustomJWTTokenUserAuth().get_user(self.token)
+
+        self.user.is_active = True
+        self.user.save()
+        CustomJWTTokenUserAuth().get_user(self.token)
+
+        self.user.delete()
+        with self.assertRaises(AuthenticationFailed):
+            CustomJWTTokenUserAuth().get_user(self.token)
+
+    def test_edit_user_only_writes_the_name(self) -> None:
+        """Editing through a user rebuilt from the cache does not write back its stale columns."""
+        headers = {"HTTP_AUTHORIZATION": f"Bearer {self.token}"}
+        CustomJWTAuth().get_user(self.token)
+        # deactivated without a signal, the cached user is still active
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+
+        response = self.client.put("/api/user", {"name": "renamed"}, content_type="application/json", **headers)
+
+        self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.name, "renamed")
+        self.assertFalse(self.user.is_active)
+
+
+class LocalFileSystemStorageTests(SimpleTestCase):
+    """`LocalFileSystemStorage` under a temporary `settings.LOCAL_FILE_STORAGE_ROOT`."""
+
+    def setUp(self) -> None:
+        """Create the storage under a temporary directory."""
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        with self.settings(LOCAL_FILE_STORAGE_ROOT=root.name):
+            self.storage = LocalFileSystemStorage()
+
+    def test_save_and_open(self) -> None:
+        """A file is stored under its key, creating the directories of the key."""
+        key = self.storage.save("records/user/record.txt", io.BytesIO(b"hello"))
+
+        self.assertEqual(key, "records/user/record.txt")
+        with self.storage.open(key) as f:
+            self.assertEqual(f.read(), b"hello")
+
+    def test_save_reads_from_the_current_position(self) -> None:
+        """Bytes before the position of the file object are not stored."""
+        fileobj = io.BytesIO(b"skipped|stored")
+        fileobj.seek(len(b"skipped|"))
+
+        with self.storage.open(self.storage.save("record.txt", fileobj)) as f:
+            self.assertEqual(f.read(), b"stored")
+
+    def test_delete(self) -> None:
+        """A deleted file cannot be opened, deleting it again is not an error."""
+        key = self.storage.save("record.txt", io.BytesIO(b"hello"))
+
+        self.storage.delete(key)
+        self.storage.delete(key)
+
+        with self.assertRaises(FileNotFoundError):
+            self.storage.open(key)
+
+
+@override_settings(
+    AWS_S3_BUCKET_NAME="bucket",
+    AWS_ACCESS_KEY_ID="key",
+    AWS_SECRET_ACCESS_KEY="secret",  # noqa: S106
+    AWS_REGION="us-east-1",
+    AWS_S3_MULTIPART_CHUNK_SIZE=5 * 1024 * 1024,
+    AWS_S3_MAX_CONCURRENCY=2,
+)
+class S3StorageTests(SimpleTestCase):
+    """`S3Storage` on a stubbed boto3 client."""
+
+    def setUp(self) -> None:
+        """Create the storage with a mock S3 client."""
+        with mock.patch("core.storage.boto3.client") as client:
+            self.storage = S3Storage()
+
+        client.assert_called_once_with(
+            "s3",
+            aws_access_key_id="key",
+            aws_secret_access_key="secret",  # noqa: S106
+            region_name="us-east-1",
+        )
+        self.client = client.return_value
+
+    def test_save_is_a_multipart_upload(self) -> None:
+        """The file object is streamed to the bucket in parts of `settings.AWS_S3_MULTIPART_CHUNK_SIZE`."""
+        fileobj = io.BytesIO(b"hello")
+
+        key = self.storage.save("records/user/record.txt", fileobj)
+
+        self.assertEqual(key, "records/user/record.txt")
+        self.client.upload_fileobj.assert_called_once_with(
+            fileobj,
+            "bucket",
+            "records/user/record.txt",
+            Config=self.storage.transfer_config,
+        )
+        config = self.storage.transfer_config
+        self.assertEqual(config.multipart_threshold, 5 * 1024 * 1024)
+        self.assertEqual(config.multipart_chunksize, 5 * 1024 * 1024)
+        self.assertEqual(config.max_concurrency, 2)
+
+    def test_open_streams_the_object_body(self) -> None:
+        """The body of the object is returned without reading it."""
+        body = io.BytesIO(b"hello")
+        self.client.get_object.return_value = {"Body": body}
+
+        self.assertIs(self.storage.open("record.txt"), body)
+        self.client.get_object.assert_called_once_with(Bucket="bucket", Key="record.txt")
+
+    def test_delete(self) -> None:
+        """The object is deleted from the bucket."""
+        self.storage.delete("record.txt")
+
+        self.client.delete_object.assert_called_once_with(Bucket="bucket", Key="record.txt")
@@ -1,24 +1,158 @@
+import base64
+import binascii
+import threading
 from types import ModuleType
 from uuid import UUID
 
 from django.conf import settings
+from django.contrib.auth.models import AbstractBaseUser
 from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import ValidationError
 from django.core.handlers.wsgi import WSGIRequest
 from django.db import transaction
+from django.db.models import Count
+from django.db.models import Q
 from django.db.utils import IntegrityError
 from ninja_extra import api_controller
 from ninja_extra import route
 from ninja_extra.permissions import IsAuthenticated
-from openai import OpenAI
+from pydantic import create_model
 
 from core.authentication import CustomJWTAuth
 from core.models import BaseModel
+from core.models import User
 
 from . import exceptions
 from . import schemas
 
 
-OPENAI_CLIENT = OpenAI(api_key=settings.OPENAI_API_KEY)
+_system_user: User | None = None
+_system_user_lock = threading.RLock()
+
+
+def get_system_user() -> User:
+    """Get the user the backend's own writes are attributed to.
+
+    The user with `settings.SYSTEM_USER_EMAIL` is looked up, or created without a usable password, on
+    first use and memoized for the process, see `invalidate_system_user`. The memo is only used as the
+    target of `*_by_user` foreign keys, so a stale copy is harmless as long as the row keeps its primary
+    key. Deleting and recreating the system user requires restarting the other processes.
+
+    Returns:
+        User: the system user.
+    """
+    global _system_user  # noqa: PLW0603
+
+    with _system_user_lock:
+        if _system_user is None or _system_user.email != settings.SYSTEM_USER_EMAIL:
+            try:
+                _system_user = User.objects.get(email=settings.SYSTEM_USER_EMAIL)
+            except User.DoesNotExist:
+                try:
+                    _system_user = User.objects.create_user(email=settings.SYSTEM_USER_EMAIL, name="System")
+                except IntegrityError:
+                    # created by another process in the meantime
+                    _system_user = User.objects.get(email=settings.SYSTEM_USER_EMAIL)
+        return _system_user
+
+
+def invalidate_system_user(user_id: UUID | None = None) -> None:
+    """Forget the memoized system user so the next `get_system_user` looks it up again.
+
+    Called by the user signals of this process only, other processes keep their memo.
+
+    Args:
+        user_id (UUID | None, optional): only forget it if it is this user. Defaults to None.
+    """
+    global _system_user  # noqa: PLW0603
+
+    with _system_user_lock:
+        if user_id is None or (_system_user is not None and _system_user.pk == user_id):
+            _system_user = None
+
+
+def encode_cursor(*values: object) -> str:
+    """Encode the keyset values of a row as an opaque pagination cursor.
+
+    Only the first value may contain "|", e.g. a name followed by an id.
+
+    Args:
+        *values (object): the keyset values, e.g. created_at and id.
+
+    Returns:
+        str: url-safe cursor.
+    """
+    return base64.urlsafe_b64encode("|".join(str(value) for value in values).encode()).decode()
+
+
+def decode_cursor(cursor: str, size: int) -> list[str]:
+    """Decode a pagination cursor built by `encode_cursor`.
+
+    Args:
+        cursor (str): the cursor.
+        size (int): the number of keyset values the cursor must hold.
+
+    Raises:
+        Http400BadRequestException: the cursor is malformed.
+
+    Returns:
+        list[str]: the keyset values as strings.
+    """
+    try:
+        values = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit("|", size - 1)
+    except (binascii.Error, UnicodeDecodeError) as e:
+        raise exceptions.Http400BadRequestException("Invalid cursor") from e
+
+    if len(values) != size:
+        raise exceptions.Http400BadRequestException("Invalid cursor")
+    return values
+
+
+def _check_batch_ownership(model: type[BaseModel], user: AbstractBaseUser, pks: list[UUID]) -> None:
+    """Check with a single query that all objects exist and were created by the user.
+
+    Args:
+        model (type[BaseModel]): The model of the objects.
+        user (AbstractBaseUser): The user changing the objects.
+        pks (list[UUID]): The primary keys of the objects.
+
+    Raises:
+        Http404NotFoundException: one or more objects do not exist.
+        Http403ForbiddenException: one or more objects were created by another user.
+    """
+    counts = model.objects.filter(pk__in=pks).aggregate(
+        found=Count("pk"),
+        owned=Count("pk", filter=Q(created_by_user=user)),
+    )
+    if counts["found"] != len(set(pks)):
+        raise exceptions.Http404NotFoundException
+    if counts["owned"] != counts["found"]:
+        raise exceptions.Http403ForbiddenException("You don't have permission to change one or more objects.")
+
+
+def _check_relation_ownership(
+    model: type[BaseModel],
+    user: AbstractBaseUser,
+    objs: list[BaseModel],
+    relations: tuple[str, ...],
+) -> None:
+    """Check with a single query per relation that the objects only reference objects created by the user.
+
+    Args:
+        model (type[BaseModel]): The model of the objects.
+        user (AbstractBaseUser): The user creating the objects.
+        objs (list[BaseModel]): The new objects.
+        relations (tuple[str, ...]): The foreign keys to check.
+
+    Raises:
+        Http404NotFoundException: one or more referenced objects do not exist.
+        Http403ForbiddenException: one or more referenced objects were created by another user.
+    """
+    for name in relations:
+        field = model._meta.get_field(name)  # noqa: SLF001
+        pks = list({getattr(obj, field.attname) for obj in objs} - {None})
+        if pks:
+            _check_batch_ownership(field.related_model, user, pks)  # type: ignore
 
 
 def generate_crud_controller(
@@ -26,6 +160,7 @@ def generate_crud_controller(
     model_name: str,
     controller_prefix: str,
     application_schemas: ModuleType,
+    owned_relations: tuple[str, ...] = (),
 ):
     """Generate a CRUD controller for a model.
 
@@ -34,7 +169,11 @@ def generate_crud_controller(
         model_name (str): The name of the model.
         controller_prefix (str): The prefix for the controller.
         application_schemas (ModuleType): The module containing the application schemas.
+        owned_relations (tuple[str, ...], optional): The foreign keys of created objects that must reference
+            objects created by the same user. Defaults to ().
     """
+    put_schema = getattr(application_schemas, f"Put{model_name}Schema")
+    put_batch_schema = create_model(f"PutBatch{model_name}Schema", __base__=put_schema, id=(UUID, ...))
 
     @api_controller(
         prefix_or_class=controller_prefix,
@@ -50,6 +189,8 @@ def generate_crud_controller(
             response={
                 200: getattr(application_schemas, f"Get{model_name}ResponseSchema"),
                 401: schemas.Http401UnauthorizedSchema,
+                403: schemas.Http403ForbiddenSchema,
+                404: schemas.Http404NotFoundSchema,
             },
         )
         def create(
@@ -60,7 +201,8 @@ def generate_crud_controller(
             if isinstance(request.user, AnonymousUser):
                 raise exceptions.Http401UnauthorizedException
 
-            q = self.Model(**body.dict())
+            q = self.Model(**body.dict(by_alias=True))
+            _check_relation_ownership(self.Model, request.user, [q], owned_relations)  # type: ignore
 
             try:
                 q.create(request.user)
@@ -74,6 +216,8 @@ def generate_crud_controller(
             response={
                 200: list[getattr(application_schemas, f"Get{model_name}ResponseSchema")],
                 401: schemas.Http401UnauthorizedSchema,
+                403: schemas.Http403ForbiddenSchema,
+                404: schemas.Http404NotFoundSchema,
             },
         )
         def create_batch(
@@ -84,16 +228,15 @@ def generate_crud_controller(
             if isinstance(request.user, AnonymousUser):
                 raise exceptions.Http401UnauthorizedException
 
+            objs = [self.Model(**item.dict(by_alias=True)) for item in body]
+            _check_relation_ownership(self.Model, request.user, objs, owned_relations)  # type: ignore
+
             try:
                 with transaction.atomic():
-                    created_objects = []
-
-                    for item in body:
-                        obj = self.Model(**item.dict())
-
-                        obj.create(request.user)
-                        created_objects.append(obj)
+                    created_objects = self.Model.create_batch(request.user, objs)  # type: ignore
 
+            except ValidationError as e:
+                raise exceptions.Http400BadRequestException(f"Batch operation failed: {'; '.join(e.messages)}") from e
             except IntegrityError as e:
                 raise exceptions.Http400BadRequestException(
                     "Batch operation failed: One or more records are invalid",
@@ -103,6 +246,62 @@ def generate_crud_controller(
 
             return created_objects
 
+        @route.put(
+            "/batch",
+            response={
+                200: schemas.BaseResponseSchema,
+                400: schemas.Http400BadRequestSchema,
+                401: schemas.Http401UnauthorizedSchema,
+                403: schemas.Http403ForbiddenSchema,
+                404: schemas.Http404NotFoundSchema,
+            },
+        )
+        def update_batch(
+            self,
+            request: WSGIRequest,
+            body: list[put_batch_schema],  # type: ignore
+        ) -> dict:
+            if isinstance(request.user, AnonymousUser):
+                raise exceptions.Http401UnauthorizedException
+
+            pks = [item.id for item in body]
+            if len(set(pks)) != len(pks):
+                raise exceptions.Http400BadRequestException("Batch operation failed: duplicated ids")
+
+            try:
+                with transaction.atomic():
+                    _check_batch_ownership(self.Model, request.user, pks)  # type: ignore
+                    self.Model.update_batch(
+                        request.user,  # type: ignore
+                        [self.Model(**item.dict(by_alias=True)) for item in body],
+                        list(put_schema.model_fields),
+                    )
+            except IntegrityError as e:
+                raise exceptions.Http400BadRequestException(
+                    "Batch operation failed: One or more records are invalid",
+                ) from e
+
+            return {"msg": "success"}
+
+        @route.delete(
+            "/batch",
+            response={
+                200: schemas.BaseResponseSchema,
+                401: schemas.Http401UnauthorizedSchema,
+                403: schemas.Http403ForbiddenSchema,
+                404: schemas.Http404NotFoundSchema,
+            },
+        )
+        def delete_batch(self, request: WSGIRequest, body: schemas.BatchDeleteRequestSchema) -> dict:
+            if isinstance(request.user, AnonymousUser):
+                raise exceptions.Http401UnauthorizedException
+
+            with transaction.atomic():
+                _check_batch_ownership(self.Model, request.user, body.ids)  # type: ignore
+                self.Model.delete_batch(request.user, body.ids)  # type: ignore
+
+            return {"msg": "success"}
+
         @route.get(
             "",
             response={
@@ -117,7 +316,7 @@ def generate_crud_controller(
             if isinstance(request.user, AnonymousUser):
                 raise exceptions.Http401UnauthorizedException
 
-            return self.Model.objects.filter().values()  # type: ignore
+            return self.Model.objects.filter(created_by_user=request.user).values()  # type: ignore
 
         @route.get(
             "/{pk}",
@@ -136,7 +335,7 @@ def generate_crud_controller(
             except self.Model.DoesNotExist as e:
                 raise exceptions.Http404NotFoundException from e
 
-            if q.company_id != request.user.company_id:  # type: ignore
+            if q.created_by_user_id != request.user.pk:  # type: ignore
                 raise exceptions.Http403ForbiddenException("You don't have permission to get this object.")
 
             return q
@@ -146,6 +345,7 @@ def generate_crud_controller(
             response={
                 200: schemas.BaseResponseSchema,
                 401: schemas.Http401UnauthorizedSchema,
+                403: schemas.Http403ForbiddenSchema,
                 404: schemas.Http404NotFoundSchema,
             },
         )
@@ -163,7 +363,10 @@ def generate_crud_controller(
             except self.Model.DoesNotExist as e:
                 raise exceptions.Http404NotFoundException from e
 
-            for k, v in body.dict().items():
+            if q.created_by_user_id != request.user.pk:  # type: ignore
+                raise exceptions.Http403ForbiddenException("You don't have permission to update this object.")
+
+            for k, v in body.dict(by_alias=True).items():
                 setattr(q, k, v)
 
             try:
@@ -178,6 +381,7 @@ def generate_crud_controller(
             response={
                 200: schemas.BaseResponseSchema,
                 401: schemas.Http401UnauthorizedSchema,
+                403: schemas.Http403ForbiddenSchema,
                 404: schemas.Http404NotFoundSchema,
             },
         )
@@ -185,14 +389,12 @@ def generate_crud_controller(
             if isinstance(request.user, AnonymousUser):
                 raise exceptions.Http401UnauthorizedException
 
-            company_id = request.user.company_id  # type: ignore
-
             try:
                 q = self.Model.objects.get(id=pk)
             except self.Model.DoesNotExist as e:
                 raise exceptions.Http404NotFoundException from e
 
-            if q.company_id != company_id:  # type: ignore
+            if q.created_by_user_id != request.user.pk:  # type: ignore
                 raise exceptions.Http403ForbiddenException("You don't have permission to delete this object.")
 
             q.delete(request.user)
@@ -40,6 +40,6 @@ api.register_controllers(AuthController)
 
 api.register_controllers(core_apis.UserEditController)
 
-# api.register_controllers(chatbot_apis.conversation_crud_controller)
-# api.register_controllers(chatbot_apis.message_crud_controller)
+api.register_controllers(chatbot_apis.message_crud_controller)
 api.register_controllers(chatbot_apis.ChatbotApiController)
+api.register_controllers(chatbot_apis.AsyncChatbotApiController)
@@ -11,6 +11,7 @@ from config.schemas import TokenObtainPairOutputSchema
 from config.schemas import TokenRefreshInputSchema
 from config.schemas import TokenRefreshOutputSchema
 
+from core.authentication import invalidate_cached_user
 from core.models import User
 
 
@@ -46,6 +47,7 @@ class AuthController(ControllerBase):
             last_login_ip=ip_address,
             last_login_time=login_time,
         )
+        invalidate_cached_user(user_token._user.pk)  # type: ignore # noqa: SLF001
 
         return user_token.to_response_schema()
 
@@ -52,16 +52,42 @@ DATABASES = {
         "PASSWORD": os.environ.get("POSTGRES_PASSWORD"),
     },
 }
+# rows per INSERT of the bulk create endpoints, POST /{prefix}/batch
+BULK_CREATE_BATCH_SIZE = 500
 
 # CACHES
 # ------------------------------------------------------------------------------
 # https://docs.djangoproject.com/en/dev/ref/settings/#caches
-CACHES = {
-    "default": {
-        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
-        "LOCATION": "",
-    },
-}
+# shared redis cache when CACHE_URL is set, otherwise a per-process in-memory cache (tests, one-off scripts).
+CACHE_URL = os.environ.get("CACHE_URL")
+# keys are prefixed per environment so environments can share a redis instance.
+CACHE_KEY_PREFIX = (
+    os.environ.get("CACHE_KEY_PREFIX")
+    or f"chronos-{os.environ.get('DJANGO_SETTINGS_MODULE', 'config.settings.local').rsplit('.', 1)[-1]}"
+)
+if CACHE_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": CACHE_URL,
+            "KEY_PREFIX": CACHE_KEY_PREFIX,
+            "OPTIONS": {
+                # connection pool shared by all threads of the process
+                "max_connections": int(os.environ.get("CACHE_MAX_CONNECTIONS") or 50),
+                "socket_connect_timeout": 1,
+                "socket_timeout": 1,
+                "health_check_interval": 30,
+            },
+        },
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "",
+            "KEY_PREFIX": CACHE_KEY_PREFIX,
+        },
+    }
 
 # URLS
 # ------------------------------------------------------------------------------
@@ -119,6 +145,8 @@ LOGIN_REDIRECT_URL = "admin/"
 # https://docs.djangoproject.com/en/dev/ref/settings/#login-url
 LOGIN_URL = "token/login/"
 LOGOUT_REDIRECT_URL = "admin/"
+# the user writes made by the backend on its own behalf are attributed to, created on first use
+SYSTEM_USER_EMAIL = os.environ.get("SYSTEM_USER_EMAIL") or "admin@email.com"
 
 # PASSWORDS
 # ------------------------------------------------------------------------------
@@ -417,6 +445,9 @@ CORS_ALLOWED_ORIGINS = [
 # django-cors-headers - https://github.com/adamchainz/django-cors-headers#setup
 CORS_URLS_REGEX = r"^/api/.*$"
 
+# seconds an authenticated user is cached by core.authentication.CustomJWTAuth
+AUTH_USER_CACHE_TIMEOUT = 60
+
 NINJA_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(days=1),
     "REFRESH_TOKEN_LIFETIME": timedelta(days=1),
@@ -469,9 +500,90 @@ CELERY_RESULT_SERIALIZER = "json"
 CELERY_WORKER_CANCEL_LONG_RUNNING_TASKS_ON_CONNECTION_LOSS = False
 CELERY_BEAT_SCHEDULER = "django_celery_beat.schedulers:DatabaseScheduler"
 
+REDIS_URL = os.environ.get("REDIS_URL") or CELERY_BROKER_URL
+# pub/sub used to push chatbot reply tokens and state changes,
+# "core.broker.InProcessBroker" only delivers inside one process (tests, local runs).
+MESSAGE_BROKER_BACKEND = os.environ.get("MESSAGE_BROKER_BACKEND") or "core.broker.RedisBroker"
+
 AWS_ACCESS_KEY_ID = os.environ.get("AWS_ACCESS_KEY_ID")
 AWS_SECRET_ACCESS_KEY = os.environ.get("AWS_SECRET_ACCESS_KEY")
 AWS_S3_BUCKET_NAME = os.environ.get("AWS_S3_BUCKET_NAME")
 AWS_REGION = os.environ.get("AWS_REGION")
+AWS_S3_MULTIPART_CHUNK_SIZE = 8 * 1024 * 1024
+AWS_S3_MAX_CONCURRENCY = 4
+
+# "core.storage.S3Storage", or "core.storage.LocalFileSystemStorage" writing under LOCAL_FILE_STORAGE_ROOT.
+FILE_STORAGE_BACKEND = os.environ.get("FILE_STORAGE_BACKEND") or "core.storage.S3Storage"
+LOCAL_FILE_STORAGE_ROOT = str(BASE_DIR / "static/media/storage")
 
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
+# connection pool of the OpenAI clients of each process, see core.providers.get_openai_client.
+# HTTP/2 multiplexes concurrent requests over one connection, it requires the `h2` package (httpx[http2]).
+OPENAI_MAX_CONNECTIONS = int(os.environ.get("OPENAI_MAX_CONNECTIONS") or 100)
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("OPENAI_MAX_KEEPALIVE_CONNECTIONS") or 20)
+OPENAI_KEEPALIVE_EXPIRY_SECONDS = float(os.environ.get("OPENAI_KEEPALIVE_EXPIRY_SECONDS") or 30)
+OPENAI_HTTP2 = os.environ.get("OPENAI_HTTP2") == "true"
+# rate limits of the OpenAI organization shared by every process through redis, see core.ratelimit.RateLimiter.
+# The concurrency limit adapts between the bounds, halving on 429/5xx and growing back on successes.
+OPENAI_RATE_LIMIT_ENABLED = (os.environ.get("OPENAI_RATE_LIMIT_ENABLED") or "true") == "true"
+OPENAI_REQUESTS_PER_MINUTE = int(os.environ.get("OPENAI_REQUESTS_PER_MINUTE") or 500)
+OPENAI_TOKENS_PER_MINUTE = int(os.environ.get("OPENAI_TOKENS_PER_MINUTE") or 30000)
+OPENAI_MIN_CONCURRENCY = int(os.environ.get("OPENAI_MIN_CONCURRENCY") or 1)
+OPENAI_MAX_CONCURRENCY = int(os.environ.get("OPENAI_MAX_CONCURRENCY") or 50)
+# seconds a concurrency slot is held at most, slots of crashed processes are freed after it
+OPENAI_LEASE_SECONDS = float(os.environ.get("OPENAI_LEASE_SECONDS") or 600)
+# seconds a call waits for capacity before failing
+OPENAI_RATE_LIMIT_TIMEOUT_SECONDS = float(os.environ.get("OPENAI_RATE_LIMIT_TIMEOUT_SECONDS") or 120)
+# retries of a call failing with 429/5xx or a connection error, full jitter exponential backoff
+OPENAI_MAX_RETRIES = int(os.environ.get("OPENAI_MAX_RETRIES") or 5)
+OPENAI_RETRY_BASE_SECONDS = float(os.environ.get("OPENAI_RETRY_BASE_SECONDS") or 1)
+OPENAI_RETRY_MAX_SECONDS = float(os.environ.get("OPENAI_RETRY_MAX_SECONDS") or 30)
+# tokens taken from the bucket for a reply, and for a run whose thread context is not known up front
+OPENAI_REPLY_TOKEN_ESTIMATE = int(os.environ.get("OPENAI_REPLY_TOKEN_ESTIMATE") or 500)
+OPENAI_RUN_TOKEN_ESTIMATE = int(os.environ.get("OPENAI_RUN_TOKEN_ESTIMATE") or 4000)
+
+# LLM
+# ------------------------------------------------------------------------------
+# "core.providers.OpenAIProvider", or "core.providers.FakeLLMProvider" replying offline with generated
+# text, for load tests and benchmarks.
+LLM_PROVIDER_BACKEND = os.environ.get("LLM_PROVIDER_BACKEND") or "core.providers.OpenAIProvider"
+# seconds of every fake provider call, and the rate and length of the fake replies
+LLM_FAKE_LATENCY_SECONDS = float(os.environ.get("LLM_FAKE_LATENCY_SECONDS") or 0.05)
+LLM_FAKE_TOKENS_PER_SECOND = float(os.environ.get("LLM_FAKE_TOKENS_PER_SECOND") or 50)
+LLM_FAKE_REPLY_TOKENS = int(os.environ.get("LLM_FAKE_REPLY_TOKENS") or 64)
+
+# CHATBOT
+# ------------------------------------------------------------------------------
+# "blocking" waits for the whole assistant run, "stream" pushes the reply tokens to
+# GET /chatbot/{conversation_id}/stream while the run is generating.
+CHATBOT_REPLY_MODE = os.environ.get("CHATBOT_REPLY_MODE") or "blocking"
+CHATBOT_STREAM_KEEPALIVE_SECONDS = 15
+# the reply stream ends with a "timeout" error event after this many seconds, even if the reply is still pending.
+CHATBOT_STREAM_MAX_SECONDS = int(os.environ.get("CHATBOT_STREAM_MAX_SECONDS") or 300)
+# upper bound of the page size of GET /chatbot/{conversation_id}
+CHATBOT_MESSAGE_PAGE_MAX_SIZE = 200
+# GET /chatbot/{conversation_id}/sync returns the messages changed in this window again, so rows whose
+# transaction commits after a later stamped row are not skipped. Should exceed the longest transaction.
+CHATBOT_SYNC_OVERLAP_SECONDS = 10
+# upper bound of the page size of GET /chatbot
+CHATBOT_CONVERSATION_PAGE_MAX_SIZE = 100
+# upper bound of the timeout of GET /chatbot/{conversation_id}/state/wait
+CHATBOT_STATE_WAIT_MAX_SECONDS = 55
+# create the OpenAI assistant of a new chatbot in a celery task instead of inside POST /chatbot.
+CHATBOT_DEFERRED_ASSISTANT_CREATION = os.environ.get("CHATBOT_DEFERRED_ASSISTANT_CREATION") == "true"
+# uploaded chat records are read in chunks, only the most representative turns of the target speaker
+# fitting in the (estimated) token budget are put into the assistant instructions.
+CHATBOT_RECORD_CHUNK_SIZE = 64 * 1024
+CHATBOT_RECORD_TOKEN_BUDGET = int(os.environ.get("CHATBOT_RECORD_TOKEN_BUDGET") or 8000)
+# number of stored messages replayed when an OpenAI thread is (re)built for a conversation.
+CHATBOT_THREAD_REBUILD_MESSAGES = 32
+# "ASSISTANTS" replies through an assistant run on a thread, "CHAT" with a single streamed chat completion
+# of the persona instructions and the latest CHATBOT_CHAT_HISTORY_MESSAGES messages. Conversations may
+# override it with their `reply_engine`.
+CHATBOT_REPLY_ENGINE = os.environ.get("CHATBOT_REPLY_ENGINE") or "ASSISTANTS"
+CHATBOT_CHAT_HISTORY_MESSAGES = 32
+# hand assistant runs over to the `run_reply_poller` command instead of waiting for them in the celery worker,
+# its single event loop polls (blocking mode) or streams (stream mode) up to CHATBOT_RUN_POLLER_MAX_RUNS runs at once.
+CHATBOT_RUN_POLLER = os.environ.get("CHATBOT_RUN_POLLER") == "true"
+CHATBOT_RUN_POLLER_MAX_RUNS = int(os.environ.get("CHATBOT_RUN_POLLER_MAX_RUNS") or 500)
+CHATBOT_RUN_POLL_INTERVAL_SECONDS = float(os.environ.get("CHATBOT_RUN_POLL_INTERVAL_SECONDS") or 1)